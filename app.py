@@ -1,15 +1,40 @@
 from github.GithubException import GithubException
 import os
+import sys
 import time
 import threading
 import logging
-from flask import Flask, request, jsonify
-from github import Github, UnknownObjectException
+from flask import Flask, Response, request, jsonify
+from github import InputGitTreeElement, UnknownObjectException
 import requests
 import json
-from google import genai
+import re
 import hashlib
-from queue import Queue
+import argparse
+import base64
+import calendar
+import contextvars
+import importlib.metadata
+import itertools
+import multiprocessing
+import pwd
+import shutil
+import signal
+import subprocess
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import artifacts
+import batch
+import cluster
+import credentials
+import github_budget
+import prompts
+import similarity
+import tracing
+from jobs import (HEARTBEAT_INTERVAL, NODE_LEASE_SECONDS, JobStore, JobSuperseded,
+                  LeaseLost, QueueFull, process_id)
 
 
 # Set up logging
@@ -24,39 +49,441 @@ GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 GITHUB_USER = os.getenv("GITHUB_USER")
 AIPIPE_TOKEN = os.getenv("AIPIPE_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-AIPIPE_URL = "https://aipipe.org/openrouter/v1/chat/completions"
+AIPIPE_URL = os.getenv(
+    "AIPIPE_URL", "https://aipipe.org/openrouter/v1/chat/completions")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
 # PIPE = "GEMINI"
-PIPE = "OPENAI"
+PIPE = os.getenv("PIPE", "OPENAI")
+# Round-1 briefs at least this similar (0-1) to an earlier successful task
+# are built as an update of that task's app.py. Above 1 disables reuse.
+BRIEF_REUSE_THRESHOLD = float(os.getenv("BRIEF_REUSE_THRESHOLD", "0.8"))
+# Resolve requirements.txt into a hashed requirements.lock for the generated
+# workflow (needs pip and PyPI access); "0" skips it.
+LOCK_REQUIREMENTS = os.getenv("LOCK_REQUIREMENTS", "1") != "0"
+PYPI_URL = os.getenv("PYPI_URL", "https://pypi.org")
+# Interpreter and platform the generated workflow builds on.
+WORKFLOW_PYTHON = "3.11"
+# ubuntu-latest (24.04) has glibc 2.39; listed newest first so the lock
+# pins the wheel the runner itself would pick.
+WORKFLOW_PLATFORMS = [f"manylinux_2_{minor}_x86_64" for minor in range(39, 4, -1)] + [
+    "manylinux2014_x86_64", "manylinux2010_x86_64", "manylinux1_x86_64"]
+# "actions": commit a generated deploy workflow and wait for its run.
+# "direct": run the generated `app.py --export` on the worker and push output/
+# to PAGES_BRANCH; a workflow is only generated when the export fails.
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "actions")
+PAGES_BRANCH = "gh-pages"
+# Unprivileged user the export runs as (the worker must run as root). A child
+# with the worker's own uid can read the worker's credentials from
+# /proc/<pid>/environ, so without EXPORT_USER direct mode only exports when
+# EXPORT_SAME_USER=1 accepts that risk, and otherwise falls back to Actions.
+EXPORT_USER = os.getenv("EXPORT_USER")
+EXPORT_SAME_USER = os.getenv("EXPORT_SAME_USER", "0") == "1"
+EXPORT_TIMEOUT = int(os.getenv("EXPORT_TIMEOUT", "120"))
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+EXPORT_MEMORY_BYTES = 2 * 1024 * 1024 * 1024
+# Packages a generated app needs beyond this interpreter's, one directory
+# per requirements.txt.
+EXPORT_DEPS_DIR = os.getenv(
+    "EXPORT_DEPS_DIR", os.path.join(tempfile.gettempdir(), "export-deps"))
+# Worker threads inside the web process. Set to 0 when the web tier runs
+# under gunicorn and `python app.py worker` executes the jobs instead.
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "2"))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "2"))
+# Autoscaling ceilings. Pools grow towards running + runnable jobs (one per
+# task lane) and shrink back after WORKER_IDLE_TIMEOUT idle seconds. The
+# defaults equal the minimums, i.e. fixed-size pools.
+WORKER_MAX = int(os.getenv("WORKER_MAX", str(WORKER_COUNT)))
+WORKER_MAX_PROCESSES = int(os.getenv("WORKER_MAX_PROCESSES", str(WORKER_PROCESSES)))
+WORKER_IDLE_TIMEOUT = int(os.getenv("WORKER_IDLE_TIMEOUT", "60"))
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "16"))
+# Multi-node mode: NODE_ID names this node, whose workers only run the tasks
+# it owns on the hash ring of live nodes (see jobs.py). JOB_STORE_URL points
+# at a `python app.py store` server; unset, the local JOB_DB_PATH file is used.
+NODE_ID = os.getenv("NODE_ID") or None
+JOB_STORE_URL = os.getenv("JOB_STORE_URL")
+# Rounds built in this process whose repo state is kept for the task's next
+# round, which affinity routes back here.
+TASK_CACHE_MAX = int(os.getenv("TASK_CACHE_MAX", "256"))
+JOB_POLL_INTERVAL = 2
+# /jobs/<id>/events polls the store this often and sends an SSE comment when
+# nothing changed for JOB_EVENTS_KEEPALIVE seconds, so proxies keep it open.
+JOB_EVENTS_INTERVAL = 1
+JOB_EVENTS_KEEPALIVE = 15
+# Each stream holds a web thread, so it closes after this long and the client
+# reconnects (SSE `retry:`) instead of pinning the thread for the whole job.
+JOB_EVENTS_MAX_SECONDS = int(os.getenv("JOB_EVENTS_MAX_SECONDS", "30"))
+JOB_EVENTS_RETRY_MS = 1000
 
 app = Flask(__name__)
-gh = Github(GITHUB_TOKEN)
 
+# Providers are created on first use so that importing this module (flask
+# run reloaders, tooling) stays cheap and an OpenAI-only deployment never
+# needs google.genai or a Gemini key.
+_providers_lock = threading.Lock()
+_gh_clients = {}
+_gemini_chats = {}
+_llm_pool = None
+_github_pool = None
+_provider_errors = {}
+
+_workers_lock = threading.Lock()
+_workers = []
+_workers_started = False
+_worker_limits = {"min": 0, "max": 0}
+_busy_workers = 0
+_job_store = None
+_job_available = threading.Event()
+_node_lease = {"until": 0.0}
+_task_cache_lock = threading.Lock()
+_task_cache = OrderedDict()
+# (provision_repo future, other prep futures) of the running pipeline, so
+# checkpoint() can fail the job as soon as provisioning has failed.
+_provisioning = contextvars.ContextVar("provisioning", default=None)
+
+
+def get_llm_pool():
+    """Returns the pool of AIPIPE tokens, or of Gemini keys when PIPE=GEMINI."""
+    global _llm_pool
+    if _llm_pool is None:
+        with _providers_lock:
+            if _llm_pool is None:
+                if PIPE == "GEMINI":
+                    # genai.Client() without a key reads GOOGLE_API_KEY or
+                    # application default credentials itself.
+                    _llm_pool = credentials.from_env(
+                        "gemini", "GEMINI_API_KEYS", "GEMINI_API_KEY", keyless=True)
+                else:
+                    _llm_pool = credentials.from_env("aipipe", "AIPIPE_TOKENS", "AIPIPE_TOKEN")
+    return _llm_pool
+
+
+def get_github_pool():
+    """Returns the pool of GitHub accounts, ranked by their API budgets."""
+    global _github_pool
+    if _github_pool is None:
+        with _providers_lock:
+            if _github_pool is None:
+                pool = credentials.github_from_env(
+                    quota=lambda c: github_budget.budget_for(c.secret).remaining_fraction())
+                for account in pool.credentials:
+                    github_budget.register(account.secret, account.label)
+                _github_pool = pool
+    return _github_pool
+
+
+def get_github(account=None):
+    """Returns the shared PyGithub client of an account (default: the first one)."""
+    if account is None:
+        pool = get_github_pool()
+        account = pool.credentials[0] if len(pool) else None
+    token = account.secret if account else None
+    if token not in _gh_clients:
+        with _providers_lock:
+            if token not in _gh_clients:
+                _gh_clients[token] = github_budget.github_client(token, GITHUB_API_URL)
+    return _gh_clients[token]
+
+
+def get_gemini_chat(api_key=None):
+    """Returns the Gemini chat of a key, importing google.genai on first use."""
+    if api_key not in _gemini_chats:
+        with _providers_lock:
+            if api_key not in _gemini_chats:
+                try:
+                    from google import genai
+                    client = genai.Client(api_key=api_key) if api_key else genai.Client()
+                    _gemini_chats[api_key] = client.chats.create(model="gemini-2.5-flash")
+                    _provider_errors.pop("llm", None)
+                except Exception as e:
+                    _provider_errors["llm"] = str(e)
+                    raise
+    return _gemini_chats[api_key]
+
+
+def get_job_store():
+    """Returns this process's handle on the shared job queue."""
+    global _job_store
+    if _job_store is None:
+        with _providers_lock:
+            if _job_store is None:
+                if JOB_STORE_URL:
+                    _job_store = cluster.RemoteJobStore(JOB_STORE_URL)
+                else:
+                    _job_store = JobStore(max_depth=JOB_QUEUE_MAX_DEPTH)
+    return _job_store
+
+
+def providers_status():
+    """
+    Initializes the providers needed by the selected pipe and reports whether
+    each one is usable. No network calls are made.
+    """
+    status = {}
+    try:
+        accounts = get_github_pool().credentials
+        get_github()
+        status["github"] = bool(accounts) and all(a.login for a in accounts)
+    except Exception as e:
+        _provider_errors["github"] = str(e)
+        status["github"] = False
 
-task_queue = Queue(maxsize=16)
+    try:
+        keys = get_llm_pool().credentials
+    except Exception as e:
+        _provider_errors["llm"] = str(e)
+        keys = []
+    if PIPE == "GEMINI":
+        try:
+            get_gemini_chat(keys[0].secret if keys else None)
+            status["llm"] = True
+        except Exception:
+            status["llm"] = False
+    else:
+        status["llm"] = bool(keys)
+    return status
 
-client = genai.Client()
-chat = client.chats.create(model="gemini-2.5-flash")
+
+def run_job(store, job):
+    """Runs one claimed job and records its outcome in the store."""
+    global _busy_workers
+    with _workers_lock:
+        _busy_workers += 1
+    try:
+        # Your existing function (already handles retries)
+        result = process_request(job["payload"], job_id=job["id"],
+                                 merged=job.get("merged"),
+                                 revisions=job.get("revisions"))
+        if result:
+            store.finish(job["id"], "done", result=result, worker=job.get("worker"))
+        else:
+            store.finish(job["id"], "failed", error="pipeline failed, see logs",
+                         worker=job.get("worker"))
+    except JobSuperseded as e:
+        logger.info(f"Job {job['id']} cancelled, {e}.")
+        store.supersede(job["id"], e.job_id)
+        _job_available.set()
+    except LeaseLost:
+        # Recovery requeues the job for the task's new owner.
+        logger.warning(f"Job {job['id']} abandoned: node {NODE_ID} lost its lease.")
+    except Exception as e:
+        logger.error(f"Background worker error: {e}")
+        store.finish(job["id"], "failed", error=str(e), worker=job.get("worker"))
+    finally:
+        with _workers_lock:
+            _busy_workers -= 1
+
+
+def _retire_worker():
+    """Lets an idle worker thread exit while the pool is above its minimum."""
+    with _workers_lock:
+        alive = [t for t in _workers if t.is_alive()]
+        if len(alive) <= _worker_limits["min"]:
+            return False
+        _workers.remove(threading.current_thread())
+        logger.info(f"Idle worker retired, {len(alive) - 1} left.")
+        return True
 
 
 def worker():
+    store = get_job_store()
+    worker_id = f"{process_id()}:{threading.get_ident()}"
+    idle_since = time.time()
     while True:
-        req = task_queue.get()
         try:
-            # Your existing function (already handles retries)
-            process_request(req)
+            job = store.claim(worker_id, node=NODE_ID)
         except Exception as e:
-            logger.error(f"Background worker error: {e}")
-        finally:
-            task_queue.task_done()
-
-
-for _ in range(2):  # Tune this number for your quota/environment
+            logger.error(f"Failed to claim a job: {e}")
+            job = None
+        if job is None:
+            if time.time() - idle_since > WORKER_IDLE_TIMEOUT and _retire_worker():
+                return
+            _job_available.wait(JOB_POLL_INTERVAL)
+            _job_available.clear()
+            continue
+        run_job(store, job)
+        idle_since = time.time()
+
+
+def _spawn_worker_thread():
+    # Caller holds _workers_lock.
     t = threading.Thread(target=worker)
     t.daemon = True
     t.start()
+    _workers.append(t)
+
+
+def scale_workers():
+    """
+    Resizes the worker thread pool to the busy workers plus the task lanes
+    that could start right now, within the configured min/max.
+    """
+    if not _workers_started or _worker_limits["max"] <= 0:
+        return
+    try:
+        _, runnable = get_job_store().load(node=NODE_ID)
+    except Exception as e:
+        logger.warning(f"Could not read queue load: {e}")
+        return
+    with _workers_lock:
+        _workers[:] = [t for t in _workers if t.is_alive()]
+        wanted = min(_worker_limits["max"],
+                     max(_worker_limits["min"], _busy_workers + runnable))
+        added = wanted - len(_workers)
+        for _ in range(added):
+            _spawn_worker_thread()
+    if added > 0:
+        logger.info(f"Scaled worker pool up to {wanted} threads ({runnable} runnable jobs).")
+
+
+def credential_snapshot():
+    return {"llm": get_llm_pool().snapshot(), "github": get_github_pool().snapshot()}
+
+
+def node_heartbeat(store, stats=None):
+    """Worker heartbeat that also renews this node's lease in multi-node mode."""
+    # The process id is explicit: a remote store would default to its own.
+    lease_until = store.heartbeat(process_id(), slots=_worker_limits["max"], stats=stats,
+                                  node=NODE_ID, lease=NODE_LEASE_SECONDS)
+    if lease_until:
+        # Kept on the local clock: the stored end is on the store's.
+        _node_lease["until"] = time.time() + NODE_LEASE_SECONDS
+
+
+def _heartbeat_loop():
+    store = get_job_store()
+    while True:
+        try:
+            node_heartbeat(store, stats={"github": github_budget.snapshot(),
+                                         "credentials": credential_snapshot()})
+            # GitHub's limits are per account, across every process.
+            github_budget.set_processes(len(store.live_workers()))
+            store.prune()
+        except Exception as e:
+            logger.warning(f"Worker heartbeat failed: {e}")
+        scale_workers()
+        time.sleep(HEARTBEAT_INTERVAL)
 
 
-def upsert_github_file(repo, path, content, commit_msg, branch="main"):
+def start_workers(count=WORKER_COUNT, max_count=WORKER_MAX):
+    """
+    Starts the background worker threads once per process. The pool keeps at
+    least `count` threads and autoscales up to `max_count`.
+    """
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+        if count <= 0:
+            return
+        _worker_limits.update(min=count, max=max(count, max_count))
+        store = get_job_store()
+        node_heartbeat(store)
+        store.recover_stale()
+        threading.Thread(target=_heartbeat_loop, daemon=True).start()
+        for _ in range(count):  # Tune this number for your quota/environment
+            _spawn_worker_thread()
+        logger.info(f"Started {count} background workers (max {_worker_limits['max']}).")
+
+
+@app.before_request
+def _startup():
+    # `flask run` never executes __main__, so the first request starts the
+    # workers in the serving process (and never in the reloader parent).
+    if not _workers_started:
+        start_workers()
+
+
+def worker_process_main(threads=1):
+    """Entry point of one supervised job-executor process."""
+    # Scaling happens at the process level; threads per process stay fixed.
+    start_workers(threads, max_count=threads)
+    while True:
+        time.sleep(3600)
+
+
+def supervise_workers(processes=WORKER_PROCESSES, threads=1,
+                      max_processes=WORKER_MAX_PROCESSES):
+    """
+    Runs between `processes` and `max_processes` job-executor processes,
+    scaling with queue load, restarting any that die and putting the jobs
+    they were running back in the queue.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    store = get_job_store()
+    max_processes = max(processes, max_processes)
+    children = {}
+    slots = itertools.count()
+    idle_since = {}
+    stopping = threading.Event()
+
+    def spawn(slot=None):
+        slot = next(slots) if slot is None else slot
+        proc = ctx.Process(target=worker_process_main, args=(threads,),
+                           name=f"job-worker-{slot}")
+        proc.start()
+        children[slot] = proc
+        logger.info(f"Started job worker {slot} (pid {proc.pid})")
+
+    def autoscale():
+        running, runnable = store.load(node=NODE_ID)
+        wanted = min(max_processes,
+                     max(processes, -(-(running + runnable) // threads)))
+        while len(children) < wanted:
+            spawn()
+        now = time.time()
+        for slot, proc in list(children.items()):
+            if store.is_busy(process_id(proc.pid)):
+                idle_since.pop(slot, None)
+                continue
+            idle_since.setdefault(slot, now)
+            if len(children) > wanted and now - idle_since[slot] > WORKER_IDLE_TIMEOUT:
+                logger.info(f"Retiring idle job worker {slot} (pid {proc.pid})")
+                del children[slot]
+                idle_since.pop(slot, None)
+                proc.terminate()
+                proc.join(timeout=10)
+                store.requeue_worker(process_id(proc.pid))
+
+    def stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping job workers...")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(processes):
+        spawn()
+
+    last_recovery = time.time()
+    while not stopping.is_set():
+        stopping.wait(1)
+        for slot, proc in list(children.items()):
+            if stopping.is_set() or proc.is_alive():
+                continue
+            logger.warning(
+                f"Job worker {slot} (pid {proc.pid}) exited with code {proc.exitcode}, restarting")
+            store.requeue_worker(process_id(proc.pid))
+            spawn(slot)
+        if time.time() - last_recovery > HEARTBEAT_INTERVAL:
+            store.recover_stale()
+            store.prune()
+            last_recovery = time.time()
+        if max_processes > processes and not stopping.is_set():
+            autoscale()
+
+    for proc in children.values():
+        proc.terminate()
+    for proc in children.values():
+        proc.join(timeout=10)
+        store.requeue_worker(process_id(proc.pid))
+    if NODE_ID:
+        # Hand this node's tasks to the other nodes without waiting for the lease.
+        store.release_node(NODE_ID)
+
+
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
+def upsert_github_file(repo, path, content, commit_msg, branch="main", known=None):
     """
     Upserts a file to a specific path in a GitHub repository on a given branch.
 
@@ -66,7 +493,30 @@ def upsert_github_file(repo, path, content, commit_msg, branch="main"):
         content (str): The content to write to the file.
         commit_msg (str): The commit message.
         branch (str): The name of the branch to commit to. Defaults to "main".
+        known (dict): Optional {path: blob sha} of the branch (see
+            fetch_tree_shas). Saves the lookup per file; kept up to date.
     """
+    tracing.set_attribute("path", path)
+    if known is not None:
+        try:
+            if path in known:
+                result = repo.update_file(path=path, message=commit_msg, content=content,
+                                          sha=known[path], branch=branch)
+                tracing.set_attribute("status", "updated")
+            else:
+                result = repo.create_file(path=path, message=commit_msg,
+                                          content=content, branch=branch)
+                tracing.set_attribute("status", "created")
+            known[path] = result["content"].sha
+            return result
+        except GithubException as e:
+            if e.status not in (404, 409, 422):
+                print(f"Encountered an unexpected error: {e}")
+                tracing.set_attribute("status", f"error {e.status}")
+                return None
+            # The prefetched SHA is stale; look the file up as usual.
+            logger.info(f"Stale SHA for '{path}' ({e.status}), refetching")
+            known.pop(path, None)
     try:
         # Get the file to see if it exists on the specified branch
         file = repo.get_contents(path, ref=branch)
@@ -80,6 +530,9 @@ def upsert_github_file(repo, path, content, commit_msg, branch="main"):
             branch=branch
         )
         print(f"Updated '{path}' on branch '{branch}'.")
+        tracing.set_attribute("status", "updated")
+        if known is not None:
+            known[path] = result["content"].sha
         return result
 
     except GithubException as e:
@@ -92,11 +545,15 @@ def upsert_github_file(repo, path, content, commit_msg, branch="main"):
                 branch=branch
             )
             print(f"Created '{path}' on branch '{branch}'.")
+            tracing.set_attribute("status", "created")
+            if known is not None:
+                known[path] = result["content"].sha
             return result
 
         else:
             # Re-raise other exceptions
             print(f"Encountered an unexpected error: {e}")
+            tracing.set_attribute("status", f"error {e.status}")
             return None
 
 
@@ -109,38 +566,85 @@ def get_repo_name_from_task(task):
     return f"{task}-{short_hash}"
 
 
-def llm_generate_file(prompt):
+def record_prompt_usage(call, usage):
+    """Counts prompt tokens and the share served from the provider's prompt cache."""
+    prompt_tokens, cached_tokens = prompts.usage_tokens(usage)
+    if not prompt_tokens:
+        return
+    if call is not None:
+        call.set_attribute("prompt_tokens", prompt_tokens)
+        call.set_attribute("cached_tokens", cached_tokens)
+    store = get_job_store()
+    store.incr("llm.prompt_tokens", prompt_tokens)
+    if cached_tokens:
+        store.incr("llm.cached_tokens", cached_tokens)
+
+
+def llm_generate_file(prompt, template=None):
+    """
+    Sends a prompt to the configured LLM. `template` names the prompts.py
+    template it was rendered from, recorded with its version on the call's span.
+    """
+    checkpoint()
     max_attempts = 3
     for attempt in range(1, max_attempts + 1):
+        tracing.set_attribute("retries", attempt - 1)
+        pool = get_llm_pool()
         try:
-            if PIPE == "GEMINI":
-                logger.info(f"Calling LLM for file generation with {PIPE}")
-                response = chat.send_message(prompt)
-                output = response.text
-                return output
-            else:
-                logger.info(
-                    f"Calling LLM for file generation... [Attempt {attempt}]")
-                headers = {
-                    "Authorization": f"Bearer {AIPIPE_TOKEN}",
-                    "Content-Type": "application/json"
-                }
-                payload = {
-                    "model": "openai/gpt-5-nano",
-                    "messages": [{"role": "user", "content": prompt}]
-                }
-
-                resp = requests.post(
-                    AIPIPE_URL, headers=headers, json=payload, timeout=120
-                )
-                resp.raise_for_status()  # Raise exception for bad status codes
-                logger.info(
-                    f"Received response from LLM. Status: {resp.status_code}")
-                logger.debug(f"Raw response: {resp.text[:200]}...")
+            with tracing.span("llm.request", kind=tracing.SPAN_KIND_CLIENT,
+                              pipe=PIPE, attempt=attempt,
+                              prompt_chars=len(prompt)) as call, pool.lease() as cred:
+                if call is not None:
+                    call.set_attribute("credential", cred.label)
+                    if template:
+                        call.set_attribute("prompt_template", prompts.TEMPLATES[template].key)
+                if PIPE == "GEMINI":
+                    logger.info(f"Calling LLM for file generation with {PIPE}")
+                    try:
+                        response = get_gemini_chat(cred.secret).send_message(prompt)
+                    except Exception:
+                        pool.report(cred, error=True)
+                        raise
+                    pool.report(cred)
+                    record_prompt_usage(call, getattr(response, "usage_metadata", None))
+                    output = response.text
+                    return output
+                else:
+                    logger.info(
+                        f"Calling LLM for file generation... [Attempt {attempt}]")
+                    headers = {
+                        "Authorization": f"Bearer {cred.secret}",
+                        "Content-Type": "application/json"
+                    }
+                    payload = {
+                        "model": "openai/gpt-5-nano",
+                        "messages": [{"role": "user", "content": prompt}]
+                    }
+                    if template:
+                        # Routes prompts sharing the template's prefix to the same cache.
+                        payload["prompt_cache_key"] = prompts.TEMPLATES[template].key
+
+                    try:
+                        resp = requests.post(
+                            AIPIPE_URL, headers=headers, json=payload, timeout=120
+                        )
+                    except requests.exceptions.RequestException:
+                        pool.report(cred, error=True)
+                        raise
+                    pool.observe(cred, resp.headers)
+                    pool.report(cred, status=resp.status_code,
+                                retry_after=resp.headers.get("Retry-After"))
+                    if call is not None:
+                        call.set_attribute("http.status_code", resp.status_code)
+                    resp.raise_for_status()  # Raise exception for bad status codes
+                    logger.info(
+                        f"Received response from LLM. Status: {resp.status_code}")
+                    logger.debug(f"Raw response: {resp.text[:200]}...")
 
-                response_json = resp.json()
-                output = response_json["choices"][0]["message"]["content"]
-                return output
+                    response_json = resp.json()
+                    output = response_json["choices"][0]["message"]["content"]
+                    record_prompt_usage(call, response_json.get("usage"))
+                    return output
 
         except requests.exceptions.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
@@ -161,7 +665,7 @@ def llm_generate_file(prompt):
 def llm_generate_file2(prompt):
     if PIPE == "GEMINI":
         logger.info(f"Calling LLM for file generation with {PIPE}")
-        response = chat.send_message(prompt)
+        response = get_gemini_chat().send_message(prompt)
         output = response.text
     else:
         logger.info("Calling LLM for file generation...")
@@ -199,462 +703,220 @@ def llm_generate_file2(prompt):
     return output
 
 
+@tracing.traced()
 def generate_code(brief, app_code, attachments=None, round_num=1, checks=None, output_dir="output"):
     """
     Constructs a prompt for generating a Flask app that can run as a server
     OR export static files for GitHub Pages deployment.
     """
-    attachments = attachments or []
-    checks = checks or []
-
-    checks_section = "\n".join(
-        f"- {chk}" for chk in checks) or "- None specified."
-    att_preview = "\n".join(
-        f"- {att['name']} (Preview: {att['url'][:64]}...)"
-        for att in attachments
-    ) or "- None"
-
-    sample_data_json = (
-        '{\n'
-        '  "attachments": [\n'
-        '    { "name": "sample.png", "url": "data:image/png;base64,iVBORw..." }\n'
-        '  ]\n'
-        '}'
-    )
-
-    # prompt = (
-    #     "TASK: Build an app (app.py) based on the brief and functional checks below.\n"
-    #     "By default, generate a minimal and generic Python app.\n"
-    #     "If ANY requirement, check, or brief context specifically mentions/requires 'Flask', the app MUST use Flask and follow all Flask usage conventions (setup, routing, server, context, etc.).\n"
-    #     "App must visually and functionally demonstrate every condition in the brief/checks in its static export (if required).\n"
-
-    #     "--BRIEF--\n"
-    #     f"{brief}\n\n"
-
-    #     "--- FUNCTIONAL REQUIREMENTS ---\n"
-    #     f"{checks_section}\n"
-    #     "Exclude any requirements/checks related to README or repository setup.\n"
-    #     "Ensure all imports required for the app are included.\n\n"
-
-    #     "--- ATTACHMENT HANDLING ---\n"
-    #     "At runtime, app must load attachments from repo root data.json, which has this format:\n"
-    #     f"{sample_data_json}\n"
-    #     f"Attachments to process:\n{att_preview}\n\n"
-
-    #     "--- DUAL MODE OPERATION ---\n"
-    #     "Your app must support two modes:\n"
-    #     "1. Development: Run 'python app.py' to start a Flask server on any standard port, serving pages dynamically.\n"
-    #     f"2. Static Export: Run 'python app.py --export' to generate all pages as static HTML files in '{output_dir}/', including assets and decoded files.\n"
-    #     "    - Export all required assets (CSS, JS, images, decoded attachments) so links work offline.\n"
-    #     "    - Establish an application context to run the function if flask is the backend\n"
-    #     "    - No user interaction is required; script completes after export.\n\n"
-
-    #     "--- SPECIFIC INSTRUCTIONS ---\n"
-    #     "1. Parse data.json to extract and decode all Data URIs.\n"
-    #     "2. Use attachments as required by BRIEF context.\n"
-    #     "3. Do NOT hardcode example data; always load from data.json.\n"
-    #     "4. In export mode, save all decoded binary/static files (images, etc.) to output_dir.\n"
-    #     "5. Ensure all relative links and references work in the exported static site.\n"
-    #     "6. Export CSS either inline or as separate file to output_dir, as needed for proper rendering.\n"
-    #     "7. All exported files must reside in output_dir and be referenced correctly from HTML pages.\n"
-    #     "8. The exported site must be fully self-contained and ready for GitHub Pages.\n\n"
-    #     "9. Ensure rendering github pages strictly follows FUNCTIONAL REQUIREMENTS around pages, layout, content, and features.\n"
-    #     "10. When writing any HTML, CSS, or JavaScript strings that use .format() in Python, always use double curly braces ({{ }}) for all curly braces that do not represent format placeholders. This is required for correct string formatting and to avoid runtime KeyError or ValueError.\n"
-    #     "11. **Important** : Ensure rendering github pages strictly follows FUNCTIONAL REQUIREMENTS around pages, layout, content, and features. Also, no redirects or embedded links to access app from github pages are allowed.\n"
-
-    #     "--- OUTPUT REQUIREMENT ---\n"
-    #     "Output ONLY the code for app.py. Do NOT use markdown, code fences, sample input/output, or external explanations."
-    # )
-    # if round_num == 1:
-    #     prompt = (
-    #         "TASK: Build app.py based on the BRIEF and FUNCTIONAL REQUIREMENTS below.\n"
-    #         "By default, produce a minimal, generic Python app.\n"
-    #         "If ANY requirement, check, or brief context explicitly mentions or requires 'Flask', you MUST use Flask and rigorously follow Flask conventions (setup, routing, context, dynamic server, etc.).\n"
-    #         "The exported static site must visually and functionally demonstrate EVERY condition in the brief and functional checks—no hidden logic. All outputs must be directly observable.\n\n"
-
-    #         "--BRIEF--\n"
-    #         f"{brief}\n\n"
-
-    #         "--- FUNCTIONAL REQUIREMENTS (ALL MUST BE REFLECTED IN OUTPUT) ---\n"
-    #         f"{checks_section}\n"
-    #         "Exclude any README or repository setup requirements.\n"
-    #         "Include all required imports for the app’s code.\n\n"
-
-    #         "--- ATTACHMENT HANDLING ---\n"
-    #         "At runtime, load attachments from data.json in the repo root, using this format:\n"
-    #         f"{sample_data_json}\n"
-    #         f"Attachments to process:\n{att_preview}\n\n"
-
-    #         "--- MODES OF OPERATION ---\n"
-    #         "Support BOTH modes:\n"
-    #         "1. Development: 'python app.py' starts a Flask (if required) server on any standard port, serving pages dynamically.\n"
-    #         f"2. Static Export: 'python app.py --export' generates all site pages, assets, decoded attachment files, CSS/JS/images, etc., into '{output_dir}/' so links work offline. No user interaction—script exits after export.\n"
-    #         "    - If Flask is used, correctly handle application context during export.\n\n"
-
-    #         "--- SPECIFIC INSTRUCTIONS ---\n"
-    #         "1. Parse data.json to extract and decode all Data URIs. Do NOT hardcode attachments or sample data.\n"
-    #         "2. Use attachments exactly as required by the BRIEF and functional checks.\n"
-    #         "3. In export mode, save ALL binary/static files to output_dir. Ensure HTML, images, scripts, and CSS are properly linked for the static site.\n"
-    #         "4. Export CSS either inline or as separate file to output_dir as needed for correct rendering.\n"
-    #         "5. All exported files (HTML, CSS, attachments) must reside in output_dir and be referenced correctly in the HTML.\n"
-    #         "6. Exported site must be fully self-contained, directly validating every functional requirement—no redirects, no external links required for complete inspection.\n"
-    #         "7. All code must use standard Python 3 indentation (4 spaces per level, no tabs), be free of indentation or syntax errors, and be ready to run without modification.\n\n"
-    #         "8. **Important:** Static GitHub Pages output must strictly follow FUNCTIONAL REQUIREMENTS for layout, content, pages, and features.\n"
-    #         "9. When generating any Python string containing HTML, CSS, or JS for use with .format(), always escape literal curly braces with double braces ({{ }}) except for variable placeholders. This prevents KeyError and ensures correct formatting.\n"
-    #         "10. Never include links or redirects that require navigation outside the exported static site to access app features in GitHub Pages.\n"
-    #         "11. All code must use standard Python 3 indentation (4 spaces per level, no tabs), be free of indentation or syntax errors, and be ready to run without modification.\n\n"
-
-    #         "--- OUTPUT REQUIREMENT ---\n"
-    #         "Output ONLY the complete code for app.py. No markdown, code fences, sample input/output, comments outside code, or explanations."
-    #     )
-    # else:
-    #     prompt = (
-    #         "TASK: Update ONLY the feature logic in app.py below according to the revised brief and functional checks for round 2.\n"
-    #         "Keep all other code, structure, attachments/data.json handling, export/static/dual-mode routines, and file naming exactly as-is.\n"
-    #         "You may ONLY change or add code necessary to fulfill the new logic/routes/output as described.\n"
-    #         "Do NOT modify headers, comments, initialization, dual-mode switches, export routines, or static file patterns except as required by the new brief and checks.\n"
-    #         "If using Flask, keep all existing routing/app setup and modify only route logic as needed.\n"
-    #         "Preserve all import statements, file IO, and static export patterns unless feature logic demands otherwise.\n"
-
-    #         "--ROUND 2 BRIEF--\n"
-    #         f"{brief}\n\n"
-
-    #         "--- UPDATED FUNCTIONAL REQUIREMENTS ---\n"
-    #         f"{checks_section}\n"
-    #         "All new requirements must be reflected in app logic, view output, or site content as relevant.\n"
-    #         "Preserve dependencies, attachment decoding, and dual-mode support from the previous version.\n\n"
-    #         "All code must use standard Python 3 indentation (4 spaces per level, no tabs), be free of indentation or syntax errors, and be ready to run without modification.\n\n"
-
-    #         "--PREVIOUS APP.PY CODE (START)--\n"
-    #         f"{app_code}\n"
-    #         "--PREVIOUS APP.PY CODE (END)--\n\n"
-
-    #         "--- OUTPUT REQUIREMENT ---\n"
-    #         "Output ONLY the new, full code for app.py (with the core logic updated for round 2 as above, everything else untouched). Do NOT include markdown, code fences, or explanations."
-    #     )
-
     if round_num == 1:
-        prompt = (
-            "TASK: Build app.py based on the BRIEF and FUNCTIONAL REQUIREMENTS below.\n"
-            "By default, create a minimal, generic Python app.\n"
-            "If ANY requirement, check, or brief context explicitly mentions or requires 'Flask', rigorously use Flask with correct conventions (setup, routing, context, dynamic server, etc.).\n"
-            "Exported static site must visually and functionally demonstrate EVERY condition in the brief and functional checks—no hidden logic, everything directly observable for inspection.\n"
-            "All code must be syntactically and indentation-correct Python 3 ready-to-run code (4 spaces per level, no tabs).\n\n"
-            "--BRIEF--\n"
-            f"{brief}\n\n"
-            "--- FUNCTIONAL REQUIREMENTS (ALL MUST BE REFLECTED IN OUTPUT) ---\n"
-            f"{checks_section}\n"
-            "Exclude README/repo setup requirements.\n"
-            "Include all imports required for app functionality.\n\n"
-            "--- ATTACHMENT HANDLING ---\n"
-            "At runtime, load attachments from data.json in repo root, formatted as:\n"
-            f"{sample_data_json}\n"
-            f"Attachments to process:\n{att_preview}\n\n"
-            "--- MODES OF OPERATION ---\n"
-            "Support BOTH modes:\n"
-            "1. Development: 'python app.py' starts the Flask (if required) server on any standard port for dynamic serving.\n"
-            f"2. Static Export: 'python app.py --export' generates all site pages, decoded attachments, CSS/JS/images, etc. in '{output_dir}/' for offline viewing. Script completes without user interaction.\n"
-            "    - If Flask is used, always render templates/routes via Flask (not raw Jinja) before saving HTML to output_dir in export mode.\n"
-            "    - Ensure exported HTML only contains evaluated content—no Jinja tags visible to users.\n\n"
-            "--- SPECIFIC INSTRUCTIONS ---\n"
-            "1. Parse data.json; decode all Data URIs at runtime. Do NOT hardcode attachments/sample data.\n"
-            "2. Use attachments exactly as required in brief and functional checks.\n"
-            "3. In export mode, save ALL output/binary/static files to output_dir and properly link/image/reference in HTML.\n"
-            "4. Export CSS inline or as a separate file in output_dir for proper rendering.\n"
-            "5. All exported files must reside in output_dir and be referenced correctly from HTML/pages.\n"
-            "6. Static GitHub Pages export MUST be fully self-contained and directly validate every functional requirement (no external links, redirects, or missing data).\n"
-            "7. Always use standard Python 3 indentation (4 spaces per level) and guarantee no syntax/indentation errors.\n"
-            "8. When writing Python strings containing HTML, CSS, or JS for .format(), always escape literal curly braces as double braces ({{ and }}), except for format placeholders.\n"
-            "9. Never include links or redirects outside exported static site for feature access or inspection in GitHub Pages.\n"
-            "10. Strictly render all template logic before export—do NOT save raw templates with Jinja tags to output_dir.\n"
-            "11. Do NOT display the words 'static export', 'exported', '--export', 'development mode', or other workflow/internal process keywords anywhere on the rendered pages, headings, or user-facing site text.\n"
-            "12. All visible content must reflect only the required outputs, features, data, and UX as described in the BRIEF and functional checks. Hide all implementation details from users.\n"
-            "13. - During '--export' mode, always wrap all template rendering (render_template, render_template_string) in 'with app.app_context():' \n"
-            "14. All Jinja template expressions must use only valid Jinja2 syntax—never put colons (:) inside {{ ... }}. For default values, use {{ var or 'default' }} instead of {{ var:default }}.\n"
-            "15. Ensure all template files render without any Jinja TemplateSyntaxError in Flask.\n"
-            "16. **Important** : Strictly use the brief/checks to define all visible content, features, and UX.\n\n"
-            "--- OUTPUT REQUIREMENT ---\n"
-            "Output ONLY the full code for app.py—no markdown, code fences, sample input/output, or explanations. All code must be fully runnable and free of syntax/indentation errors."
-        )
+        prompt = prompts.render("code_build", brief=brief, checks=checks or [],
+                                attachments=attachments or [], output_dir=output_dir)
+        return llm_generate_file(prompt, "code_build")
+    prompt = prompts.render("code_update", brief=brief, checks=checks or [], app_code=app_code)
+    return llm_generate_file(prompt, "code_update")
+
+
+DEPLOY_WORKFLOW_TEMPLATE = """name: Deploy static site
+
+on:
+  push:
+    branches: [main]
+    paths: [app.py]
+  workflow_dispatch:
+
+permissions:
+  contents: read
+  pages: write
+  id-token: write
+
+concurrency:
+  group: pages-${{ github.ref }}
+  cancel-in-progress: true
+
+jobs:
+  build:
+    runs-on: ubuntu-latest
+    steps:
+      - uses: actions/checkout@v4
+        with:
+          fetch-depth: 0
+      - name: Scan for secrets
+        uses: gitleaks/gitleaks-action@v2
+        env:
+          GITHUB_TOKEN: ${{ secrets.GITHUB_TOKEN }}
+      - uses: actions/setup-python@v4
+        with:
+          python-version: "__PYTHON__"
+          cache: pip
+          cache-dependency-path: __DEPS__
+      - name: Install dependencies
+        run: pip install __INSTALL_FLAGS__-r __DEPS__
+      - name: Verify data.json
+        run: test -f data.json
+      - name: Export static site
+        run: python app.py --export
+      - uses: actions/upload-pages-artifact@v4
+        with:
+          path: __OUTPUT_DIR__
+
+  deploy:
+    needs: build
+    runs-on: ubuntu-latest
+    environment:
+      name: github-pages
+      url: ${{ steps.deployment.outputs.page_url }}
+    steps:
+      - id: deployment
+        uses: actions/deploy-pages@v4
+"""
+
+
+def render_workflow_template(deps_file, output_dir="output"):
+    install_flags = "--require-hashes " if deps_file.endswith(".lock") else ""
+    return (DEPLOY_WORKFLOW_TEMPLATE
+            .replace("__PYTHON__", WORKFLOW_PYTHON)
+            .replace("__DEPS__", deps_file)
+            .replace("__INSTALL_FLAGS__", install_flags)
+            .replace("__OUTPUT_DIR__", output_dir))
+
+
+def validate_workflow(workflow, deps_file):
+    """Returns what a generated deploy.yml is missing (empty list if usable)."""
+    problems = []
+    required = {
+        "python app.py --export": "export step",
+        "actions/upload-pages-artifact": "Pages artifact upload",
+        "actions/deploy-pages": "Pages deployment",
+        "cancel-in-progress: true": "cancelling concurrency group",
+        f"-r {deps_file}": f"install from {deps_file}",
+    }
+    for needle, what in required.items():
+        if needle not in workflow:
+            problems.append(what)
+    cache_key = re.compile(
+        rf"cache-dependency-path:\s*(['\"]?){re.escape(deps_file)}\1\s*$", re.MULTILINE)
+    if not cache_key.search(workflow):
+        problems.append(f"pip cache keyed on {deps_file}")
+    if deps_file.endswith(".lock") and not any(
+            "--require-hashes" in line for line in workflow.splitlines()
+            if f"-r {deps_file}" in line):
+        problems.append(f"hash-checked install from {deps_file}")
+    try:
+        import yaml  # Optional; only used to reject unparsable output.
+    except ImportError:
+        return problems
+    try:
+        if not isinstance(yaml.safe_load(workflow), dict):
+            problems.append("YAML mapping")
+    except yaml.YAMLError as e:
+        problems.append(f"valid YAML ({e})")
+    return problems
 
-    else:
-        prompt = (
-            "TASK: Update ONLY the feature logic in app.py below based on the revised brief and functional checks for round 2.\n"
-            "Keep ALL other code—structure, attachments/data.json handling, export/static/dual-mode routines, and file naming—exactly as-is.\n"
-            "Change or add ONLY the code necessary to fulfill the new logic/routes/output per the updated requirements.\n"
-            "Do NOT modify headers, comments, initialization, dual-mode switches, export routines, or static file patterns unless mandated by the new brief/checks.\n"
-            "If using Flask, retain all existing routing/app setup and update only route logic as required.\n"
-            "Preserve all import statements, file IO, and static export mechanisms unless core logic changes require updates.\n"
-            "All code must use standard Python 3 indentation (4 spaces per level, no tabs), be free of syntax/indentation errors, and be ready to run without modification.\n\n"
-            "--ROUND 2 BRIEF--\n"
-            f"{brief}\n\n"
-            "--- UPDATED FUNCTIONAL REQUIREMENTS ---\n"
-            f"{checks_section}\n"
-            "All new requirements must be reflected in app logic, view output, or site content as needed.\n"
-            "Preserve dependencies, attachment decoding, and dual-mode support from previous version.\n\n"
-            "--PREVIOUS APP.PY CODE (START)--\n"
-            f"{app_code}\n"
-            "--PREVIOUS APP.PY CODE (END)--\n\n"
-            "--- OUTPUT REQUIREMENT ---\n"
-            "Output ONLY the new, full code for app.py (with core logic updated for round 2, all else untouched). Do NOT include markdown, code fences, or explanations. Output must be fully runnable and free of syntax/indentation errors."
-        )
 
-    return llm_generate_file(prompt)
+@tracing.traced(profile=True)
+def lock_requirements(req_txt):
+    """
+    Resolves requirements.txt for the workflow's interpreter/platform and
+    returns a pip --require-hashes lock file (every published file hash of
+    each pinned release), or None if resolution is disabled or fails.
+    """
+    if not LOCK_REQUIREMENTS:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        req_path = os.path.join(tmp, "requirements.txt")
+        report_path = os.path.join(tmp, "report.json")
+        with open(req_path, "w") as f:
+            f.write(req_txt)
+        cmd = [sys.executable, "-m", "pip", "install", "--dry-run", "--quiet",
+               "--ignore-installed", "--report", report_path,
+               "--only-binary=:all:", "--python-version", WORKFLOW_PYTHON,
+               "--implementation", "cp", "--target", os.path.join(tmp, "target"),
+               "-r", req_path]
+        cmd += [arg for platform in WORKFLOW_PLATFORMS for arg in ("--platform", platform)]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=180)
+            with open(report_path) as f:
+                report = json.load(f)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            detail = getattr(e, "stderr", "") or e
+            logger.warning(f"Could not lock requirements, using requirements.txt: {detail}")
+            tracing.set_attribute("status", "unlocked")
+            return None
+
+    lines = []
+    for item in sorted(report.get("install", []),
+                       key=lambda i: i["metadata"]["name"].lower()):
+        name, version = item["metadata"]["name"], item["metadata"]["version"]
+        hashes = set()
+        archive = item.get("download_info", {}).get("archive_info", {})
+        if "sha256" in archive.get("hashes", {}):
+            hashes.add(archive["hashes"]["sha256"])
+        try:
+            resp = requests.get(f"{PYPI_URL}/pypi/{name}/{version}/json", timeout=15)
+            resp.raise_for_status()
+            hashes.update(u["digests"]["sha256"] for u in resp.json().get("urls", []))
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logger.info(f"Using the resolved wheel hash only for {name}: {e}")
+        if not hashes:
+            logger.warning(f"No hash for {name}=={version}, using requirements.txt")
+            return None
+        lines.append(f"{name}=={version} \\\n" + " \\\n".join(
+            f"    --hash=sha256:{h}" for h in sorted(hashes)))
+    tracing.set_attribute("packages", len(lines))
+    header = (f"# Generated from requirements.txt for CPython {WORKFLOW_PYTHON} on x86_64 Linux.\n"
+              "# Install with: pip install --require-hashes -r requirements.lock\n")
+    return header + "\n".join(lines) + "\n"
 
 
-def generate_workflow(brief, code, attachments=None, checks=None, output_dir="output"):
+@tracing.traced()
+def generate_workflow(brief, code, attachments=None, checks=None, output_dir="output",
+                      deps_file="requirements.txt"):
     """
     Generates prompt for GitHub Actions workflow that exports Flask app as static site.
+    Falls back to DEPLOY_WORKFLOW_TEMPLATE when the generated YAML misses the
+    export, Pages, pip cache or concurrency settings.
     """
-    attachments = attachments or []
-    checks = checks or []
-
-    checks_section = "\n".join(
-        f"- {chk}" for chk in checks) or "- None specified."
-    att_names = "\n".join(
-        f"- {att['name']}" for att in attachments) or "- None provided."
-
-    prompt = (
-        f"TASK: Generate a GitHub Actions workflow YAML (deploy.yml) to export and deploy the Flask app below as a static site to GitHub Pages.\n\n"
-        "-- ORIGINAL APP BRIEF --\n"
-        f"{brief}\n\n"
-        "--- FUNCTIONAL REQUIREMENTS ---\n"
-        f"{checks_section}\n\n"
-        "--- REFERENCE APP CODE ---\n"
-        "Use the following app.py code as the definitive reference for runtime, environment, dependencies, data handling, commands, and output structure:\n"
-        "----- BEGIN app.py -----\n"
-        f"{code}\n"
-        "----- END app.py -----\n\n"
-        "--- CRITICAL WORKFLOW REQUIREMENTS ---\n"
-        "1. The workflow must ONLY be triggered by either:\n"
-        "    - A push to the main branch where 'app.py' was changed (created, updated, or deleted)\n"
-        "    - A manual workflow dispatch event (workflow_dispatch)\n"
-        "2. Do not trigger for changes to other files.\n"
-        "3. Set up Python 3.11+ environment as required by the code\n"
-        "4. Install all dependencies from requirements.txt (must include flask and any others required by the reference code)\n"
-        "5. Ensure data.json exists in repo root\n"
-        f"6. **CRITICAL:** Run 'python app.py --export' as defined in the reference code to generate static files to '{output_dir}/'\n"
-        f"7. Upload ONLY the '{output_dir}/' directory using actions/upload-pages-artifact@v4. Do not use any download-pages-artifact action; only use the official upload and deploy actions.\n"
-        "8. Deploy using actions/deploy-pages@v4 in a separate job\n"
-        "9. Set permissions: contents: read, pages: write, id-token: write\n"
-        "10. Use concurrency group 'pages'\n"
-        "11. Use TWO jobs: 'build' (export static files) and 'deploy' (deploy to pages)\n"
-        "12. **SECURITY CHECK:** The first build step must scan the entire repo for secrets using Gitleaks (zricethezav/gitleaks-action@v2 or latest). If secrets are found, fail the build and do not deploy.\n\n"
-        "--- EXACT STRUCTURE ---\n"
-        "Job 1 'build':\n"
-        "  - Checkout code (actions/checkout@v4)\n"
-        "  - Setup Python 3.11 (actions/setup-python@v4)\n"
-        "  - Run Gitleaks scan\n"
-        "  - Install requirements (must match those in reference app.py)\n"
-        "  - Verify data.json exists\n"
-        "  - Run: python app.py --export\n"
-        f"  - Upload '{output_dir}/' directory using actions/upload-pages-artifact@v4\n\n"
-        "Job 2 'deploy':\n"
-        "  - Needs: build\n"
-        "  - Environment: github-pages\n"
-        "  - Uses: actions/deploy-pages@v4\n\n"
-        "--- OUTPUT FORMAT ---\n"
-        "Output ONLY valid YAML for .github/workflows/deploy.yml.\n"
-        "Use only: actions/checkout@v4, actions/setup-python@v4, actions/upload-pages-artifact@v4, actions/deploy-pages@v4.\n"
-        "Do not use any download-pages-artifact step—GitHub deploy-pages will use the uploaded artifact automatically.\n"
-        "Reference only the code and requirements shown above. No markdown fences, no explanations: produce pure YAML only."
-    )
-
-    # prompt = (
-    #     f"TASK: Generate a GitHub Actions workflow YAML (deploy.yml) to export and deploy the Flask app below as a static site to GitHub Pages.\n\n"
-    #     "-- ORIGINAL APP BRIEF --\n"
-    #     f"{brief}\n\n"
-    #     "--- FUNCTIONAL REQUIREMENTS ---\n"
-    #     f"{checks_section}\n\n"
-    #     "--- REFERENCE APP CODE ---\n"
-    #     "Use the following app.py code as the definitive reference for runtime, environment, dependencies, data handling, commands, and output structure:\n"
-    #     "----- BEGIN app.py -----\n"
-    #     f"{code}\n"
-    #     "----- END app.py -----\n\n"
-    #     "--- CRITICAL WORKFLOW REQUIREMENTS ---\n"
-    #     "1. The workflow must ONLY be triggered by either:\n"
-    #     "    - A push to the main branch where 'app.py' was changed (created, updated, or deleted)\n"
-    #     "    - A manual workflow dispatch event (workflow_dispatch)\n"
-    #     "2. Do not trigger for changes to other files.\n"
-    #     "3. Set up Python 3.11+ environment as required by the code\n"
-    #     "4. Install all dependencies from requirements.txt (must include flask and any others required by the reference code)\n"
-    #     "5. Ensure data.json exists in repo root\n"
-    #     f"6. **CRITICAL:** Run 'python app.py --export' as defined in the reference code to generate static files to '{output_dir}/'\n"
-    #     f"7. Upload ONLY the '{output_dir}/' directory using actions/upload-pages-artifact@v4\n"
-    #     "8. Deploy using actions/deploy-pages@v4 in a separate job\n"
-    #     "9. Set permissions: contents: read, pages: write, id-token: write\n"
-    #     "10. Use concurrency group 'pages'\n"
-    #     "11. Use TWO jobs: 'build' (export static files) and 'deploy' (deploy to pages)\n"
-    #     "12. **SECURITY CHECK:** The first build step must scan the entire repo for secrets using Gitleaks (zricethezav/gitleaks-action@v2 or latest). If secrets are found, fail the build and do not deploy.\n\n"
-    #     "--- EXACT STRUCTURE ---\n"
-    #     "Job 1 'build':\n"
-    #     "  - Checkout code\n"
-    #     "  - Setup Python 3.11\n"
-    #     "  - Run Gitleaks scan\n"
-    #     "  - Install requirements (must match those referenced in app.py)\n"
-    #     "  - Verify data.json exists\n"
-    #     "  - Run: python app.py --export\n"
-    #     f"  - Upload '{output_dir}/' directory using actions/upload-pages-artifact@v4\n\n"
-    #     "Job 2 'deploy':\n"
-    #     "  - Needs: build\n"
-    #     "  - Environment: github-pages\n"
-    #     "  - Uses: actions/deploy-pages@v4\n\n"
-    #     "--- OUTPUT FORMAT ---\n"
-    #     "Output ONLY valid YAML for .github/workflows/deploy.yml.\n"
-    #     "Use: checkout@v4, setup-python@v4, upload-pages-artifact@v4, deploy-pages@v4, and reference only the code and requirements shown above. No markdown fences, no explanations: produce pure YAML only."
-    # )
-
-    # prompt = (
-    #     f"TASK: Generate a GitHub Actions workflow YAML (deploy.yml) to export and deploy the Flask app below as a static site to GitHub Pages.\n\n"
-    #     "-- ORIGINAL APP BRIEF --\n"
-    #     f"{brief}\n\n"
-    #     "--- FUNCTIONAL REQUIREMENTS ---\n"
-    #     f"{checks_section}\n\n"
-    #     "--- REFERENCE APP CODE ---\n"
-    #     "Use the following app.py code as the definitive reference for runtime, environment, dependencies, data handling, commands, and output structure:\n"
-    #     "----- BEGIN app.py -----\n"
-    #     f"{code}\n"
-    #     "----- END app.py -----\n\n"
-    #     "--- CRITICAL WORKFLOW REQUIREMENTS ---\n"
-    #     "1. Trigger on push to main branch and on manual dispatch\n"
-    #     "2. Set up Python 3.11+ environment as required by the code\n"
-    #     "3. Install all dependencies from requirements.txt (must include flask and any others required by the reference code)\n"
-    #     "4. Ensure data.json exists in repo root\n"
-    #     f"5. **CRITICAL:** Run 'python app.py --export' as defined in the reference code to generate static files to '{output_dir}/'\n"
-    #     f"6. Upload ONLY the '{output_dir}/' directory using actions/upload-pages-artifact@v4\n"
-    #     "7. Deploy using actions/deploy-pages@v4 in a separate job\n"
-    #     "8. Set permissions: contents: read, pages: write, id-token: write\n"
-    #     "9. Use concurrency group 'pages'\n"
-    #     "10. Use TWO jobs: 'build' (export static files) and 'deploy' (deploy to pages)\n"
-    #     "11. **SECURITY CHECK:** The first build step must scan the entire repo for secrets using Gitleaks (zricethezav/gitleaks-action@v2 or latest). If secrets are found, fail the build and do not deploy.\n\n"
-    #     "--- EXACT STRUCTURE ---\n"
-    #     "Job 1 'build':\n"
-    #     "  - Checkout code\n"
-    #     "  - Setup Python 3.11\n"
-    #     "  - Run Gitleaks scan\n"
-    #     "  - Install requirements (must match those referenced in app.py)\n"
-    #     "  - Verify data.json exists\n"
-    #     "  - Run: python app.py --export\n"
-    #     f"  - Upload '{output_dir}/' directory using actions/upload-pages-artifact@v4\n\n"
-    #     "Job 2 'deploy':\n"
-    #     "  - Needs: build\n"
-    #     "  - Environment: github-pages\n"
-    #     "  - Uses: actions/deploy-pages@v4\n\n"
-    #     "--- OUTPUT FORMAT ---\n"
-    #     "Output ONLY valid YAML for .github/workflows/deploy.yml.\n"
-    #     "Use: checkout@v4, setup-python@v4, upload-pages-artifact@v4, deploy-pages@v4, and reference only the code and requirements shown above. No markdown fences, no explanations: produce pure YAML only."
-    # )
-
-    # prompt = (
-    #     f"TASK: Generate a GitHub Actions workflow YAML to export Flask app as static site and deploy to GitHub Pages.\n\n"
-    #     "--- ORIGINAL APP BRIEF ---\n"
-    #     f"{brief}\n\n"
-    #     "--- FUNCTIONAL REQUIREMENTS ---\n"
-    #     f"{checks_section}\n\n"
-    #     "--- APP CODE CONTEXT ---\n"
-    #     f"The app is a Flask Python script (app.py) that:\n"
-    #     f"- Can run as a development server: python app.py\n"
-    #     f"- Can export static files: python app.py --export\n"
-    #     f"- Reads data from data.json in repo root\n"
-    #     f"- Processes attachments: {att_names}\n"
-    #     f"- Exports static site to '{output_dir}/' directory when run with --export flag\n\n"
-    #     "--- CRITICAL WORKFLOW REQUIREMENTS ---\n"
-    #     "1. Trigger on push to main branch and allow manual dispatch\n"
-    #     "2. Set up Python 3.11+ environment\n"
-    #     "3. Install dependencies from requirements.txt (must include flask)\n"
-    #     "4. Ensure data.json exists in repo root\n"
-    #     f"5. **CRITICAL**: Run 'python app.py --export' to generate static files in '{output_dir}/'\n"
-    #     f"6. Upload ONLY the '{output_dir}/' directory using actions/upload-pages-artifact@v4\n"
-    #     "7. Deploy using actions/deploy-pages@v4 in separate job\n"
-    #     "8. Set permissions: contents: read, pages: write, id-token: write\n"
-    #     "9. Use concurrency group 'pages'\n"
-    #     "10. Use TWO jobs: 'build' (export static files) and 'deploy' (deploy to pages)\n"
-    #     "11. **SECURITY CHECK:** The first job step MUST scan the entire repository for secrets using Gitleaks (zricethezav/gitleaks-action@v2 or latest). If gitleaks finds issues, fail the build and do not proceed to deploy.\n\n"
-    #     "--- EXACT STRUCTURE ---\n"
-    #     "Job 1 'build':\n"
-    #     "  - Checkout code\n"
-    #     "  - Setup Python 3.11\n"
-    #     "  - Run gitleak scans\n"
-    #     "  - Install requirements (flask must be included)\n"
-    #     "  - Verify data.json exists\n"
-    #     "  - Run: python app.py --export\n"
-    #     f"  - Upload '{output_dir}/' with actions/upload-pages-artifact@v4\n\n"
-    #     "Job 2 'deploy':\n"
-    #     "  - Needs: build\n"
-    #     "  - Environment: github-pages\n"
-    #     "  - Uses: actions/deploy-pages@v4\n\n"
-    #     "--- OUTPUT FORMAT ---\n"
-    #     "Generate ONLY valid YAML for .github/workflows/deploy.yml\n"
-    #     "Use: checkout@v4, setup-python@v4, upload-pages-artifact@v4, deploy-pages@v4\n"
-    #     "No markdown fences, no explanations, pure YAML only."
-    # )
-
-    return llm_generate_file(prompt)
+    prompt = prompts.render(
+        "workflow", brief=brief, checks=checks or [], code=code,
+        python_version=WORKFLOW_PYTHON, deps_file=deps_file, output_dir=output_dir,
+        install_flags="--require-hashes " if deps_file.endswith(".lock") else "")
+    workflow = llm_generate_file(prompt, "workflow")
+    problems = validate_workflow(workflow, deps_file)
+    if problems:
+        logger.warning(
+            f"Generated workflow rejected (missing {', '.join(problems)}); using template.")
+        tracing.set_attribute("status", "template")
+        return render_workflow_template(deps_file, output_dir)
+    return workflow
 
 
+@tracing.traced()
 def generate_readme(repo_name, brief, round_num, github_user, code):
-    # prompt = (
-    #     f"Write a rich README.md for the GitHub repo '{repo_name}'. "
-    #     "Ensure it is comprehensive and user-friendly."
-    #     f"Include: Summary ({brief}), setup instructions, usage, code explanation (for app.py, LICENSE, README.md) - {code} "
-    #     f"MIT License. Link to Pages: https://{github_user}.github.io/{repo_name}/. State it's AI-generated."
-    # )
-
-    prompt = (
-        f"Write a comprehensive, user-friendly README.md for the GitHub repository '{repo_name}'.\n\n"
-        "Use the following as your complete source of truth for code and features:\n"
-        "--- START app.py ---\n"
-        f"{code}\n"
-        "--- END app.py ---\n\n"
-        "--- PROJECT SUMMARY ---\n"
-        f"{brief}\n\n"
-        "--- SETUP INSTRUCTIONS ---\n"
-        "1. Outline all prerequisites required by the code, including Python version and external dependencies.\n"
-        "2. Provide steps for installing requirements and running the app (include any data.json preparation as seen in code).\n"
-        "3. Give instructions for both development (dynamic) and static export modes, and describe the --export flag if used.\n"
-        "--- USAGE GUIDE ---\n"
-        "Describe how to run the app, use its options/flags, and where the exported files will appear according to the real code provided.\n\n"
-        "--- CODE EXPLANATION ---\n"
-        "Explain the logical structure of app.py based on the code above—major components, data flow, file handling, and any non-obvious routines.\n"
-        "- Summarize the LICENSE and how it applies to this code.\n"
-        "- For README.md, state that it is AI-generated for transparency.\n\n"
-        "--- LICENSE ---\n"
-        "MIT License (brief summary of permissions and limitations).\n\n"
-        "--- LIVE DEMO LINK ---\n"
-        f"[GitHub Pages live site](https://{github_user}.github.io/{repo_name}/)\n\n"
-        "--- AI GENERATION NOTICE ---\n"
-        "End by stating that this README and the code were generated with an AI tool."
-    )
-
+    prompt = prompts.render("readme", repo_name=repo_name, github_user=github_user,
+                            brief=brief, code=code)
     logger.info("Generating README.md...")
-    return llm_generate_file(prompt)
+    return llm_generate_file(prompt, "readme")
 
 
+@tracing.traced()
 def generate_requirements(code):
-    prompt = (
-        f"For the attached code snippet, please gather and provide the requirements.txt content - {code}"
-        "Do not include built-in Python modules."
-        "List each package name and the required version (if known); otherwise, latest is fine."
-        "Output requirements.txt as plain text only—do not use code fences, markdown, or add any explanations."
-    )
+    prompt = prompts.render("requirements", code=code)
     logger.info("Generating Requirements.txt")
-    return llm_generate_file(prompt)
+    return llm_generate_file(prompt, "requirements")
 
 
+@tracing.traced()
 def generate_license():
-    prompt = (
-        "Based on FUNCTIONAL REQUIREMENTS & CHECK about license in the previous chat, create a license file."
-        " If no license check mentioned, create MIT license as default"
-        "Output license  as plain text only—do not use code fences, markdown, or add any explanations."
-    )
     logger.info("Generating LICENSE")
-    return llm_generate_file(prompt)
+    return llm_generate_file(prompts.render("license"), "license")
 
 
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
 def get_run_id_for_commit(owner, repo, commit_sha, token, workflow_filename=None):
     """Finds the GitHub Actions run ID for a specific commit."""
     # This URL filters runs by the triggering commit
-    url = f"https://api.github.com/repos/{owner}/{repo}/actions/runs"
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs"
     headers = {"Authorization": f"Bearer {token}",
                "Accept": "application/vnd.github+json"}
     params = {"head_sha": commit_sha}
@@ -665,7 +927,7 @@ def get_run_id_for_commit(owner, repo, commit_sha, token, workflow_filename=None
     # Retry a few times in case the run hasn't been created yet
     for _ in range(5):
         try:
-            resp = requests.get(url, headers=headers, params=params)
+            resp = github_budget.session().get(url, headers=headers, params=params)
             resp.raise_for_status()
             runs = resp.json().get("workflow_runs", [])
 
@@ -696,6 +958,34 @@ def get_run_id_for_commit(owner, repo, commit_sha, token, workflow_filename=None
     return None
 
 
+def _github_time(value):
+    """Epoch seconds of a GitHub ISO-8601 timestamp, or None."""
+    try:
+        return calendar.timegm(time.strptime(value, "%Y-%m-%dT%H:%M:%SZ"))
+    except (TypeError, ValueError):
+        return None
+
+
+def record_actions_duration(run_data):
+    """
+    Records how long a finished Actions run took, so the effect of the pip
+    cache and the lock file on build time shows up in /metrics.
+    """
+    started = _github_time(run_data.get("run_started_at"))
+    finished = _github_time(run_data.get("updated_at"))
+    if started is None or finished is None or finished < started:
+        return
+    duration = finished - started
+    tracing.set_attribute("actions_duration", duration)
+    try:
+        store = get_job_store()
+        store.incr("actions.runs")
+        store.incr("actions.seconds", duration)
+    except Exception as e:
+        logger.warning(f"Could not record Actions run duration: {e}")
+
+
+@tracing.traced()
 def wait_for_actions_run(owner, repo, commit_sha, token, workflow_filename=None, timeout=180):
     """Dynamically finds and waits for a GitHub Actions run to complete."""
 
@@ -704,24 +994,33 @@ def wait_for_actions_run(owner, repo, commit_sha, token, workflow_filename=None,
     if not run_id:
         return False
 
-    url = f"https://api.github.com/repos/{owner}/{repo}/actions/runs/{run_id}"
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs/{run_id}"
     headers = {"Authorization": f"Bearer {token}",
                "Accept": "application/vnd.github+json"}
     start_time = time.time()
 
     logger.info(f"Polling status for Run ID: {run_id}")
+    tracing.set_attribute("run_id", run_id)
+    poll = 0
     while time.time() - start_time < timeout:
+        poll += 1
         try:
-            resp = requests.get(url, headers=headers)
-            resp.raise_for_status()
-            run_data = resp.json()
-
-            status = run_data.get("status")
-            conclusion = run_data.get("conclusion")
+            with tracing.span("actions.poll", kind=tracing.SPAN_KIND_CLIENT,
+                              run_id=run_id, poll=poll) as poll_span:
+                resp = github_budget.session().get(url, headers=headers)
+                resp.raise_for_status()
+                run_data = resp.json()
+
+                status = run_data.get("status")
+                conclusion = run_data.get("conclusion")
+                if poll_span is not None:
+                    poll_span.set_attribute("status", status)
+                    poll_span.set_attribute("conclusion", conclusion)
 
             if status == "completed":
                 logger.info(
                     f"Workflow completed with conclusion: {conclusion}")
+                record_actions_duration(run_data)
                 return conclusion == "success"
 
             logger.info(
@@ -740,12 +1039,13 @@ def wait_for_actions_run(owner, repo, commit_sha, token, workflow_filename=None,
     return False
 
 
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
 def ensure_pages_enabled(owner, repo_name, token, max_retries=5):
     """
     Enable GitHub Pages with GitHub Actions as the source.
     Retries if needed to handle API delays.
     """
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/pages"
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo_name}/pages"
     headers = {
         "Authorization": f"Bearer {token}",
         "Accept": "application/vnd.github+json",
@@ -753,13 +1053,19 @@ def ensure_pages_enabled(owner, repo_name, token, max_retries=5):
     }
 
     # Check if Pages already exists
-    resp = requests.get(url, headers=headers)
+    resp = github_budget.session().get(url, headers=headers)
     logger.info(f"GET Pages status: {resp.status_code}")
+    tracing.set_attribute("status", resp.status_code)
 
     if resp.status_code == 200:
         pages_info = resp.json()
         logger.info(
             f"Pages already enabled. Source: {pages_info.get('source')}")
+        if pages_info.get("build_type") == "legacy":
+            # Published from PAGES_BRANCH before; hand the site back to Actions.
+            resp = github_budget.session().put(
+                url, headers=headers, json={"build_type": "workflow"})
+            logger.info(f"PUT Pages build_type workflow: {resp.status_code}")
         return True
 
     if resp.status_code == 404:
@@ -775,7 +1081,8 @@ def ensure_pages_enabled(owner, repo_name, token, max_retries=5):
         }
 
         for attempt in range(max_retries):
-            resp = requests.post(url, headers=headers, json=payload)
+            tracing.set_attribute("retries", attempt)
+            resp = github_budget.session().post(url, headers=headers, json=payload)
             logger.info(
                 f"POST Pages (attempt {attempt + 1}): {resp.status_code} - {resp.text[:200]}")
 
@@ -798,120 +1105,658 @@ def ensure_pages_enabled(owner, repo_name, token, max_retries=5):
     return False
 
 
-def process_request(req):
+# Runs the generated app with resource limits. Limits are set in the child
+# itself because preexec_fn is not safe in a threaded worker.
+SANDBOX_BOOTSTRAP = """
+import resource, runpy, sys
+cpu, memory, fsize = (int(v) for v in sys.argv[1:4])
+resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+resource.setrlimit(resource.RLIMIT_FSIZE, (fsize, fsize))
+sys.argv = ["app.py", "--export"]
+sys.path.insert(0, ".")
+runpy.run_path("app.py", run_name="__main__")
+"""
+
+
+def export_env(home, pythonpath=""):
+    """Credential-free environment for export subprocesses."""
+    return {"PATH": os.environ.get("PATH", ""), "HOME": home, "LANG": "C.UTF-8",
+            "PYTHONDONTWRITEBYTECODE": "1", "PYTHONPATH": pythonpath}
+
+
+def export_dependencies(req_txt):
+    """
+    Returns a directory holding the requirements this interpreter lacks,
+    installing them on first use, or None if nothing is missing. Only wheels
+    are installed, so no package build script runs on the worker.
+    """
+    missing = []
+    for line in req_txt.splitlines():
+        match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", line.split("#", 1)[0])
+        if not match:
+            continue
+        try:
+            importlib.metadata.version(match.group(1))
+        except importlib.metadata.PackageNotFoundError:
+            missing.append(match.group(1))
+    if not missing:
+        return None
+    target = os.path.join(
+        EXPORT_DEPS_DIR, hashlib.sha256(req_txt.encode("utf-8")).hexdigest()[:16])
+    if os.path.isdir(target):
+        return target
+    logger.info(f"Installing export dependencies: {', '.join(missing)}")
+    os.makedirs(EXPORT_DEPS_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=EXPORT_DEPS_DIR)
+    req_path = os.path.join(staging, "requirements.txt")
+    with open(req_path, "w") as f:
+        f.write(req_txt)
+    subprocess.run([sys.executable, "-m", "pip", "install", "--quiet",
+                    "--only-binary=:all:", "--no-input", "--target",
+                    os.path.join(staging, "site"), "-r", req_path],
+                   env=export_env(staging), check=True, capture_output=True,
+                   text=True, timeout=300)
+    try:
+        # Atomic, so concurrent workers never see a half-installed directory.
+        os.rename(os.path.join(staging, "site"), target)
+    except OSError:
+        pass  # Another worker installed the same requirements first.
+    shutil.rmtree(staging, ignore_errors=True)
+    return target
+
+
+@tracing.traced(profile=True)
+def export_site(code, attachments_content, req_txt):
+    """
+    Runs `python app.py --export` for the generated code in a temporary
+    directory and returns the exported output/ tree as {path: bytes}, or
+    None if the export fails or produces no index.html.
+
+    The child gets no credentials in its environment and is bounded in CPU
+    time, memory, file size and wall time; it is not network-isolated. It
+    runs as EXPORT_USER when set, else as the worker's own user, which can
+    read the worker's credentials (see EXPORT_SAME_USER).
+    """
+    try:
+        user = pwd.getpwnam(EXPORT_USER) if EXPORT_USER else None
+    except KeyError:
+        logger.warning(f"EXPORT_USER {EXPORT_USER} does not exist")
+        tracing.set_attribute("status", "no_user")
+        return None
+    with tempfile.TemporaryDirectory(prefix="export-") as tmp:
+        with open(os.path.join(tmp, "app.py"), "w") as f:
+            f.write(code)
+        with open(os.path.join(tmp, "data.json"), "w") as f:
+            f.write(attachments_content)
+        try:
+            deps_dir = export_dependencies(req_txt)
+        except (subprocess.SubprocessError, OSError) as e:
+            detail = getattr(e, "stderr", "") or e
+            logger.warning(f"Could not install export dependencies: {detail}")
+            tracing.set_attribute("status", "deps_failed")
+            return None
+        cmd = [sys.executable, "-c", SANDBOX_BOOTSTRAP, str(EXPORT_TIMEOUT),
+               str(EXPORT_MEMORY_BYTES), str(EXPORT_MAX_BYTES)]
+        run_as = {}
+        try:
+            if user is not None:
+                os.chown(tmp, user.pw_uid, user.pw_gid)
+                run_as = {"user": user.pw_uid, "group": user.pw_gid, "extra_groups": []}
+            proc = subprocess.run(cmd, cwd=tmp, env=export_env(tmp, deps_dir or ""),
+                                  capture_output=True, text=True, timeout=EXPORT_TIMEOUT,
+                                  start_new_session=True, **run_as)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Export timed out after {EXPORT_TIMEOUT}s")
+            tracing.set_attribute("status", "timeout")
+            return None
+        except OSError as e:  # Switching to EXPORT_USER needs root.
+            logger.warning(f"Could not start the export as {EXPORT_USER}: {e}")
+            tracing.set_attribute("status", "failed")
+            return None
+        if proc.returncode != 0:
+            logger.warning(f"Export exited with {proc.returncode}: {proc.stderr[-2000:]}")
+            tracing.set_attribute("status", "failed")
+            return None
+
+        output_dir = os.path.join(tmp, "output")
+        files, total = {}, 0
+        for root, _, names in os.walk(output_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    continue  # Never publish files from outside the sandbox.
+                with open(path, "rb") as f:
+                    data = f.read()
+                total += len(data)
+                if total > EXPORT_MAX_BYTES:
+                    logger.warning(f"Export is larger than {EXPORT_MAX_BYTES} bytes")
+                    tracing.set_attribute("status", "too_large")
+                    return None
+                files[os.path.relpath(path, output_dir).replace(os.sep, "/")] = data
+    tracing.set_attribute("files", len(files))
+    tracing.set_attribute("bytes", total)
+    if "index.html" not in files:
+        logger.warning("Export produced no output/index.html")
+        tracing.set_attribute("status", "no_index")
+        return None
+    tracing.set_attribute("status", "exported")
+    return files
+
+
+def publish_pages_branch(repo, files, message):
+    """
+    Commits `files` as the whole tree of PAGES_BRANCH with the git data API:
+    one tree and one commit however many files there are. Returns the
+    branch's commit SHA (unchanged if the tree is identical).
+    """
+    elements = [InputGitTreeElement(".nojekyll", "100644", "blob", content="")]
+    for path, data in sorted(files.items()):
+        try:
+            elements.append(InputGitTreeElement(
+                path, "100644", "blob", content=data.decode("utf-8")))
+        except UnicodeDecodeError:
+            blob = repo.create_git_blob(base64.b64encode(data).decode("ascii"), "base64")
+            elements.append(InputGitTreeElement(path, "100644", "blob", sha=blob.sha))
+    tree = repo.create_git_tree(elements)
+
+    try:
+        ref = repo.get_git_ref(f"heads/{PAGES_BRANCH}")
+        parent = repo.get_git_commit(ref.object.sha)
+    except UnknownObjectException:
+        ref, parent = None, None
+    if parent is not None and parent.tree.sha == tree.sha:
+        logger.info(f"{PAGES_BRANCH} already has this export")
+        return parent.sha
+    commit = repo.create_git_commit(message, tree, [parent] if parent else [])
+    if ref is not None:
+        ref.edit(commit.sha, force=True)
+    else:
+        repo.create_git_ref(f"refs/heads/{PAGES_BRANCH}", commit.sha)
+    return commit.sha
+
+
+def export_for_direct_publish(code, attachments_content, req_txt):
+    """Exported site files in PUBLISH_MODE=direct, else None (use Actions)."""
+    if PUBLISH_MODE != "direct":
+        return None
+    if not (EXPORT_USER or EXPORT_SAME_USER):
+        logger.warning("PUBLISH_MODE=direct needs EXPORT_USER (or EXPORT_SAME_USER=1), "
+                       "publishing through the Actions workflow")
+        return None
+    files = export_site(code, attachments_content, req_txt)
+    if files is None:
+        logger.warning("Local export failed, falling back to the Actions workflow")
+    return files
+
+
+@tracing.traced()
+def publish_site(repo, repo_name, files, source_sha, account):
+    """Pushes an exported site to PAGES_BRANCH and serves Pages from it."""
+    sha = publish_pages_branch(repo, files, f"Deploy {source_sha} to GitHub Pages")
+    tracing.set_attribute("pages_sha", sha)
+    status, _ = ensure_pages_site(account.login, repo_name, PAGES_BRANCH, account.secret)
+    tracing.set_attribute("status", status)
+    return status in (200, 201, 204)
+
+
+@tracing.traced()
+def notify_evaluation(evaluation_url, eval_payload):
+    """POSTs the result to the evaluation endpoint with exponential backoff."""
+    # Retry logic for evaluation notification
+    delay = 1
+    for attempt in range(6):
+        logger.info(f"Sending evaluation, attempt {attempt+1}")
+        tracing.set_attribute("retries", attempt)
+        with tracing.span("evaluation.notify", kind=tracing.SPAN_KIND_CLIENT,
+                          attempt=attempt + 1, retries=attempt) as notify:
+            resp = requests.post(evaluation_url, json=eval_payload,
+                                 headers={"Content-Type": "application/json"})
+            if notify is not None:
+                notify.set_attribute("http.status_code", resp.status_code)
+        if resp.status_code == 200:
+            logger.info("✓ Evaluation notification sent")
+            return True
+        time.sleep(delay)
+        delay *= 2
+    return False
+
+
+def replay_evaluation(req, result):
+    """Re-sends the stored outcome of a completed job for a duplicate request."""
+    eval_payload = {
+        "email": req.get("email"), "task": req.get("task"),
+        "round": req.get("round"), "nonce": req.get("nonce"),
+        "repo_url": result.get("repo_url"), "commit_sha": result.get("commit_sha"),
+        "pages_url": result.get("pages_url"),
+    }
+    try:
+        with tracing.start_trace("replay_evaluation", task=req.get("task"),
+                                 round=req.get("round"), nonce=req.get("nonce")):
+            notify_evaluation(req["evaluation_url"], eval_payload)
+    except Exception as e:
+        logger.error(f"Replaying evaluation for {req.get('task')} failed: {e}")
+
+
+def process_request(req, job_id=None, merged=None, revisions=None):
+    """
+    Runs the full pipeline for one request inside its own trace. Returns the
+    repo_url/commit_sha/pages_url of the deployment, or None on failure.
+    When `job_id` is given, stage progress is recorded in the job store.
+    `merged` are other requests of the same task coalesced into this run and
+    `revisions` all of them, `req` included, in round and arrival order.
+    """
+    attributes = {"task": req.get("task"), "round": req.get("round"),
+                  "nonce": req.get("nonce")}
+    if job_id:
+        attributes["job_id"] = job_id
+    if merged:
+        attributes["merged"] = len(merged)
+    with tracing.start_trace("process_request", **attributes):
+        return run_pipeline(req, merged, revisions)
+
+
+@tracing.traced()
+def find_reusable_code(brief, checks):
+    """
+    Returns the app.py of the most similar earlier successful task when it
+    passes BRIEF_REUSE_THRESHOLD, else None. Lookups and hits are counted
+    in the job store for /metrics.
+    """
+    if BRIEF_REUSE_THRESHOLD > 1:
+        return None
+    try:
+        store = get_job_store()
+        best_score, best = similarity.closest(
+            similarity.signature(brief, checks), store.generations())
+        store.incr("reuse.lookups")
+        tracing.set_attribute("similarity", round(best_score, 3))
+        if best is None or best_score < BRIEF_REUSE_THRESHOLD:
+            return None
+        code = store.generation_code(best["task"], best["round"])
+        if code:
+            store.incr("reuse.hits")
+            tracing.set_attribute("source_task", best["task"])
+            logger.info(
+                f"Reusing app.py of {best['task']} round {best['round']} "
+                f"(similarity {best_score:.2f})")
+        return code
+    except Exception as e:
+        logger.warning(f"Similar-brief lookup failed: {e}")
+        return None
+
+
+def remember_generation(task, round_num, brief, checks, code):
+    """Indexes a successfully deployed app.py for later near-duplicate briefs."""
+    try:
+        get_job_store().record_generation(
+            task, round_num, similarity.signature(brief, checks), code)
+    except Exception as e:
+        logger.warning(f"Could not index generation of {task}: {e}")
+
+
+def checkpoint(supersede=True):
+    """
+    Cooperative cancellation point between stages: raises JobSuperseded when
+    a newer revision has replaced the running job, and LeaseLost when this
+    node's lease ran out, as another node may have taken the task over.
+    Once a run has committed its files, pass `supersede=False`: the commit
+    already recorded its brief, so the run finishes and the newer revision
+    follows as its own job. A failed background provisioning is raised here,
+    with the other prep work cancelled, before more LLM quota is spent.
+    """
+    prep = _provisioning.get()
+    if prep is not None:
+        repo_future, others = prep
+        if repo_future.done() and repo_future.exception() is not None:
+            for future in others:
+                future.cancel()
+            raise repo_future.exception()
+    active = tracing.current_span()
+    job_id = active.trace.root.attributes.get("job_id") if active else None
+    if job_id:
+        if NODE_ID and time.time() > _node_lease["until"]:
+            raise LeaseLost(f"node {NODE_ID} lease expired")
+        newer = get_job_store().superseded_by(job_id) if supersede else None
+        if newer:
+            raise JobSuperseded(newer)
+
+
+def latest_revisions(reqs):
+    """
+    Reduces coalesced requests, ordered by round and arrival (as JobStore.claim
+    returns them in `revisions`), to one per round, keeping each round's newest
+    revision, in round order.
+    """
+    by_round = {}
+    for r in reqs:
+        by_round[r["round"]] = r
+    return [by_round[k] for k in sorted(by_round)]
+
+
+# Span attributes copied onto a job's stage entries.
+STAGE_ATTRIBUTES = ("retries", "run_id", "commit_sha", "status", "actions_duration")
+
+
+def record_stage(event, span):
+    """
+    Span listener mirroring the top-level stages of queued jobs (the direct
+    children of the process_request span) into the job store.
+    """
+    root = span.trace.root
+    job_id = root.attributes.get("job_id") if root is not None else None
+    if not job_id or span.parent_id != root.span_id:
+        return
+    if event == "start":
+        get_job_store().stage_started(job_id, span.name, span.start_ns / 1e9)
+    else:
+        attributes = {k: span.attributes[k] for k in STAGE_ATTRIBUTES
+                      if k in span.attributes}
+        if span.status_code == tracing.STATUS_ERROR:
+            attributes["error"] = span.status_message
+        get_job_store().stage_finished(job_id, span.name, span.end_ns / 1e9, attributes)
+
+
+tracing.add_span_listener(record_stage)
+
+
+def github_account_for(task, repo_name, round_num):
+    """
+    The GitHub account that owns the task's repo. The first job of a task
+    picks the account with the lowest load per remaining API budget; every
+    later job of the task gets the same account (sticky, in the job store).
+    """
+    pool = get_github_pool()
+    store = get_job_store()
+    label = store.task_account(task)
+    if label is None and round_num != 1 and len(pool) > 1:
+        # Repos created before assignments were recorded: ask each account.
+        for account in pool.credentials:
+            try:
+                get_github(account).get_user().get_repo(repo_name)
+                label = account.label
+                break
+            except UnknownObjectException:
+                continue
+    if label is None:
+        label = pool.select(loads=store.account_loads()).label
+    label = store.assign_account(task, label)
+    account = pool.get(label)
+    if account is None:
+        raise RuntimeError(f"GitHub account {label} owning task {task} is not configured")
+    return account
+
+
+def workflow_fingerprint(code, deps_file):
+    """Fingerprint of the deploy workflow's inputs for this pipeline's settings."""
+    return artifacts.workflow_fingerprint(
+        code, WORKFLOW_PYTHON, "output", deps_file, DEPLOY_WORKFLOW_TEMPLATE,
+        prompts.version("workflow"))
+
+
+def readme_fingerprint(code, brief):
+    return artifacts.readme_fingerprint(code, brief, prompts.version("readme"))
+
+
+def requirements_fingerprint(code):
+    return artifacts.requirements_fingerprint(
+        code, LOCK_REQUIREMENTS, prompts.version("requirements"))
+
+
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
+def provision_repo(repo_name, account=None):
+    """Finds the task's repo from an earlier round, or creates it."""
+    user = get_github(account).get_user()
+    try:
+        # Try to find the repo created in a previous round.
+        repo = user.get_repo(repo_name)
+        logger.info(f"Found existing repo for task: {repo_name}")
+        tracing.set_attribute("status", "found")
+    except UnknownObjectException:
+        # If it's not found, this MUST be Round 1. Create it.
+        logger.info(f"No existing repo found for task: {repo_name}")
+        logger.info(f"Creating new repo for task: {repo_name}")
+        repo = user.create_repo(repo_name, private=False)
+        tracing.set_attribute("status", "created")
+    return repo
+
+
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
+def fetch_tree_shas(repo, branch="main"):
+    """
+    {path: blob sha} of every file on the branch in one call, so commits can
+    skip the per-file lookup. Empty for a new repo.
+    """
+    try:
+        tree = repo.get_git_tree(branch, recursive=True)
+    except GithubException as e:
+        if e.status in (404, 409):  # No such branch / empty repository
+            return {}
+        raise
+    shas = {entry.path: entry.sha for entry in tree.tree if entry.type == "blob"}
+    tracing.set_attribute("files", len(shas))
+    return shas
+
+
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
+def fetch_previous_round(repo):
+    """The saved context.json text and app.py of the previous round."""
+    context = repo.get_contents("context.json").decoded_content.decode("utf-8")
+    previous_code = repo.get_contents("app.py").decoded_content.decode("utf-8")
+    return context, previous_code
+
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def cached_round(task, account):
+    """
+    Repo, file SHAs, context.json and app.py this process kept after building
+    the task's previous round, if that round is still the task's latest
+    deployment (no other node built one since) and used the same account.
+    """
+    with _task_cache_lock:
+        state = _task_cache.get(task)
+    try:
+        store = get_job_store()
+        store.incr("task_cache.lookups")
+        if state is None or state["account"] != account.label:
+            return None
+        if store.task_head(task) != state["commit_sha"]:
+            with _task_cache_lock:
+                _task_cache.pop(task, None)
+            return None
+        store.incr("task_cache.hits")
+    except Exception as e:
+        logger.warning(f"Could not check the cached state of {task}: {e}")
+        return None
+    return state
+
+
+def remember_round(task, account, repo, commit_sha, known, context, code):
+    """Keeps a built round's repo state for the task's next round (LRU)."""
+    if not (commit_sha and context):
+        return
+    with _task_cache_lock:
+        _task_cache[task] = {"account": account.label, "repo": repo,
+                             "commit_sha": commit_sha, "known": dict(known),
+                             "context": context, "code": code}
+        _task_cache.move_to_end(task)
+        while len(_task_cache) > TASK_CACHE_MAX:
+            _task_cache.popitem(last=False)
+
+
+def run_pipeline(req, merged=None, revisions=None):
+    prep_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="prep")
+    account = prep_token = None
     try:
         logger.info(
             f"Processing new request for task '{req.get('task')}', round {req.get('round')}")
-        email = req["email"]
         task = req["task"]
         round_num = req["round"]
-        nonce = req["nonce"]
-        brief = req["brief"]
-        attachments = req.get("attachments", [])
-        checks = req.get("checks", [])
-        evaluation_url = req["evaluation_url"]
+        # Requests coalesced into this run: every nonce gets a callback, but
+        # only the newest revision of each round feeds the build.
+        recipients = [req] + list(merged or [])
+        rounds = latest_revisions(revisions or recipients)
+        briefs = [r["brief"] for r in rounds]
+        brief = briefs[0] if len(briefs) == 1 else \
+            "This is a cumulative brief...\n" + "\n".join(briefs)
+        attachments, checks = [], []
+        for r in rounds:
+            attachments += [a for a in r.get("attachments", []) if a not in attachments]
+            checks += [c for c in r.get("checks", []) if c not in checks]
+        if merged:
+            logger.info(
+                f"Coalesced {len(merged)} queued request(s) into this run "
+                f"(rounds {[r['round'] for r in rounds]})")
         # repo_id = str(uuid.uuid4()).split("-")[0]
         # repo_name = f"{task}-{repo_id}" if round_num == 1 else req.get("repo_name")
-        user = gh.get_user()
         repo_name = get_repo_name_from_task(task)
         commit_sha = None
-
-        try:
-            # Try to find the repo created in a previous round.
-            repo = user.get_repo(repo_name)
-            logger.info(f"Found existing repo for task: {repo_name}")
-        except UnknownObjectException:
-            logger.info(f"No existing repo found for task: {repo_name}")
-            logger.info(f"Creating new repo for task: {repo_name}")
-            repo = user.create_repo(repo_name, private=False)
-            # If it's not found, this MUST be Round 1. Create it.
-
-        repo_url = repo.html_url
-        pages_url = f"https://{GITHUB_USER}.github.io/{repo_name}/"
+        account = get_github_pool().acquire(github_account_for(task, repo_name, round_num))
+        github_user, github_token = account.login, account.secret
+        tracing.set_attribute("github_account", account.label)
+
+        # GitHub provisioning does not depend on the LLM output: it runs on
+        # the side and the pipeline joins it where the repo is first needed.
+        # A later round on the node that built the previous one starts from
+        # the state kept then instead.
+        cached = cached_round(task, account) if round_num != 1 else None
+        if round_num != 1:
+            tracing.set_attribute("task_cache", "hit" if cached else "miss")
+        if cached:
+            repo_future = _resolved(cached["repo"])
+            tree_future = _resolved(dict(cached["known"]))
+        else:
+            repo_future = tracing.submit(prep_pool, provision_repo, repo_name, account)
+            tree_future = tracing.submit(
+                prep_pool, lambda: fetch_tree_shas(repo_future.result()))
+        pages_future = previous_future = None
+        if round_num == 1 and PUBLISH_MODE != "direct":
+            def enable_pages():
+                repo_future.result()
+                return ensure_pages_enabled(github_user, repo_name, github_token)
+            pages_future = tracing.submit(prep_pool, enable_pages)
+        elif cached:
+            previous_future = _resolved((cached["context"], cached["code"]))
+        elif round_num != 1:
+            previous_future = tracing.submit(
+                prep_pool, lambda: fetch_previous_round(repo_future.result()))
+        prep_token = _provisioning.set((repo_future, [
+            f for f in (tree_future, pages_future, previous_future) if f is not None]))
+
+        pages_url = f"https://{github_user}.github.io/{repo_name}/"
         workflow_path = ".github/workflows/deploy.yml"
 
         if round_num == 1:
             context_to_save = {
-                "brief_history": [brief],
+                "brief_history": briefs,
                 "checks_history": checks,
                 "attachment_history": attachments
             }
 
-            context_content = json.dumps(context_to_save, indent=2)
-            attachments_content = json.dumps(
-                {"attachments": attachments}, indent=2)
+            with tracing.span("prepare_context", profile=True):
+                attachments_content = json.dumps(
+                    {"attachments": attachments}, indent=2)
 
-            previous_code = None
+            previous_code = find_reusable_code(brief, checks)
             logger.info(
                 "Step 1/8: Generating code file with export capability")
-            code = generate_code(brief, previous_code,
-                                 attachments, round_num, checks)
+            # A reused app is patched like a round-2 update.
+            code = generate_code(brief, previous_code, attachments,
+                                 2 if previous_code else round_num, checks)
 
             logger.info("Step 2/8: Generating README.md")
             readme = generate_readme(
-                repo_name, brief, round_num, GITHUB_USER, code)
+                repo_name, brief, round_num, github_user, code)
 
             logger.info("Step 3/8: Generating requirements.txt")
             req_txt = generate_requirements(code)
             # Ensure Flask is included
             if "flask" not in req_txt.lower():
                 req_txt = "flask\n" + req_txt
+            lock_txt = lock_requirements(req_txt)
+            deps_file = "requirements.lock" if lock_txt else "requirements.txt"
 
             logger.info("Step 4/8: Generating LICENSE")
             license_content = generate_license()
 
-            logger.info("Step 5/8: Generating workflow YAML")
-            workflow_content = generate_workflow(
-                brief, code, attachments, checks, output_dir="output")
-
-            # CRITICAL: Enable Pages BEFORE creating any files
-            logger.info("Step 6/8: Enabling GitHub Pages with Actions source")
-            pages_enabled = ensure_pages_enabled(
-                GITHUB_USER, repo_name, GITHUB_TOKEN)
-            if not pages_enabled:
-                logger.warning("Failed to enable Pages, but continuing...")
+            site_files = export_for_direct_publish(code, attachments_content, req_txt)
+            workflow_content = None
+            if site_files is None:
+                logger.info("Step 5/8: Generating workflow YAML")
+                workflow_content = generate_workflow(
+                    brief, code, attachments, checks, output_dir="output",
+                    deps_file=deps_file)
+
+                # CRITICAL: Enable Pages BEFORE creating any files
+                checkpoint()
+                logger.info("Step 6/8: Enabling GitHub Pages with Actions source")
+                if pages_future is not None:
+                    pages_enabled = pages_future.result()
+                else:  # Direct mode whose export failed
+                    pages_enabled = ensure_pages_enabled(
+                        github_user, repo_name, github_token)
+                if not pages_enabled:
+                    logger.warning("Failed to enable Pages, but continuing...")
 
             logger.info("Step 7/8: Creating repo files")
+            repo, known = repo_future.result(), tree_future.result()
+            fingerprints = {
+                artifacts.README: readme_fingerprint(code, brief),
+                artifacts.REQUIREMENTS: requirements_fingerprint(code),
+            }
+            if workflow_content:
+                fingerprints[artifacts.WORKFLOW] = workflow_fingerprint(code, deps_file)
+            context_to_save["artifacts"] = {"fingerprints": fingerprints, "deps_file": deps_file}
+            context_content = json.dumps(context_to_save, indent=2)
 
-            upsert_github_file(repo, "data.json",
-                               attachments_content, "Add attachments data")
-            # upsert_github_file(repo, "app.py", code,
-            #                    "Initial Flask app with export")
-            upsert_github_file(repo, "requirements.txt",
-                               req_txt, "Add dependencies")
-            upsert_github_file(repo, "LICENSE", license_content, "Add license")
-            upsert_github_file(repo, "README.md", readme, "Add README")
-            upsert_github_file(repo, "context.json",
-                               context_content, "Add context")
-            upsert_github_file(
-                repo, workflow_path, workflow_content, "Add Pages deployment workflow")
-            time.sleep(5)  #
-            result = upsert_github_file(repo, "app.py", code,
-                                        "Initial Flask app with export")
-            # repo.create_file(
-            #     "data.json", "Add attachments data", attachments_content)
-            # repo.create_file("app.py", "Initial Flask app with export", code)
-            # repo.create_file("requirements.txt", "Add dependencies", req_txt)
-            # repo.create_file("LICENSE", "Add license", license_content)
-            # repo.create_file("README.md", "Add README", readme)
-            # repo.create_file("context.json", "Add context", context_content)
-            # result = repo.create_file(
-            #     workflow_path, "Add Pages deployment workflow", workflow_content)
-            if result is not None:
-                commit_sha = result["commit"].sha
-            else:
-                commit_sha = repo.get_commits()[0].sha
+            with tracing.span("commit_files"):
+                upsert_github_file(repo, "data.json",
+                                   attachments_content, "Add attachments data", known=known)
+                # upsert_github_file(repo, "app.py", code,
+                #                    "Initial Flask app with export")
+                upsert_github_file(repo, "requirements.txt",
+                                   req_txt, "Add dependencies", known=known)
+                if lock_txt:
+                    upsert_github_file(repo, "requirements.lock",
+                                       lock_txt, "Add locked dependencies", known=known)
+                upsert_github_file(repo, "LICENSE", license_content, "Add license", known=known)
+                upsert_github_file(repo, "README.md", readme, "Add README", known=known)
+                upsert_github_file(repo, "context.json",
+                                   context_content, "Add context", known=known)
+                if workflow_content:
+                    upsert_github_file(
+                        repo, workflow_path, workflow_content, "Add Pages deployment workflow", known=known)
+                    time.sleep(5)  #
+                result = upsert_github_file(repo, "app.py", code,
+                                            "Initial Flask app with export", known=known)
+                # repo.create_file(
+                #     "data.json", "Add attachments data", attachments_content)
+                # repo.create_file("app.py", "Initial Flask app with export", code)
+                # repo.create_file("requirements.txt", "Add dependencies", req_txt)
+                # repo.create_file("LICENSE", "Add license", license_content)
+                # repo.create_file("README.md", "Add README", readme)
+                # repo.create_file("context.json", "Add context", context_content)
+                # result = repo.create_file(
+                #     workflow_path, "Add Pages deployment workflow", workflow_content)
+                if result is not None:
+                    commit_sha = result["commit"].sha
+                else:
+                    commit_sha = repo.get_commits()[0].sha
+                tracing.set_attribute("commit_sha", commit_sha)
         else:
             # Update existing repo for subsequent rounds
             logger.info(
                 f"Updating existing repo files for round - {round_num}")
 
+            repo = repo_future.result()
             try:
-                context_file = repo.get_contents("context.json")
-                previous_code = repo.get_contents(
-                    "app.py").decoded_content.decode("utf-8")
-                past_context = json.loads(
-                    context_file.decoded_content.decode())
+                context_text, previous_code = previous_future.result()
+                past_context = json.loads(context_text)
 
                 existing_attachments = {
                     (att['name'], att['url']) for att in past_context.get("attachment_history", [])}
@@ -922,8 +1767,9 @@ def process_request(req):
                         logger.info(
                             f"Appended new attachment: '{attachment['name']}'")
 
-                if brief not in past_context["brief_history"]:
-                    past_context["brief_history"].append(brief)
+                for new_brief in briefs:
+                    if new_brief not in past_context["brief_history"]:
+                        past_context["brief_history"].append(new_brief)
 
                 brief = "This is a cumulative brief...\n" + \
                     "\n".join(past_context["brief_history"])
@@ -943,120 +1789,200 @@ def process_request(req):
                 previous_code = None
                 full_attachments = attachments
 
-            if past_context:
-                context_content = json.dumps(past_context, indent=2)
-                repo.update_file("context.json", f"Update context for round {round_num}",
-                                 context_content, context_file.sha)
+            known = tree_future.result()
+            # Fingerprints of the artifacts committed so far; only those
+            # whose inputs changed are rebuilt (see artifacts.py).
+            built = (past_context or {}).get("artifacts", {})
+            fingerprints = dict(built.get("fingerprints", {}))
 
             # Update attachments
-            attachments_content = json.dumps(
-                {"attachments": full_attachments}, indent=2)
+            with tracing.span("prepare_context", profile=True):
+                attachments_content = json.dumps(
+                    {"attachments": full_attachments}, indent=2)
 
             logger.info("Step 1/4: Generating code for update")
             logging.info("Using previous code length: %d", len(
                 previous_code) if previous_code else 0)
             code = generate_code(brief, previous_code,
                                  full_attachments, round_num, checks)
-            logger.info("Step 2/4: Generating README.md for update")
-            readme = generate_readme(
-                repo_name, brief, round_num, GITHUB_USER, code)
-            logger.info("Step 3/4: Generating workflow for update")
-            workflow_content = generate_workflow(
-                brief, code, full_attachments, checks, output_dir="output")
-
-            logger.info("Step 4/4: Generating requirements.txt for update")
-            req_txt = generate_requirements(code)
 
-            upsert_github_file(repo, "data.json",
-                               attachments_content, "Add attachments data for round {round_num}")
-            upsert_github_file(repo, "requirements.txt",
-                               req_txt, f"Update for round {round_num}")
-            upsert_github_file(repo, "README.md", readme,
-                               f"Update README for round {round_num}")
-            upsert_github_file(
-                repo, workflow_path, workflow_content, f"Update workflow for round {round_num}")
-            time.sleep(5)  #
-            result = upsert_github_file(repo, "app.py", code,
-                                        f"Update for round {round_num}")
-            # repo.update_file(
-            #     "data.json", f"Add attachments data for round {round_num}", attachments_content,
-            #                  repo.get_contents("data.json").sha)
-            # repo.update_file("app.py", f"Update for round {round_num}", code,
-            #                  repo.get_contents("app.py").sha)
-            # repo.update_file("requirements.txt", f"Update for round {round_num}", req_txt,
-            #                  repo.get_contents("requirements.txt").sha)
-            # repo.update_file("README.md", f"Update README for round {round_num}", readme,
-            #                  repo.get_contents("README.md").sha)
-            # result = repo.update_file(workflow_path, f"Update workflow for round {round_num}",
-            #                           workflow_content, repo.get_contents(workflow_path).sha)
-            if result is not None:
-                commit_sha = result["commit"].sha
+            readme = None
+            readme_fp = readme_fingerprint(code, brief)
+            if fingerprints.get(artifacts.README) == readme_fp:
+                logger.info("Step 2/4: README.md inputs unchanged, keeping it")
+            else:
+                logger.info("Step 2/4: Generating README.md for update")
+                readme = generate_readme(
+                    repo_name, brief, round_num, github_user, code)
+                fingerprints[artifacts.README] = readme_fp
+
+            # Requirements come first: the workflow installs from their lock.
+            req_txt = lock_txt = None
+            req_fp = requirements_fingerprint(code)
+            if fingerprints.get(artifacts.REQUIREMENTS) == req_fp and "deps_file" in built:
+                logger.info("Step 3/4: Imports unchanged, keeping requirements")
+                deps_file = built["deps_file"]
             else:
-                commit_sha = repo.get_commits()[0].sha
+                logger.info("Step 3/4: Generating requirements.txt for update")
+                req_txt = generate_requirements(code)
+                lock_txt = lock_requirements(req_txt)
+                deps_file = "requirements.lock" if lock_txt else "requirements.txt"
+                fingerprints[artifacts.REQUIREMENTS] = req_fp
+
+            if req_txt is None and PUBLISH_MODE == "direct":
+                req_txt_for_export = repo.get_contents(
+                    "requirements.txt").decoded_content.decode("utf-8")
+            else:
+                req_txt_for_export = req_txt
+            site_files = export_for_direct_publish(
+                code, attachments_content, req_txt_for_export)
+            workflow_content = None
+            if site_files is None:
+                workflow_fp = workflow_fingerprint(code, deps_file)
+                if fingerprints.get(artifacts.WORKFLOW) == workflow_fp:
+                    logger.info("Step 4/4: Workflow inputs unchanged, keeping it")
+                else:
+                    logger.info("Step 4/4: Generating workflow for update")
+                    workflow_content = generate_workflow(
+                        brief, code, full_attachments, checks, output_dir="output",
+                        deps_file=deps_file)
+                    fingerprints[artifacts.WORKFLOW] = workflow_fp
+                # A site published from PAGES_BRANCH in an earlier round is
+                # still on the legacy build type; Actions deploys need it back.
+                ensure_pages_enabled(github_user, repo_name, github_token)
+            tracing.set_attribute("rebuilt", ",".join(sorted(
+                name for name, value in (
+                    (artifacts.README, readme), (artifacts.REQUIREMENTS, req_txt),
+                    (artifacts.WORKFLOW, workflow_content)) if value)))
+
+            context_content = None
+            with tracing.span("commit_files"):
+                if past_context:
+                    past_context["artifacts"] = {"fingerprints": fingerprints,
+                                                 "deps_file": deps_file}
+                    context_content = json.dumps(past_context, indent=2)
+                    upsert_github_file(repo, "context.json", context_content,
+                                       f"Update context for round {round_num}", known=known)
+                upsert_github_file(repo, "data.json",
+                                   attachments_content, "Add attachments data for round {round_num}", known=known)
+                if req_txt is not None:
+                    upsert_github_file(repo, "requirements.txt",
+                                       req_txt, f"Update for round {round_num}", known=known)
+                if lock_txt:
+                    upsert_github_file(repo, "requirements.lock", lock_txt,
+                                       f"Update locked dependencies for round {round_num}", known=known)
+                if readme is not None:
+                    upsert_github_file(repo, "README.md", readme,
+                                       f"Update README for round {round_num}", known=known)
+                if workflow_content:
+                    upsert_github_file(
+                        repo, workflow_path, workflow_content, f"Update workflow for round {round_num}", known=known)
+                    time.sleep(5)  #
+                result = upsert_github_file(repo, "app.py", code,
+                                            f"Update for round {round_num}", known=known)
+                # repo.update_file(
+                #     "data.json", f"Add attachments data for round {round_num}", attachments_content,
+                #                  repo.get_contents("data.json").sha)
+                # repo.update_file("app.py", f"Update for round {round_num}", code,
+                #                  repo.get_contents("app.py").sha)
+                # repo.update_file("requirements.txt", f"Update for round {round_num}", req_txt,
+                #                  repo.get_contents("requirements.txt").sha)
+                # repo.update_file("README.md", f"Update README for round {round_num}", readme,
+                #                  repo.get_contents("README.md").sha)
+                # result = repo.update_file(workflow_path, f"Update workflow for round {round_num}",
+                #                           workflow_content, repo.get_contents(workflow_path).sha)
+                if result is not None:
+                    commit_sha = result["commit"].sha
+                else:
+                    commit_sha = repo.get_commits()[0].sha
+                tracing.set_attribute("commit_sha", commit_sha)
 
-        logger.info("Step: Waiting for workflow to complete")
-        actions_success = wait_for_actions_run(
-            GITHUB_USER, repo_name, commit_sha, GITHUB_TOKEN,
-            workflow_filename="deploy.yml",
-            timeout=180  # 3 minutes
-        )
+        remember_round(task, account, repo, commit_sha, known, context_content, code)
+        repo_url = repo.html_url
+        checkpoint(supersede=False)
+        if site_files is not None:
+            logger.info(f"Step: Publishing exported site to {PAGES_BRANCH}")
+            actions_success = None
+            deployed = publish_site(repo, repo_name, site_files, commit_sha, account)
+        else:
+            logger.info("Step: Waiting for workflow to complete")
+            actions_success = wait_for_actions_run(
+                github_user, repo_name, commit_sha, github_token,
+                workflow_filename="deploy.yml",
+                timeout=180  # 3 minutes
+            )
+            deployed = actions_success
 
-        if actions_success:
-            logger.info("✓ Workflow completed successfully")
+        if deployed:
+            logger.info("✓ Site deployed successfully")
+            remember_generation(task, round_num, brief, checks, code)
         else:
-            logger.warning("⚠ Workflow did not complete successfully")
+            logger.warning("⚠ Site was not deployed successfully")
 
         logger.info("Notifying evaluation endpoint")
-        eval_payload = {
-            "email": email, "task": task, "round": round_num, "nonce": nonce,
-            "repo_url": repo_url, "commit_sha": commit_sha,
-            "pages_url": pages_url,
-        }
-
-        # Retry logic for evaluation notification
-        delay = 1
-        for attempt in range(6):
-            logger.info(f"Sending evaluation, attempt {attempt+1}")
-            resp = requests.post(evaluation_url, json=eval_payload,
-                                 headers={"Content-Type": "application/json"})
-            if resp.status_code == 200:
-                logger.info("✓ Evaluation notification sent")
-                break
-            time.sleep(delay)
-            delay *= 2
+        for r in recipients:
+            eval_payload = {
+                "email": r["email"], "task": task, "round": r["round"],
+                "nonce": r["nonce"], "repo_url": repo_url, "commit_sha": commit_sha,
+                "pages_url": pages_url,
+            }
+            notify_evaluation(r["evaluation_url"], eval_payload)
 
         logger.info(f"✓ Process complete for {task} round {round_num}")
-
+        tracing.set_attribute("commit_sha", commit_sha)
+        tracing.set_attribute("actions_success", actions_success)
+        tracing.set_attribute("publish_mode", "direct" if site_files is not None else "actions")
+        tracing.set_attribute("status", "completed")
+        return {"repo_url": repo_url, "commit_sha": commit_sha,
+                "pages_url": pages_url, "actions_success": actions_success,
+                "deployed": deployed}
+
+    except (JobSuperseded, LeaseLost) as e:
+        tracing.set_attribute(
+            "status", "superseded" if isinstance(e, JobSuperseded) else "lease lost")
+        raise
     except Exception as ex:
         logger.error(f"process_request error: {ex}", exc_info=True)
-
-
+        tracing.set_attribute("status", "failed")
+        if tracing.current_span() is not None:
+            tracing.current_span().set_error(ex)
+        return None
+    finally:
+        if prep_token is not None:
+            _provisioning.reset(prep_token)
+        # Joins provisioning still running after an early failure or cancel.
+        prep_pool.shutdown(wait=True)
+        if account is not None:
+            get_github_pool().release(account)
+
+
+@tracing.traced(kind=tracing.SPAN_KIND_CLIENT)
 def ensure_pages_site(owner, repo_name, branch, token, path="/"):
     """
     Robustly create or update a GitHub Pages site.
     Tries GET; if 404, uses POST to create; if 200, uses PUT to update.
     """
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/pages"
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo_name}/pages"
     headers = {
         "Authorization": f"Bearer {token}",
         "Accept": "application/vnd.github+json"
     }
     # 1. Check if Pages site exists
-    resp = requests.get(url, headers=headers)
+    resp = github_budget.session().get(url, headers=headers)
     logger.info(f"GET Pages site: {resp.status_code} - {resp.text}")
     if resp.status_code == 404:
         # Create Pages site (POST)
         logger.info("Pages site not found, creating...")
-        resp = requests.post(url, headers=headers, json={
-            "source": {"branch": branch, "path": path}
+        resp = github_budget.session().post(url, headers=headers, json={
+            "build_type": "legacy", "source": {"branch": branch, "path": path}
         })
         logger.info(f"POST Pages site: {resp.status_code} - {resp.text}")
         time.sleep(3)  # Give GitHub time to initialize
     elif resp.status_code == 200:
         # Update source branch/path (PUT)
         logger.info("Pages site exists, updating source branch/path...")
-        resp = requests.put(url, headers=headers, json={
-            "source": {"branch": branch, "path": path}
+        resp = github_budget.session().put(url, headers=headers, json={
+            "build_type": "legacy", "source": {"branch": branch, "path": path}
         })
         logger.info(f"PUT Pages site: {resp.status_code} - {resp.text}")
     else:
@@ -1080,6 +2006,52 @@ def ensure_pages_site(owner, repo_name, branch, token, path="/"):
 #     logger.info("Request acknowledged and processing in background thread.")
 #     return jsonify({"status": "acknowledged"}), 200
 
+def _isoformat(timestamp):
+    if timestamp is None:
+        return None
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def job_view(store, job):
+    """Public status of a job: progress, stage timings and outcome."""
+    result = job["result"] or {}
+    stages = []
+    for entry in job["stages"]:
+        finished = entry.get("finished_at")
+        stage = {k: v for k, v in entry.items() if k not in ("started_at", "finished_at")}
+        stage.update(started_at=_isoformat(entry["started_at"]),
+                     finished_at=_isoformat(finished),
+                     seconds=round((finished or time.time()) - entry["started_at"], 3))
+        stages.append(stage)
+    view = {
+        "job_id": job["id"], "task": job["task"], "round": job["round"],
+        "nonce": job["nonce"], "status": job["status"], "stage": job["stage"],
+        "attempts": job["attempts"],
+        "retries": sum(int(s.get("retries", 0)) for s in job["stages"]),
+        "created_at": _isoformat(job["created_at"]),
+        "started_at": _isoformat(job["started_at"]),
+        "finished_at": _isoformat(job["finished_at"]),
+        "stages": stages,
+        "commit_sha": result.get("commit_sha") or next(
+            (s["commit_sha"] for s in job["stages"] if "commit_sha" in s), None),
+        "actions_run_id": next(
+            (s["run_id"] for s in job["stages"] if "run_id" in s), None),
+    }
+    if job["merged_into"]:
+        view["merged_into"] = job["merged_into"]
+    if job["status"] == "queued":
+        projected = store.projected_start(job["id"])
+        view["queue_position"] = store.queue_position(job["id"])
+        view["projected_start"] = _isoformat(projected)
+    elif job["status"] in ("done", "failed"):
+        view["outcome"] = {
+            "repo_url": result.get("repo_url"), "pages_url": result.get("pages_url"),
+            "actions_success": result.get("actions_success"),
+            "deployed": result.get("deployed"), "error": job["error"],
+        }
+    return view
+
+
 # In your Flask endpoint, put the request in the queue instead of spawning a thread directly:
 @app.route("/api-endpoint", methods=["POST"])
 def api_endpoint():
@@ -1088,9 +2060,93 @@ def api_endpoint():
     if req.get("secret") != GOOGLE_FORM_SECRET:
         logger.warning("Invalid secret provided.")
         return jsonify(error="Invalid secret"), 403
-    task_queue.put(req)  # Add request to the queue
-    logger.info("Request acknowledged and queued for background processing.")
-    return jsonify(status="acknowledged"), 200
+    store = get_job_store()
+    try:
+        job_id, existing = store.enqueue(req)  # Add request to the queue
+    except QueueFull as e:
+        logger.warning(f"Job queue is full ({e}), rejecting request.")
+        return jsonify(error="Queue is full, retry later"), 503
+
+    if existing and existing["status"] == "done":
+        logger.info(
+            f"Duplicate of completed job {job_id}; replaying evaluation callback.")
+        threading.Thread(target=replay_evaluation,
+                         args=(req, existing["result"] or {}), daemon=True).start()
+        return jsonify(status="completed", duplicate=True, job_id=job_id,
+                       **{k: (existing["result"] or {}).get(k)
+                          for k in ("repo_url", "commit_sha", "pages_url")}), 200
+    if existing:
+        logger.info(f"Duplicate of {existing['status']} job {job_id}; attached to it.")
+    _job_available.set()
+    if _worker_limits["max"] > _worker_limits["min"]:
+        scale_workers()
+
+    projected = store.projected_start(job_id) or time.time()
+    logger.info(
+        f"Request acknowledged and queued for background processing "
+        f"(projected start in {projected - time.time():.0f}s).")
+    return jsonify(status="acknowledged", duplicate=bool(existing), job_id=job_id,
+                   projected_start=_isoformat(projected),
+                   projected_start_in=max(0, round(projected - time.time()))), 200
+
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    store = get_job_store()
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    jobs = store.list_jobs(task=request.args.get("task"), limit=limit)
+    return jsonify(jobs=[job_view(store, job) for job in jobs]), 200
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(job_view(store, job)), 200
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-sent events: one `data:` message per change until the job ends.
+    Streams last at most JOB_EVENTS_MAX_SECONDS; clients reconnect and get
+    the current state first. A reconnect that already saw the final event
+    (its Last-Event-ID) gets 204, which tells EventSource to stop.
+    """
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    if (job["status"] in ("done", "failed")
+            and request.headers.get("Last-Event-ID") == str(job["updated_at"])):
+        return "", 204
+
+    def stream():
+        started = last_sent = time.time()
+        last = None
+        yield f"retry: {JOB_EVENTS_RETRY_MS}\n\n"
+        while time.time() - started < JOB_EVENTS_MAX_SECONDS:
+            job = store.get(job_id)
+            if job is None:  # Pruned while streaming.
+                yield "event: gone\ndata: {}\n\n"
+                return
+            view = job_view(store, job)
+            key = (job["status"], job["updated_at"], view.get("queue_position"))
+            if key != last:
+                yield (f"id: {job['updated_at']}\nevent: {job['status']}\n"
+                       f"data: {json.dumps(view)}\n\n")
+                last, last_sent = key, time.time()
+            elif time.time() - last_sent > JOB_EVENTS_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            if job["status"] in ("done", "failed"):
+                return
+            time.sleep(JOB_EVENTS_INTERVAL)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route("/", methods=["GET"])
@@ -1099,6 +2155,95 @@ def home():
     return "API is running!", 200
 
 
-if __name__ == "__main__":
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    counters = get_job_store().counters()
+    lookups = counters.get("reuse.lookups", 0)
+    runs = counters.get("actions.runs", 0)
+    cache_lookups = counters.get("task_cache.lookups", 0)
+    prompt_tokens = counters.get("llm.prompt_tokens", 0)
+    worker_stats = get_job_store().worker_stats()
+    budgets = {proc: stats["github"]
+               for proc, stats in worker_stats.items() if "github" in stats}
+    pools = {proc: stats["credentials"]
+             for proc, stats in worker_stats.items() if "credentials" in stats}
+    return jsonify(
+        counters=counters,
+        reuse_hit_rate=round(counters.get("reuse.hits", 0) / lookups, 3) if lookups else None,
+        task_cache_hit_rate=(round(counters.get("task_cache.hits", 0) / cache_lookups, 3)
+                             if cache_lookups else None),
+        actions_avg_seconds=round(counters.get("actions.seconds", 0) / runs, 1) if runs else None,
+        prompt_cache_share=(round(counters.get("llm.cached_tokens", 0) / prompt_tokens, 3)
+                            if prompt_tokens else None),
+        prompt_templates=prompts.versions(),
+        github_budget=budgets,
+        credentials=pools,
+    ), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    providers = providers_status()
+    store = get_job_store()
+    alive = sum(1 for t in _workers if t.is_alive())
+    worker_processes = len(store.live_workers())
+    is_ready = all(providers.values()) and (alive > 0 or worker_processes > 0)
+    body = {"ready": is_ready, "pipe": PIPE, "providers": providers,
+            "workers": alive, "worker_processes": worker_processes,
+            "queue_depth": store.depth(), "errors": dict(_provider_errors)}
+    if NODE_ID:
+        nodes = store.live_nodes()
+        body.update(node=NODE_ID, nodes=nodes, lease_held=NODE_ID in nodes)
+    return jsonify(body), 200 if is_ready else 503
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TDS Project 1 service")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="Run the development server (default)")
+    worker_cmd = commands.add_parser(
+        "worker", help="Run supervised job-executor processes")
+    worker_cmd.add_argument("--processes", type=int, default=WORKER_PROCESSES)
+    worker_cmd.add_argument("--max-processes", type=int, default=WORKER_MAX_PROCESSES,
+                            help="Autoscale up to this many processes on queue load")
+    worker_cmd.add_argument("--threads", type=int, default=1,
+                            help="Worker threads per process")
+    store_cmd = commands.add_parser(
+        "store", help="Serve the job store to the nodes of a multi-node deployment")
+    store_cmd.add_argument("--host", default="127.0.0.1",
+                           help="Bind address; any other than loopback needs JOB_STORE_TOKEN")
+    store_cmd.add_argument("--port", type=int, default=7870)
+    batch_cmd = commands.add_parser(
+        "batch", help="Replay task requests from a JSONL file")
+    batch_cmd.add_argument("file", help="JSONL file, one request per line")
+    batch_cmd.add_argument("--concurrency", type=int, default=2,
+                           help="Tasks processed in parallel")
+    batch_cmd.add_argument("--results",
+                           help="Results/checkpoint JSONL (default: <file>.results.jsonl)")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        supervise_workers(args.processes, args.threads, args.max_processes)
+        return
+    if args.command == "store":
+        if JOB_STORE_URL:
+            parser.error("JOB_STORE_URL is set; the store server opens JOB_DB_PATH itself")
+        if not cluster.JOB_STORE_TOKEN and not cluster.is_loopback(args.host):
+            parser.error(f"JOB_STORE_TOKEN must be set to serve the job store on {args.host}")
+        store = JobStore(max_depth=JOB_QUEUE_MAX_DEPTH)
+        store.recover_stale()
+        logger.info(f"Serving the job store {store.path} on {args.host}:{args.port}")
+        cluster.create_store_app(store).run(host=args.host, port=args.port, threaded=True)
+        return
+    if args.command == "batch":
+        counts = batch.run_batch(args.file, process_request,
+                                 args.concurrency, args.results)
+        sys.exit(1 if counts["failed"] else 0)
+
+    start_workers()
     logger.info("Starting Flask server on port 7860...")
     app.run(host="0.0.0.0", port=7860)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Input fingerprints for the generated repo files other than app.py.
+
+README.md, requirements.txt (with its lock) and the deploy workflow each
+depend on only part of the generated code. A fingerprint hashes just that
+part, so a later round whose fingerprint matches the one saved in
+context.json keeps the committed file instead of asking the LLM again:
+
+    requirements.txt: third-party top-level imports of app.py
+    deploy.yml:       entrypoint, its CLI flags, Python version, output
+                      directory, dependency file and workflow template
+    README.md:        routes, CLI flags and public names of app.py, plus
+                      the brief
+
+Each fingerprint also covers the version of the prompt template that
+generates the file (prompts.py), so changing a prompt rebuilds its file.
+"""
+import ast
+import hashlib
+import json
+import re
+import sys
+
+
+ENTRYPOINT = "app.py"
+README = "README.md"
+REQUIREMENTS = "requirements.txt"
+WORKFLOW = ".github/workflows/deploy.yml"
+
+_IMPORT_RE = re.compile(r"^\s*(?:from|import)\s+([A-Za-z_]\w*)", re.MULTILINE)
+_ROUTE_RE = re.compile(r"""\.route\(\s*["']([^"']*)["']""")
+_FLAG_RE = re.compile(r"""["'](--[A-Za-z][A-Za-z0-9-]*)["']""")
+
+
+def _parse(code):
+    try:
+        return ast.parse(code or "")
+    except SyntaxError:
+        return None  # Fall back to regexes; the export will tell if it runs.
+
+
+def _digest(value):
+    payload = json.dumps(value, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def imports(code):
+    """Sorted third-party top-level modules imported by the code."""
+    tree = _parse(code)
+    if tree is None:
+        names = set(_IMPORT_RE.findall(code or ""))
+    else:
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names.add(node.module.split(".")[0])
+    return sorted(n for n in names
+                  if n not in sys.stdlib_module_names and n != "__future__")
+
+
+def cli_flags(code):
+    """Sorted command-line flags (string literals like "--export") in the code."""
+    return sorted(set(_FLAG_RE.findall(code or "")))
+
+
+def routes(code):
+    """Sorted URL rules registered with @app.route / @bp.route."""
+    tree = _parse(code)
+    if tree is None:
+        return sorted(set(_ROUTE_RE.findall(code or "")))
+    rules = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            if (isinstance(decorator, ast.Call)
+                    and isinstance(decorator.func, ast.Attribute)
+                    and decorator.func.attr == "route" and decorator.args
+                    and isinstance(decorator.args[0], ast.Constant)):
+                rules.add(str(decorator.args[0].value))
+    return sorted(rules)
+
+
+def public_names(code):
+    """Sorted top-level function and class names not starting with "_"."""
+    tree = _parse(code)
+    if tree is None:
+        return []
+    return sorted(node.name for node in tree.body
+                  if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+                  and not node.name.startswith("_"))
+
+
+def requirements_fingerprint(code, locked, prompt=None):
+    return _digest({"imports": imports(code), "locked": bool(locked), "prompt": prompt})
+
+
+def workflow_fingerprint(code, python_version, output_dir, deps_file, template, prompt=None):
+    return _digest({
+        "entrypoint": ENTRYPOINT, "flags": cli_flags(code), "python": python_version,
+        "output_dir": output_dir, "deps_file": deps_file, "template": template,
+        "prompt": prompt,
+    })
+
+
+def readme_fingerprint(code, brief, prompt=None):
+    return _digest({
+        "routes": routes(code), "flags": cli_flags(code), "names": public_names(code),
+        "brief": " ".join((brief or "").split()), "prompt": prompt,
+    })
@@ -0,0 +1,143 @@
+"""
+Bulk replay of task requests from a JSONL file (`python app.py batch`).
+
+Requests run directly through `process_request`, bypassing the HTTP tier.
+Rounds of the same task run one after another in round order; different
+tasks run concurrently. Every finished job is appended to a results JSONL,
+which doubles as the checkpoint: on restart, jobs already recorded as
+"done" are skipped.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+
+logger = logging.getLogger(__name__)
+
+
+def job_key(req):
+    return f"{req.get('task')}|{req.get('round')}|{req.get('nonce')}"
+
+
+def index_requests(path):
+    """
+    Scans the JSONL file once and returns {task: [(round, offset), ...]} so
+    payloads (which can carry large attachments) are only loaded when run.
+    """
+    lanes = defaultdict(list)
+    with open(path, "rb") as f:
+        offset = f.tell()
+        for line_no, line in enumerate(iter(f.readline, b""), start=1):
+            if line.strip():
+                try:
+                    req = json.loads(line)
+                    lanes[req["task"]].append((int(req.get("round", 1)), offset))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Skipping line {line_no} of {path}: {e}")
+            offset = f.tell()
+    for entries in lanes.values():
+        entries.sort()
+    return lanes
+
+
+def load_request(path, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+def load_checkpoint(results_path):
+    """Returns the keys of jobs already completed in a previous run."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Partially written line from an interrupted run
+            if record.get("status") == "done":
+                done.add(record["key"])
+    return done
+
+
+def run_batch(path, process_request, concurrency=2, results_path=None):
+    """
+    Runs every request in `path` and appends one result record per job to
+    `results_path` (default: `<path>.results.jsonl`).
+
+    Returns:
+        dict: Counts of done, failed and skipped jobs.
+    """
+    results_path = results_path or f"{path}.results.jsonl"
+    lanes = index_requests(path)
+    done = load_checkpoint(results_path)
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+    write_lock = threading.Lock()
+    current = threading.local()
+
+    def capture(otlp):
+        current.stages = tracing.summarize(otlp)[1]
+
+    def record(entry):
+        with write_lock, open(results_path, "a") as out:
+            out.write(json.dumps(entry) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            counts[entry["status"]] += 1
+
+    def run_lane(task, entries):
+        for round_num, offset in entries:
+            req = load_request(path, offset)
+            key = job_key(req)
+            if key in done:
+                with write_lock:
+                    counts["skipped"] += 1
+                continue
+
+            logger.info(f"Batch: running {task} round {round_num}")
+            current.stages = {}
+            started = time.time()
+            try:
+                result = process_request(req)
+            except Exception as e:
+                logger.error(f"Batch job {key} raised: {e}")
+                result = None
+            finished = time.time()
+            record({
+                "key": key, "task": task, "round": round_num,
+                "nonce": req.get("nonce"),
+                "status": "done" if result else "failed",
+                "started_at": started, "finished_at": finished,
+                "duration": round(finished - started, 3),
+                "stages": {k: round(v, 3) for k, v in current.stages.items()},
+                "commit_sha": (result or {}).get("commit_sha"),
+                "pages_url": (result or {}).get("pages_url"),
+                "repo_url": (result or {}).get("repo_url"),
+            })
+            if not result:
+                # Later rounds build on this one; stop the lane and let a
+                # resumed batch retry from here.
+                logger.warning(f"Batch: stopping lane {task} after failed round {round_num}")
+                return
+
+    logger.info(f"Batch: {sum(len(e) for e in lanes.values())} requests in "
+                f"{len(lanes)} tasks, {len(done)} already done, concurrency {concurrency}")
+    tracing.add_exporter(capture)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(run_lane, task, entries)
+                       for task, entries in lanes.items()]
+            for future in futures:
+                future.result()
+    finally:
+        tracing.remove_exporter(capture)
+    logger.info(f"Batch finished: {counts} (results in {results_path})")
+    return counts
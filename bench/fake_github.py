@@ -0,0 +1,382 @@
+"""
+In-memory GitHub REST stand-in used by the offline benchmark.
+
+Implements just enough of the API for PyGithub and the raw `requests` calls in
+app.py: the authenticated user, repos, contents, commits, Pages and
+actions/runs, plus the git data API (blobs, trees, commits, refs) used to
+publish a gh-pages branch. Pushes that touch app.py start a simulated workflow run that
+completes after a configurable build duration, and every token gets a primary
+rate limit window that answers 403 once exhausted.
+"""
+import base64
+import hashlib
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, jsonify, request
+
+
+def _sha(*parts):
+    return hashlib.sha1("".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def create_app(login="bench-user", build_seconds=3.0, build_jitter=1.0,
+               build_failure_rate=0.0, rate_limit=5000, rate_window=3600,
+               seed=None, accounts=None):
+    """
+    Builds the fake GitHub Flask app.
+
+    Args:
+        login (str): Login returned for the authenticated user.
+        build_seconds (float): Mean duration of a simulated Actions run.
+        build_jitter (float): Uniform +/- seconds added to each build.
+        build_failure_rate (float): Fraction of runs that conclude with failure.
+        rate_limit (int): Requests allowed per token per window.
+        rate_window (int): Length of the rate limit window in seconds.
+        seed (int): Optional RNG seed for reproducible builds.
+        accounts (dict): Optional {token: login} for several accounts; other
+            tokens authenticate as `login`.
+    """
+    fake = Flask("fake_github")
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    run_ids = itertools.count(1000)
+
+    repos = {}
+    limits = {}
+    calls = Counter()
+
+    def base_url():
+        return request.host_url.rstrip("/")
+
+    def repo_json(repo):
+        owner, name = repo["owner"], repo["name"]
+        return {
+            "id": repo["id"],
+            "name": name,
+            "full_name": f"{owner}/{name}",
+            "owner": {"login": owner},
+            "private": False,
+            "default_branch": "main",
+            "html_url": f"https://github.com/{owner}/{name}",
+            "url": f"{base_url()}/repos/{owner}/{name}",
+        }
+
+    def content_json(repo, path, entry):
+        owner, name = repo["owner"], repo["name"]
+        return {
+            "type": "file",
+            "encoding": "base64",
+            "name": path.rsplit("/", 1)[-1],
+            "path": path,
+            "sha": entry["sha"],
+            "size": len(entry["content"]),
+            "content": base64.b64encode(entry["content"]).decode("ascii"),
+            "url": f"{base_url()}/repos/{owner}/{name}/contents/{path}",
+        }
+
+    def commit_json(repo, sha):
+        owner, name = repo["owner"], repo["name"]
+        return {
+            "sha": sha,
+            "url": f"{base_url()}/repos/{owner}/{name}/commits/{sha}",
+        }
+
+    def not_found():
+        return jsonify(message="Not Found"), 404
+
+    def get_repo(owner, name):
+        return repos.get((owner, name))
+
+    def run_json(run):
+        status, conclusion = run["status"], None
+        if time.time() >= run["finishes_at"]:
+            status, conclusion = "completed", run["conclusion"]
+        elif time.time() >= run["created_at"] + 1:
+            status = "in_progress"
+        return {
+            "id": run["id"],
+            "name": "Deploy static site",
+            "path": ".github/workflows/deploy.yml",
+            "head_sha": run["head_sha"],
+            "status": status,
+            "conclusion": conclusion,
+            "created_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(run["created_at"])),
+            "run_started_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(run["created_at"])),
+            "updated_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ",
+                time.gmtime(min(time.time(), run["finishes_at"]))),
+        }
+
+    @fake.before_request
+    def rate_limit_check():
+        if request.path.startswith("/_bench"):
+            return None
+        token = request.headers.get("Authorization", "anonymous")
+        now = time.time()
+        with lock:
+            window = limits.get(token)
+            if window is None or now >= window["reset"]:
+                window = limits[token] = {"used": 0, "reset": now + rate_window}
+            window["used"] += 1
+            remaining = rate_limit - window["used"]
+            request.rate_headers = {
+                "X-RateLimit-Limit": str(rate_limit),
+                "X-RateLimit-Remaining": str(max(0, remaining)),
+                "X-RateLimit-Reset": str(int(window["reset"])),
+            }
+            parts = request.path.strip("/").split("/")
+            calls[parts[2] if parts[0] == "repos" and len(parts) > 2 else "_user"] += 1
+        if remaining < 0:
+            resp = jsonify(message="API rate limit exceeded")
+            resp.status_code = 403
+            return resp
+
+    @fake.after_request
+    def add_rate_headers(resp):
+        for key, value in getattr(request, "rate_headers", {}).items():
+            resp.headers[key] = value
+        return resp
+
+    def current_login():
+        token = request.headers.get("Authorization", "").split()[-1:]
+        return (accounts or {}).get(token[0] if token else None, login)
+
+    @fake.route("/user", methods=["GET"])
+    def get_user():
+        user = current_login()
+        return jsonify({"login": user, "id": 1, "type": "User",
+                        "url": f"{base_url()}/users/{user}"})
+
+    @fake.route("/user/repos", methods=["POST"])
+    def create_repo():
+        body = request.get_json()
+        owner = current_login()
+        with lock:
+            key = (owner, body["name"])
+            if key in repos:
+                return jsonify(message="name already exists on this account"), 422
+            repos[key] = {"id": len(repos) + 1, "owner": owner, "name": body["name"],
+                          "files": {}, "commits": [], "pages": None, "runs": [],
+                          "objects": {}, "refs": {}}
+            return jsonify(repo_json(repos[key])), 201
+
+    @fake.route("/repos/<owner>/<name>", methods=["GET"])
+    def repo_detail(owner, name):
+        repo = get_repo(owner, name)
+        return jsonify(repo_json(repo)) if repo else not_found()
+
+    @fake.route("/repos/<owner>/<name>/contents/<path:path>", methods=["GET"])
+    def get_contents(owner, name, path):
+        repo = get_repo(owner, name)
+        if not repo or path not in repo["files"]:
+            return not_found()
+        return jsonify(content_json(repo, path, repo["files"][path]))
+
+    @fake.route("/repos/<owner>/<name>/contents/<path:path>", methods=["PUT"])
+    def put_contents(owner, name, path):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        body = request.get_json()
+        content = base64.b64decode(body["content"])
+        with lock:
+            existing = repo["files"].get(path)
+            if existing and body.get("sha") != existing["sha"]:
+                return jsonify(message=f"{path} does not match {body.get('sha')}"), 409
+            if not existing and body.get("sha"):
+                return not_found()
+            entry = {"content": content, "sha": _sha("blob", path, content)}
+            repo["files"][path] = entry
+            commit_sha = _sha("commit", owner, name, path, len(repo["commits"]), time.time())
+            repo["commits"].insert(0, commit_sha)
+            if path == "app.py" and ".github/workflows/deploy.yml" in repo["files"]:
+                created = time.time()
+                duration = max(0.5, build_seconds + rng.uniform(-build_jitter, build_jitter))
+                repo["runs"].insert(0, {
+                    "id": next(run_ids),
+                    "head_sha": commit_sha,
+                    "status": "queued",
+                    "conclusion": "failure" if rng.random() < build_failure_rate else "success",
+                    "created_at": created,
+                    "finishes_at": created + duration,
+                })
+        return jsonify({"content": content_json(repo, path, entry),
+                        "commit": commit_json(repo, commit_sha)}), 201 if not existing else 200
+
+    @fake.route("/repos/<owner>/<name>/commits", methods=["GET"])
+    def list_commits(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        return jsonify([commit_json(repo, sha) for sha in repo["commits"][:30]])
+
+    @fake.route("/repos/<owner>/<name>/pages", methods=["GET", "POST", "PUT"])
+    def pages(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        if request.method == "GET":
+            return jsonify(repo["pages"]) if repo["pages"] else not_found()
+        body = request.get_json() or {}
+        if request.method == "POST" and repo["pages"]:
+            return jsonify(message="GitHub Pages is already enabled."), 409
+        if request.method == "PUT" and not repo["pages"]:
+            return not_found()
+        repo["pages"] = {
+            "url": f"{base_url()}/repos/{owner}/{name}/pages",
+            "html_url": f"https://{owner}.github.io/{name}/",
+            "build_type": body.get("build_type", "legacy"),
+            "source": body.get("source"),
+        }
+        return (jsonify(repo["pages"]), 201) if request.method == "POST" else ("", 204)
+
+    def git_url(repo, kind, sha):
+        return f"{base_url()}/repos/{repo['owner']}/{repo['name']}/git/{kind}/{sha}"
+
+    def git_commit_json(repo, sha):
+        commit = repo["objects"][sha]
+        return {"sha": sha, "url": git_url(repo, "commits", sha),
+                "message": commit["message"],
+                "tree": {"sha": commit["tree"], "url": git_url(repo, "trees", commit["tree"])},
+                "parents": [{"sha": p, "url": git_url(repo, "commits", p)}
+                            for p in commit["parents"]]}
+
+    def ref_json(repo, ref):
+        sha = repo["refs"][ref]
+        return {"ref": ref, "url": git_url(repo, "refs", ref[len("refs/"):]),
+                "object": {"type": "commit", "sha": sha, "url": git_url(repo, "commits", sha)}}
+
+    @fake.route("/repos/<owner>/<name>/git/blobs", methods=["POST"])
+    def create_blob(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        body = request.get_json()
+        content = body["content"]
+        data = (base64.b64decode(content) if body.get("encoding") == "base64"
+                else content.encode("utf-8"))
+        sha = _sha("blob", data)
+        with lock:
+            repo["objects"][sha] = {"type": "blob", "content": data}
+        return jsonify({"sha": sha, "url": git_url(repo, "blobs", sha)}), 201
+
+    @fake.route("/repos/<owner>/<name>/git/trees", methods=["POST"])
+    def create_tree(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        entries = []
+        with lock:
+            for item in request.get_json()["tree"]:
+                sha = item.get("sha")
+                if "content" in item:
+                    data = item["content"].encode("utf-8")
+                    sha = _sha("blob", data)
+                    repo["objects"][sha] = {"type": "blob", "content": data}
+                if sha not in repo["objects"]:
+                    return jsonify(message=f"Invalid tree item {item['path']}"), 422
+                entries.append({"path": item["path"], "mode": item["mode"],
+                                "type": "blob", "sha": sha})
+            entries.sort(key=lambda e: e["path"])
+            sha = _sha("tree", *(f"{e['path']}:{e['sha']}" for e in entries))
+            repo["objects"][sha] = {"type": "tree", "tree": entries}
+        return jsonify({"sha": sha, "url": git_url(repo, "trees", sha), "tree": entries}), 201
+
+    @fake.route("/repos/<owner>/<name>/git/trees/<path:tree_ish>", methods=["GET"])
+    def get_tree(owner, name, tree_ish):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        with lock:
+            if tree_ish == repo_json(repo)["default_branch"]:
+                # Branch name: the tree of the files committed to main.
+                if not repo["files"]:
+                    return jsonify(message="Git Repository is empty."), 409
+                entries = [{"path": path, "mode": "100644", "type": "blob", "sha": entry["sha"]}
+                           for path, entry in sorted(repo["files"].items())]
+                sha = _sha("tree", *(f"{e['path']}:{e['sha']}" for e in entries))
+            elif repo["objects"].get(tree_ish, {}).get("type") == "tree":
+                sha, entries = tree_ish, repo["objects"][tree_ish]["tree"]
+            else:
+                return not_found()
+        return jsonify({"sha": sha, "url": git_url(repo, "trees", sha),
+                        "tree": entries, "truncated": False})
+
+    @fake.route("/repos/<owner>/<name>/git/commits", methods=["POST"])
+    def create_git_commit(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        body = request.get_json()
+        with lock:
+            sha = _sha("gitcommit", body["tree"], *body.get("parents", []), time.time())
+            repo["objects"][sha] = {"type": "commit", "message": body["message"],
+                                    "tree": body["tree"], "parents": body.get("parents", [])}
+            return jsonify(git_commit_json(repo, sha)), 201
+
+    @fake.route("/repos/<owner>/<name>/git/commits/<sha>", methods=["GET"])
+    def get_git_commit(owner, name, sha):
+        repo = get_repo(owner, name)
+        if not repo or repo["objects"].get(sha, {}).get("type") != "commit":
+            return not_found()
+        return jsonify(git_commit_json(repo, sha))
+
+    @fake.route("/repos/<owner>/<name>/git/ref/<path:ref>", methods=["GET"])
+    def get_ref(owner, name, ref):
+        repo = get_repo(owner, name)
+        if not repo or f"refs/{ref}" not in repo["refs"]:
+            return not_found()
+        return jsonify(ref_json(repo, f"refs/{ref}"))
+
+    @fake.route("/repos/<owner>/<name>/git/refs", methods=["POST"])
+    def create_ref(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        body = request.get_json()
+        with lock:
+            if body["ref"] in repo["refs"]:
+                return jsonify(message="Reference already exists"), 422
+            repo["refs"][body["ref"]] = body["sha"]
+            return jsonify(ref_json(repo, body["ref"])), 201
+
+    @fake.route("/repos/<owner>/<name>/git/refs/<path:ref>", methods=["PATCH"])
+    def update_ref(owner, name, ref):
+        repo = get_repo(owner, name)
+        if not repo or f"refs/{ref}" not in repo["refs"]:
+            return not_found()
+        with lock:
+            repo["refs"][f"refs/{ref}"] = request.get_json()["sha"]
+            return jsonify(ref_json(repo, f"refs/{ref}"))
+
+    @fake.route("/repos/<owner>/<name>/actions/runs", methods=["GET"])
+    def list_runs(owner, name):
+        repo = get_repo(owner, name)
+        if not repo:
+            return not_found()
+        head_sha = request.args.get("head_sha")
+        runs = [run_json(r) for r in repo["runs"]
+                if not head_sha or r["head_sha"] == head_sha]
+        return jsonify({"total_count": len(runs), "workflow_runs": runs})
+
+    @fake.route("/repos/<owner>/<name>/actions/runs/<int:run_id>", methods=["GET"])
+    def get_run(owner, name, run_id):
+        repo = get_repo(owner, name)
+        for run in (repo or {}).get("runs", []):
+            if run["id"] == run_id:
+                return jsonify(run_json(run))
+        return not_found()
+
+    @fake.route("/_bench/stats", methods=["GET"])
+    def bench_stats():
+        with lock:
+            return jsonify({"calls_by_repo": dict(calls), "total_calls": sum(calls.values())})
+
+    fake.bench_calls = calls
+    return fake
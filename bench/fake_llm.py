@@ -0,0 +1,177 @@
+"""
+OpenAI-compatible stand-in for AIPIPE used by the offline benchmark.
+
+Answers POST /v1/chat/completions (and the AIPIPE /openrouter/ prefix) with a
+response shaped like the prompt asked for: a runnable app.py for code prompts,
+a deploy.yml for workflow prompts and plain text otherwise.
+"""
+import hashlib
+import random
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+
+FAKE_APP_CODE = '''import json
+import os
+import sys
+
+from flask import Flask, render_template_string
+
+app = Flask(__name__)
+OUTPUT_DIR = "output"
+PAGE = "<html><body><h1>{{ title }}</h1></body></html>"
+
+
+def load_data():
+    with open("data.json") as f:
+        return json.load(f)
+
+
+@app.route("/")
+def index():
+    data = load_data()
+    return render_template_string(PAGE, title=len(data["attachments"]))
+
+
+if __name__ == "__main__":
+    if "--export" in sys.argv:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        with app.app_context(), app.test_request_context():
+            with open(os.path.join(OUTPUT_DIR, "index.html"), "w") as f:
+                f.write(index())
+    else:
+        app.run(port=5000)
+'''
+
+FAKE_WORKFLOW = '''name: Deploy static site
+on:
+  push:
+    branches: [main]
+    paths: [app.py]
+  workflow_dispatch:
+permissions:
+  contents: read
+  pages: write
+  id-token: write
+concurrency:
+  group: pages
+jobs:
+  build:
+    runs-on: ubuntu-latest
+    steps:
+      - uses: actions/checkout@v4
+      - uses: actions/setup-python@v4
+        with:
+          python-version: "3.11"
+      - run: pip install -r requirements.txt
+      - run: python app.py --export
+      - uses: actions/upload-pages-artifact@v4
+        with:
+          path: output/
+  deploy:
+    needs: build
+    runs-on: ubuntu-latest
+    environment: github-pages
+    steps:
+      - uses: actions/deploy-pages@v4
+'''
+
+
+def _pad(text, size, comment):
+    """Pads text with comment lines until it reaches roughly `size` chars."""
+    filler = f"{comment} benchmark filler line\n"
+    missing = max(0, size - len(text))
+    return text + filler * (missing // len(filler))
+
+
+# Like OpenAI's prompt caching: prompts of at least 1024 tokens are cached in
+# 128-token steps of their prefix (4 chars per token here).
+CACHE_MIN_CHARS = 4096
+CACHE_STEP_CHARS = 512
+
+
+def _cached_chars(prompt, seen):
+    """Length of the longest cached prefix of the prompt; caches its prefixes."""
+    if len(prompt) < CACHE_MIN_CHARS:
+        return 0
+    cached = 0
+    for end in range(CACHE_STEP_CHARS, len(prompt) + 1, CACHE_STEP_CHARS):
+        digest = hashlib.sha256(prompt[:end].encode("utf-8")).digest()
+        if digest in seen and end == cached + CACHE_STEP_CHARS:
+            cached = end
+        seen.add(digest)
+    return cached if cached >= CACHE_MIN_CHARS else 0
+
+
+def _answer(prompt, size):
+    if "app.py" in prompt and ("TASK: Build" in prompt or "TASK: Update" in prompt):
+        return _pad(FAKE_APP_CODE, size, "#")
+    if "GitHub Actions workflow" in prompt:
+        return _pad(FAKE_WORKFLOW, size, "#")
+    if "requirements.txt" in prompt and "README" not in prompt:
+        return "flask\n"
+    if "license" in prompt.lower() and "README" not in prompt:
+        return "MIT License\n\nCopyright (c) benchmark\n"
+    return _pad("# Benchmark README\n\n", size, "")
+
+
+def create_app(latency=0.5, jitter=0.2, response_size=4000, seed=None):
+    """
+    Builds the fake LLM Flask app.
+
+    Args:
+        latency (float): Mean seconds to wait before answering.
+        jitter (float): Uniform +/- seconds added to the latency.
+        response_size (int): Approximate size of generated content in chars.
+        seed (int): Optional RNG seed for reproducible latencies.
+    """
+    fake = Flask("fake_llm")
+    rng = random.Random(seed)
+    stats = {"calls": 0, "prompt_chars": 0, "completion_chars": 0, "cached_chars": 0}
+    prefixes = set()
+    lock = threading.Lock()
+
+    @fake.route("/v1/chat/completions", methods=["POST"])
+    @fake.route("/openrouter/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        body = request.get_json()
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        with lock:
+            delay = max(0.0, latency + rng.uniform(-jitter, jitter))
+        time.sleep(delay)
+
+        content = _answer(prompt, response_size)
+        with lock:
+            cached = _cached_chars(prompt, prefixes)
+            stats["calls"] += 1
+            stats["prompt_chars"] += len(prompt)
+            stats["completion_chars"] += len(content)
+            stats["cached_chars"] += cached
+
+        return jsonify({
+            "id": f"chatcmpl-bench-{stats['calls']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "prompt_tokens_details": {"cached_tokens": cached // 4},
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4,
+            },
+        })
+
+    @fake.route("/_bench/stats", methods=["GET"])
+    def bench_stats():
+        with lock:
+            return jsonify(dict(stats))
+
+    fake.bench_stats = stats
+    return fake
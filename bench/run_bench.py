@@ -0,0 +1,319 @@
+"""
+Offline end-to-end benchmark for `process_request`.
+
+Starts the fake LLM and GitHub servers on localhost, points app.py at them
+through its environment variables, replays the sample payloads at a given
+concurrency and reports jobs/min, per-stage latency percentiles (from each
+job's trace) and API calls per job. Exits non-zero when a result regresses past bench/thresholds.json.
+
+Usage:
+    python -m bench.run_bench --concurrency 4 --repeat 3
+    python -m bench.run_bench --payloads test/data/test2.json --no-check
+    python -m bench.run_bench --publish-mode direct
+"""
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+import tracing
+from bench import fake_github, fake_llm
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_THRESHOLDS = os.path.join(ROOT, "bench", "thresholds.json")
+# Reported first and in this order; any other span names follow.
+STAGES = [
+    "provision_repo", "find_reusable_code", "generate_code", "generate_readme", "generate_requirements",
+    "generate_license", "export_site", "generate_workflow", "ensure_pages_enabled",
+    "commit_files", "upsert_github_file", "wait_for_actions_run", "publish_site",
+    "notify_evaluation", "evaluation.notify",
+]
+
+logger = logging.getLogger("bench")
+
+
+def serve(flask_app):
+    """Runs a Flask app on a free localhost port in a daemon thread."""
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def create_eval_sink():
+    """Fake evaluation endpoint that records every callback it receives."""
+    sink = Flask("eval_sink")
+    received = {}
+
+    @sink.route("/evaluate", methods=["POST"])
+    def evaluate():
+        body = request.get_json()
+        received[(body["task"], body["round"], body["nonce"])] = body
+        return jsonify(status="ok"), 200
+
+    sink.received = received
+    return sink
+
+
+def load_payloads(patterns):
+    """Loads request payloads from .json and .jsonl files, skipping bad ones."""
+    payloads = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path) as f:
+                    if path.endswith(".jsonl"):
+                        payloads.extend(json.loads(line) for line in f if line.strip())
+                    else:
+                        payloads.append(json.load(f))
+            except ValueError as e:
+                logger.warning(f"Skipping unparsable payload file {path}: {e}")
+    return [p for p in payloads if "task" in p and "round" in p]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def collect_job(otlp):
+    """Turns an exported trace into a job record with per-stage durations."""
+    attrs, durations = tracing.summarize(otlp)
+    return {"task": attrs.get("task"), "round": int(attrs.get("round", 0)),
+            "nonce": attrs.get("nonce"), "stages": durations}
+
+
+def app_env(llm_url, github_url, publish_mode="actions", llm_tokens=1):
+    """Environment pointing app.py at the fake servers."""
+    return {
+        "PIPE": "OPENAI",
+        "AIPIPE_URL": f"{llm_url}/v1/chat/completions",
+        "AIPIPE_TOKEN": "bench-token",
+        "GITHUB_API_URL": github_url,
+        "GITHUB_TOKEN": "bench-token",
+        "GITHUB_USER": "bench-user",
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "bench-unused"),
+        # Locking resolves against the package index; keep the bench offline.
+        "LOCK_REQUIREMENTS": "0",
+        "PUBLISH_MODE": publish_mode,
+        # The fake servers' tokens are all the export could read.
+        "EXPORT_SAME_USER": "1",
+        "AIPIPE_TOKENS": ",".join(f"bench-token{i}" for i in range(llm_tokens)),
+    }
+
+
+def run_jobs(app_module, payloads, concurrency):
+    """
+    Replays payloads through process_request. Rounds of a task run in order,
+    different tasks run concurrently.
+    """
+    by_task = defaultdict(list)
+    for payload in payloads:
+        by_task[payload["task"]].append(payload)
+
+    results = []
+
+    def exporter(otlp):
+        results.append(collect_job(otlp))
+
+    tracing.add_exporter(exporter)
+
+    def run_task(task_payloads):
+        for payload in sorted(task_payloads, key=lambda p: p["round"]):
+            app_module.process_request(payload)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run_task, by_task.values()))
+    finally:
+        tracing.remove_exporter(exporter)
+    return results
+
+
+def build_report(results, wall_seconds, sink, llm_url, github_url):
+    llm_stats = requests.get(f"{llm_url}/_bench/stats").json()
+    llm_calls = llm_stats["calls"]
+    github_calls = requests.get(f"{github_url}/_bench/stats").json()["total_calls"]
+    jobs = len(results) or 1
+    succeeded = sum(1 for r in results
+                    if (r["task"], r["round"], r["nonce"]) in sink.received)
+
+    seen = {name for r in results for name in r["stages"]}
+    names = [n for n in STAGES if n in seen]
+    names += sorted(seen - set(names) - {"job"}) + ["job"]
+    stages = {}
+    for name in names:
+        values = [r["stages"][name] for r in results if name in r["stages"]]
+        stages[name] = {
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "p99": round(percentile(values, 99), 3),
+        }
+
+    return {
+        "jobs": len(results),
+        "succeeded": succeeded,
+        "success_rate": round(succeeded / jobs, 3),
+        "wall_seconds": round(wall_seconds, 2),
+        "jobs_per_min": round(len(results) / (wall_seconds / 60), 2) if wall_seconds else 0.0,
+        "stages": stages,
+        "calls_per_job": {
+            "llm": round(llm_calls / jobs, 2),
+            "github": round(github_calls / jobs, 2),
+        },
+        "prompt_cache_share": round(
+            llm_stats["cached_chars"] / max(llm_stats["prompt_chars"], 1), 3),
+    }
+
+
+def check_thresholds(report, thresholds):
+    """Returns a list of human readable regressions, empty if none."""
+    failures = []
+    if report["jobs_per_min"] < thresholds.get("min_jobs_per_min", 0):
+        failures.append(
+            f"jobs/min {report['jobs_per_min']} < {thresholds['min_jobs_per_min']}")
+    if report["success_rate"] < thresholds.get("min_success_rate", 0):
+        failures.append(
+            f"success rate {report['success_rate']} < {thresholds['min_success_rate']}")
+    for stage, limit in thresholds.get("max_p95_seconds", {}).items():
+        value = report["stages"].get(stage, {}).get("p95", 0)
+        if value > limit:
+            failures.append(f"{stage} p95 {value}s > {limit}s")
+    for kind, limit in thresholds.get("max_calls_per_job", {}).items():
+        value = report["calls_per_job"].get(kind, 0)
+        if value > limit:
+            failures.append(f"{kind} calls/job {value} > {limit}")
+    return failures
+
+
+def print_report(report):
+    print(f"\nJobs: {report['jobs']} ({report['succeeded']} succeeded) "
+          f"in {report['wall_seconds']}s -> {report['jobs_per_min']} jobs/min")
+    print(f"API calls per job: LLM {report['calls_per_job']['llm']}, "
+          f"GitHub {report['calls_per_job']['github']}")
+    print(f"Prompt share served from the LLM prefix cache: {report['prompt_cache_share']}")
+    for provider, calls in report.get("credentials", {}).items():
+        if len(calls) > 1:
+            print(f"{provider} credential calls: {calls}")
+    print(f"\n{'stage':<24}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, pct in report["stages"].items():
+        print(f"{name:<24}{pct['p50']:>10.3f}{pct['p95']:>10.3f}{pct['p99']:>10.3f}")
+
+
+def parse_args(argv, settings):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payloads", nargs="+",
+                        default=[os.path.join(ROOT, "test", "data", "*.json")])
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--no-check", action="store_true",
+                        help="Report only; do not fail on threshold regressions.")
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Keep app.py and fake server request logs.")
+    parser.add_argument("--concurrency", type=int, default=settings.get("concurrency", 2))
+    parser.add_argument("--repeat", type=int, default=settings.get("repeat", 1),
+                        help="Replay the payload set N times under distinct task ids.")
+    parser.add_argument("--llm-latency", type=float, default=settings.get("llm_latency", 0.5))
+    parser.add_argument("--llm-jitter", type=float, default=settings.get("llm_jitter", 0.2))
+    parser.add_argument("--llm-response-size", type=int,
+                        default=settings.get("llm_response_size", 4000))
+    parser.add_argument("--build-seconds", type=float, default=settings.get("build_seconds", 3.0))
+    parser.add_argument("--build-jitter", type=float, default=settings.get("build_jitter", 1.0))
+    parser.add_argument("--rate-limit", type=int, default=settings.get("rate_limit", 5000))
+    parser.add_argument("--rate-window", type=int, default=settings.get("rate_window", 3600))
+    parser.add_argument("--publish-mode", choices=["actions", "direct"],
+                        default=settings.get("publish_mode", "actions"))
+    parser.add_argument("--github-accounts", type=int,
+                        default=settings.get("github_accounts", 1),
+                        help="Spread tasks over N fake GitHub accounts.")
+    parser.add_argument("--llm-tokens", type=int, default=settings.get("llm_tokens", 1),
+                        help="Pool N AIPIPE tokens.")
+    parser.add_argument("--seed", type=int, default=settings.get("seed"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s',
+                        level=logging.WARNING)
+    thresholds_path = DEFAULT_THRESHOLDS
+    if argv and "--thresholds" in argv:
+        thresholds_path = argv[argv.index("--thresholds") + 1]
+    with open(thresholds_path) as f:
+        thresholds = json.load(f)
+    args = parse_args(argv, thresholds.get("settings", {}))
+
+    llm = fake_llm.create_app(args.llm_latency, args.llm_jitter,
+                              args.llm_response_size, args.seed)
+    accounts = {f"bench-token{i}": f"bench-user{i}" for i in range(args.github_accounts)}
+    github = fake_github.create_app(
+        login="bench-user", build_seconds=args.build_seconds,
+        build_jitter=args.build_jitter, rate_limit=args.rate_limit,
+        rate_window=args.rate_window, seed=args.seed, accounts=accounts)
+    sink = create_eval_sink()
+    _, llm_url = serve(llm)
+    _, github_url = serve(github)
+    _, sink_url = serve(sink)
+
+    # app.py reads its configuration at import time.
+    os.environ.update(app_env(llm_url, github_url, args.publish_mode, args.llm_tokens))
+    # A fresh job store per run: no reuse hits or task/account assignments
+    # left over from earlier runs.
+    os.environ.setdefault("JOB_DB_PATH", os.path.join(
+        tempfile.mkdtemp(prefix="bench-"), "jobs.sqlite3"))
+    if args.github_accounts > 1:
+        os.environ["GITHUB_ACCOUNTS"] = ",".join(
+            f"{login}:{token}" for token, login in accounts.items())
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    payloads = []
+    for i in range(args.repeat):
+        for payload in load_payloads(args.payloads):
+            payload = dict(payload)
+            payload["task"] = f"{payload['task']}-bench{i}"
+            payload["evaluation_url"] = f"{sink_url}/evaluate"
+            payloads.append(payload)
+    if not payloads:
+        print("No payloads to replay.")
+        return 2
+
+    start = time.perf_counter()
+    results = run_jobs(app_module, payloads, args.concurrency)
+    report = build_report(results, time.perf_counter() - start, sink, llm_url, github_url)
+    report["credentials"] = {
+        provider: {label: stats["calls"] for label, stats in pool.items()}
+        for provider, pool in app_module.credential_snapshot().items()}
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.no_check:
+        return 0
+    failures = check_thresholds(report, thresholds)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,194 @@
+"""
+Offline multi-node benchmark: several `app.py worker` nodes on one machine.
+
+Serves a job store (cluster.py) and the fake LLM/GitHub servers from this
+process, starts N worker nodes as separate process groups, queues round 1
+of every payload's task and each task's round 2 once its round 1 is done,
+and reports which node ran each job. `--kill-after` SIGKILLs the node
+owning the most tasks mid-run, to show them failing over to the others once
+its lease ends.
+
+Usage:
+    python -m bench.run_cluster --nodes 3 --repeat 3
+    python -m bench.run_cluster --nodes 3 --repeat 3 --kill-after 20
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import cluster
+from bench import fake_github, fake_llm
+from bench.run_bench import ROOT, app_env, create_eval_sink, load_payloads, serve
+from jobs import JobStore
+
+
+logger = logging.getLogger("bench")
+
+
+def with_round_two(payloads):
+    """Adds a round-2 update for every task that only has a round 1."""
+    rounds = defaultdict(dict)
+    for payload in payloads:
+        rounds[payload["task"]][payload["round"]] = payload
+    for task, by_round in rounds.items():
+        if 2 not in by_round and 1 in by_round:
+            update = dict(by_round[1], round=2, nonce=f"{by_round[1]['nonce']}-r2")
+            update["brief"] = f"Update the app: also show a footer. {update['brief']}"
+            by_round[2] = update
+    return rounds
+
+
+def start_node(node_id, env, log_dir, threads):
+    log = open(os.path.join(log_dir, f"{node_id}.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "app.py", "worker", "--processes", "1", "--threads", str(threads)],
+        cwd=ROOT, env=dict(env, NODE_ID=node_id), stdout=log, stderr=subprocess.STDOUT,
+        start_new_session=True)
+
+
+def stop_node(proc, sig=signal.SIGTERM):
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        return
+    try:
+        proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payloads", nargs="+",
+                        default=[os.path.join(ROOT, "test", "data", "*.json")])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=2, help="Worker threads per node.")
+    parser.add_argument("--repeat", type=int, default=2,
+                        help="Replay the payload set N times under distinct task ids.")
+    parser.add_argument("--kill-after", type=float,
+                        help="SIGKILL the busiest node this many seconds into the run.")
+    parser.add_argument("--lease", type=float, default=15.0,
+                        help="NODE_LEASE_SECONDS of the nodes.")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--build-seconds", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s',
+                        level=logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="bench-cluster-")
+
+    store = JobStore(os.path.join(work_dir, "jobs.sqlite3"))
+    _, store_url = serve(cluster.create_store_app(store, token=None))
+    _, llm_url = serve(fake_llm.create_app(args.llm_latency, 0.2, 4000, 1234))
+    _, github_url = serve(fake_github.create_app(
+        build_seconds=args.build_seconds, build_jitter=0.2, seed=1234))
+    sink = create_eval_sink()
+    _, sink_url = serve(sink)
+
+    rounds = {}
+    for i in range(args.repeat):
+        payloads = []
+        for payload in load_payloads(args.payloads):
+            payload = dict(payload, task=f"{payload['task']}-cluster{i}",
+                           evaluation_url=f"{sink_url}/evaluate")
+            payloads.append(payload)
+        rounds.update(with_round_two(payloads))
+    if not rounds:
+        print("No payloads to replay.")
+        return 2
+
+    env = dict(os.environ, **app_env(llm_url, github_url),
+               JOB_STORE_URL=store_url, NODE_LEASE_SECONDS=str(args.lease),
+               JOB_STORE_TOKEN="", PYTHONUNBUFFERED="1",
+               # One process per node: the per-task cache lives in the process.
+               WORKER_MAX_PROCESSES="1")
+    env.pop("JOB_DB_PATH", None)
+    node_ids = [f"node-{i}" for i in range(args.nodes)]
+    nodes = {node_id: start_node(node_id, env, work_dir, args.threads) for node_id in node_ids}
+    print(f"Started {args.nodes} nodes; logs and job store in {work_dir}")
+
+    worker_nodes = {}  # "host:pid" -> node, learned from heartbeats
+    queued = {}  # (task, round) -> job id
+    killed = None
+    start = time.perf_counter()
+    try:
+        for task, by_round in rounds.items():
+            queued[(task, 1)] = store.enqueue(by_round[1])[0]
+        while time.perf_counter() - start < args.timeout:
+            time.sleep(0.5)
+            for row in store._conn().execute(
+                    "SELECT id, node FROM workers WHERE node IS NOT NULL"):
+                worker_nodes[row["id"]] = row["node"]
+            for (task, round_num), job_id in list(queued.items()):
+                job = store.get(job_id)
+                if (round_num == 1 and job["status"] in ("done", "failed")
+                        and (task, 2) not in queued):
+                    queued[(task, 2)] = store.enqueue(rounds[task][2])[0]
+            if args.kill_after and not killed and time.perf_counter() - start > args.kill_after:
+                owners = Counter(store.task_owner(task) for task in rounds)
+                killed = owners.most_common(1)[0][0] or node_ids[0]
+                print(f"Killing {killed} at {time.perf_counter() - start:.1f}s")
+                stop_node(nodes[killed], signal.SIGKILL)
+            jobs = [store.get(job_id) for job_id in queued.values()]
+            if len(queued) == 2 * len(rounds) and all(
+                    j["status"] in ("done", "failed") for j in jobs):
+                break
+        wall = time.perf_counter() - start
+    finally:
+        for node_id, proc in nodes.items():
+            if node_id != killed:
+                stop_node(proc)
+
+    jobs = {key: store.get(job_id) for key, job_id in queued.items()}
+    ran_on = {}
+    for key, job in jobs.items():
+        proc_id = (job["worker"] or "").rpartition(":")[0]
+        ran_on[key] = worker_nodes.get(proc_id, "?") if job["status"] == "done" else None
+    per_node = Counter(node for node in ran_on.values() if node)
+    moved = sorted(task for task in rounds
+                   if ran_on.get((task, 1)) and ran_on.get((task, 2))
+                   and ran_on[(task, 1)] != ran_on[(task, 2)])
+    counters = store.counters()
+    lookups = counters.get("task_cache.lookups", 0)
+    report = {
+        "nodes": args.nodes, "killed": killed,
+        "jobs": len(jobs),
+        "done": sum(1 for j in jobs.values() if j["status"] == "done"),
+        "failed": sum(1 for j in jobs.values() if j["status"] == "failed"),
+        "unfinished": sum(1 for j in jobs.values() if j["status"] not in ("done", "failed")),
+        "callbacks": len(sink.received),
+        "wall_seconds": round(wall, 1),
+        "jobs_per_node": dict(sorted(per_node.items())),
+        "tasks_moved": moved,
+        "retried_jobs": sum(1 for j in jobs.values() if j["attempts"] > 1),
+        "task_cache_hit_rate": round(counters.get("task_cache.hits", 0) / lookups, 3)
+        if lookups else None,
+    }
+
+    print(f"\nJobs: {report['jobs']} ({report['done']} done, {report['failed']} failed, "
+          f"{report['unfinished']} unfinished) in {report['wall_seconds']}s")
+    print(f"Jobs per node: {report['jobs_per_node']}")
+    print(f"Tasks whose round 2 ran on another node: {len(moved)} {moved}")
+    print(f"Jobs retried after a node failure: {report['retried_jobs']}")
+    print(f"Round-2 task cache hit rate: {report['task_cache_hit_rate']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["done"] == report["jobs"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,123 @@
+"""
+Network front for the job store, for running several nodes.
+
+One machine runs `python app.py store`, which serves its SQLite JobStore
+over HTTP; every node points JOB_STORE_URL at it and gets a RemoteJobStore
+with the same methods instead of opening the file itself:
+
+    POST /rpc/<method>  {"args": [...], "kwargs": {...}} -> {"result": ...}
+
+Errors come back as {"error": <exception class>, "message": ...}; QueueFull
+is raised again on the node, anything else as RemoteStoreError.
+
+Environment:
+    JOB_STORE_TOKEN: Shared secret; when set, the server only answers
+        requests carrying it as a bearer token, and clients send it. The
+        store only binds to a non-loopback address when it is set.
+"""
+import hmac
+import ipaddress
+import logging
+import os
+import threading
+
+import requests
+from flask import Flask, jsonify, request
+
+from jobs import QueueFull
+
+
+logger = logging.getLogger(__name__)
+
+JOB_STORE_TOKEN = os.getenv("JOB_STORE_TOKEN")
+RPC_TIMEOUT = 30
+
+# JobStore methods callable over the network.
+RPC_METHODS = frozenset({
+    "enqueue", "claim", "finish", "superseded_by", "supersede", "stage_started",
+    "stage_finished", "get", "list_jobs", "queue_position", "prune", "depth", "load",
+    "average_duration", "capacity", "projected_start", "record_generation",
+    "generations", "generation_code", "task_head", "task_account", "assign_account",
+    "account_loads", "incr", "counters", "is_busy", "heartbeat", "live_nodes",
+    "task_owner", "release_node", "worker_stats", "live_workers", "requeue_worker",
+    "recover_stale",
+})
+
+
+class RemoteStoreError(Exception):
+    pass
+
+
+def is_loopback(host):
+    """Whether a bind address only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def create_store_app(store, token=JOB_STORE_TOKEN):
+    """Flask app answering JobStore calls for the nodes."""
+    server = Flask("job_store")
+
+    @server.route("/rpc/<method>", methods=["POST"])
+    def rpc(method):
+        if token and not hmac.compare_digest(
+                request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return jsonify(error="Unauthorized", message="bad store token"), 401
+        if method not in RPC_METHODS:
+            return jsonify(error="NotFound", message=f"no method {method}"), 404
+        body = request.get_json(silent=True) or {}
+        try:
+            result = getattr(store, method)(*body.get("args", []), **body.get("kwargs", {}))
+        except QueueFull as e:
+            return jsonify(error="QueueFull", message=str(e)), 503
+        except Exception as e:
+            logger.error(f"Store call {method} failed: {e}", exc_info=True)
+            return jsonify(error=type(e).__name__, message=str(e)), 500
+        return jsonify(result=result), 200
+
+    @server.route("/health", methods=["GET"])
+    def health():
+        return jsonify(status="ok", depth=store.depth(), nodes=store.live_nodes()), 200
+
+    return server
+
+
+class RemoteJobStore:
+    """JobStore stand-in that forwards every call to a store server."""
+
+    def __init__(self, url, token=JOB_STORE_TOKEN):
+        self.url = url.rstrip("/")
+        self.token = token
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            if self.token:
+                session.headers["Authorization"] = f"Bearer {self.token}"
+            self._local.session = session
+        return session
+
+    def call(self, method, *args, **kwargs):
+        resp = self._session().post(f"{self.url}/rpc/{method}",
+                                    json={"args": args, "kwargs": kwargs},
+                                    timeout=RPC_TIMEOUT)
+        try:
+            body = resp.json()
+        except ValueError:
+            raise RemoteStoreError(f"{method}: HTTP {resp.status_code} {resp.text[:200]}")
+        if resp.status_code == 200:
+            return body.get("result")
+        if body.get("error") == "QueueFull":
+            raise QueueFull(body.get("message"))
+        raise RemoteStoreError(f"{method}: {body.get('error')}: {body.get('message')}")
+
+    def __getattr__(self, name):
+        if name not in RPC_METHODS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
@@ -0,0 +1,204 @@
+"""
+Pools of API credentials per provider (AIPIPE, Gemini, GitHub).
+
+`CredentialPool.lease()` hands out the credential with the lowest load per
+unit of remaining quota among the healthy ones, and callers `report` each
+call's outcome so exhausted or failing credentials cool down:
+
+    rate limited (429):     Retry-After, else RATE_LIMIT_COOLDOWN seconds
+    rejected (401/403):     AUTH_COOLDOWN seconds
+    errors (5xx, network):  ERROR_COOLDOWN seconds, doubled per consecutive
+                            failure up to MAX_ERROR_COOLDOWN
+
+When every credential is cooling down the one that recovers first is used,
+so a call is never refused outright.
+
+Environment:
+    AIPIPE_TOKENS: Comma-separated AIPIPE tokens (default: AIPIPE_TOKEN).
+    GEMINI_API_KEYS: Comma-separated Gemini keys (default: GEMINI_API_KEY,
+        else one keyless credential: google-genai's own GOOGLE_API_KEY or
+        application default credentials).
+    GITHUB_ACCOUNTS: Comma-separated login:token pairs (default:
+        GITHUB_USER:GITHUB_TOKEN).
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_COOLDOWN = 60
+AUTH_COOLDOWN = 600
+ERROR_COOLDOWN = 5
+MAX_ERROR_COOLDOWN = 300
+
+
+def parse_list(value):
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def parse_accounts(value):
+    """Parses "alice:ghp_x,bob:ghp_y" into [("alice", "ghp_x"), ("bob", "ghp_y")]."""
+    accounts = []
+    for item in parse_list(value):
+        login, _, token = item.partition(":")
+        if not token:
+            raise ValueError(f"GITHUB_ACCOUNTS entry {login!r} has no token")
+        accounts.append((login.strip(), token.strip()))
+    return accounts
+
+
+class Credential:
+    def __init__(self, provider, secret, login=None):
+        self.provider = provider
+        self.secret = secret
+        self.login = login
+        # Logs and /metrics show this, never the secret.
+        if login:
+            self.label = login
+        elif secret is None:
+            self.label = f"{provider}-default"
+        else:
+            self.label = f"{provider}-{hashlib.sha256(secret.encode('utf-8')).hexdigest()[:8]}"
+        self.in_flight = 0
+        self.remaining = None  # Share of the quota left (0-1), if known
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.calls = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f"<Credential {self.label}>"
+
+
+class CredentialPool:
+    """
+    Credentials of one provider. `quota` optionally reports a credential's
+    remaining share of its quota (0-1) when the pool does not learn it from
+    response headers, as for GitHub, whose budgets live in github_budget.
+    """
+
+    def __init__(self, provider, credentials, quota=None):
+        self.provider = provider
+        self.credentials = list(credentials)
+        self.quota = quota
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def get(self, label):
+        return next((c for c in self.credentials if c.label == label), None)
+
+    def _remaining(self, cred):
+        if self.quota is not None:
+            return self.quota(cred)
+        return 1.0 if cred.remaining is None else cred.remaining
+
+    def select(self, loads=None):
+        """
+        The best credential right now, without leasing it. `loads` adds
+        in-flight counts seen elsewhere, e.g. running jobs of all processes.
+        Ties go to the least used credential.
+        """
+        if not self.credentials:
+            raise RuntimeError(f"No {self.provider} credentials configured")
+        with self.lock:
+            now = time.monotonic()
+            healthy = [c for c in self.credentials if c.cooldown_until <= now]
+            if not healthy:
+                return min(self.credentials, key=lambda c: c.cooldown_until)
+
+            def score(cred):
+                load = max(cred.in_flight, (loads or {}).get(cred.label, 0))
+                return (load + 1) / max(self._remaining(cred), 0.01), cred.calls
+            return min(healthy, key=score)
+
+    def acquire(self, cred=None):
+        """Marks the best credential (or the given one) in use and returns it."""
+        cred = cred or self.select()
+        with self.lock:
+            cred.in_flight += 1
+            cred.calls += 1
+        return cred
+
+    def release(self, cred):
+        with self.lock:
+            cred.in_flight -= 1
+
+    @contextmanager
+    def lease(self, cred=None):
+        """acquire() for the duration of one call."""
+        cred = self.acquire(cred)
+        try:
+            yield cred
+        finally:
+            self.release(cred)
+
+    def report(self, cred, status=None, error=False, retry_after=None):
+        """Records a call's outcome: an HTTP status and/or a transport error."""
+        with self.lock:
+            if status == 429:
+                try:
+                    cooldown = float(retry_after)
+                except (TypeError, ValueError):
+                    cooldown = RATE_LIMIT_COOLDOWN
+            elif status in (401, 403):
+                cooldown = AUTH_COOLDOWN
+            elif error or (status is not None and status >= 500):
+                cred.failures += 1
+                cooldown = min(ERROR_COOLDOWN * 2 ** (cred.failures - 1), MAX_ERROR_COOLDOWN)
+            else:
+                cred.failures = 0
+                return
+            cred.errors += 1
+            cred.cooldown_until = max(cred.cooldown_until, time.monotonic() + cooldown)
+        logger.warning(f"{self.provider} credential {cred.label} cooling down for "
+                       f"{cooldown:.0f}s (status {status})")
+
+    def observe(self, cred, headers):
+        """Learns the remaining request quota from rate-limit response headers."""
+        for remaining_key, limit_key in (
+                ("x-ratelimit-remaining-requests", "x-ratelimit-limit-requests"),
+                ("x-ratelimit-remaining", "x-ratelimit-limit")):
+            try:
+                remaining = float(headers[remaining_key])
+                limit = float(headers[limit_key])
+            except (KeyError, TypeError, ValueError):
+                continue
+            with self.lock:
+                cred.remaining = max(0.0, remaining) / max(limit, 1.0)
+            return
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            return {c.label: {
+                "in_flight": c.in_flight, "calls": c.calls, "errors": c.errors,
+                "remaining": round(self._remaining(c), 3),
+                "cooling_for": round(max(0.0, c.cooldown_until - now), 1),
+            } for c in self.credentials}
+
+
+def from_env(provider, list_var, single_var, keyless=False):
+    """
+    Pool from a comma-separated list variable, else the single variable. With
+    `keyless`, an empty pool gets one credential whose secret is None, for
+    clients that find their own credentials when given no key.
+    """
+    secrets = parse_list(os.getenv(list_var)) or parse_list(os.getenv(single_var))
+    if not secrets and keyless:
+        secrets = [None]
+    return CredentialPool(provider, [Credential(provider, s) for s in secrets])
+
+
+def github_from_env(quota=None):
+    accounts = parse_accounts(os.getenv("GITHUB_ACCOUNTS"))
+    if not accounts and os.getenv("GITHUB_TOKEN"):
+        accounts = [(os.getenv("GITHUB_USER"), os.getenv("GITHUB_TOKEN"))]
+    return CredentialPool(
+        "github", [Credential("github", token, login) for login, token in accounts], quota)
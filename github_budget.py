@@ -0,0 +1,363 @@
+"""
+Process-wide GitHub API budgets, one per account, shared by PyGithub and
+the raw `requests` calls in app.py.
+
+Every GitHub request goes through one `requests.Session` whose adapter
+takes a token from the bucket of each limit class the request counts
+against before sending it. Limits are per account, so each API token
+(read from the request's Authorization header) has its own buckets:
+
+    core:  the primary limit (5000/hour for a token). The bucket is synced
+           from X-RateLimit-Remaining/Reset, which spreads the remaining
+           calls over the rest of the window.
+    write: GitHub's secondary limit on content-creating requests
+           (GITHUB_WRITES_PER_MINUTE), with at least GITHUB_WRITE_INTERVAL
+           seconds between two mutating calls.
+
+GitHub counts both limits across every process using a token, so each
+worker process only spends its share: `set_processes` (fed from the job
+store's live worker count with each heartbeat) divides the buckets' rates
+by the number of live worker processes and widens the write spacing to
+match.
+
+Rate-limited answers (429, or 403 with an exhausted budget or a
+secondary-limit message) pause the class until Retry-After or the reset
+time, and the request is then sent again. Requests rejected this way were
+never applied, so retrying them is safe. Waits longer than
+GITHUB_MAX_RATE_WAIT are not attempted; the response is returned instead.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import requests
+from github import Github
+from github.Requester import (HTTPRequestsConnectionClass,
+                              HTTPSRequestsConnectionClass, Requester)
+
+import tracing
+
+
+logger = logging.getLogger(__name__)
+
+GITHUB_WRITES_PER_MINUTE = int(os.getenv("GITHUB_WRITES_PER_MINUTE", "80"))
+GITHUB_WRITE_INTERVAL = float(os.getenv("GITHUB_WRITE_INTERVAL", "1.0"))
+GITHUB_MAX_RATE_WAIT = float(os.getenv("GITHUB_MAX_RATE_WAIT", "900"))
+GITHUB_RATE_RETRIES = 5
+# Pause after a secondary-limit answer without Retry-After, per GitHub docs.
+SECONDARY_LIMIT_PAUSE = 60
+DEFAULT_PRIMARY_LIMIT = 5000
+REJECTED_TOKEN_PAUSE = 600
+
+MUTATING = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_second, min_interval=0.0):
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.per_second = per_second
+        self.min_interval = min_interval
+        self.updated = time.monotonic()
+        self.last_taken = None
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token can be taken (0 if one can be taken now)."""
+        self._refill(now)
+        wait = self.paused_until - now
+        if self.last_taken is not None:
+            wait = max(wait, self.last_taken + self.min_interval - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.per_second)
+        return max(0.0, wait)
+
+    def take(self, now):
+        self.tokens -= 1
+        self.last_taken = now
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def share(limit, processes):
+    """One process's bucket capacity: an equal share, but at least one call."""
+    return max(1.0, limit / processes)
+
+
+class GitHubBudget:
+    def __init__(self, processes=1):
+        self.lock = threading.Lock()
+        self.processes = processes
+        self.buckets = {
+            "core": TokenBucket(share(DEFAULT_PRIMARY_LIMIT, processes),
+                                DEFAULT_PRIMARY_LIMIT / 3600 / processes),
+            "write": TokenBucket(share(GITHUB_WRITES_PER_MINUTE, processes),
+                                 GITHUB_WRITES_PER_MINUTE / 60 / processes,
+                                 GITHUB_WRITE_INTERVAL * processes),
+        }
+        self.limits = {}
+        self.primary_limit = DEFAULT_PRIMARY_LIMIT
+        # A 401 means the token is revoked or wrong: report no budget for a while.
+        self.rejected_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def set_processes(self, processes):
+        """Rescales the buckets to this process's share of the account's limits."""
+        with self.lock:
+            scale = self.processes / processes
+            self.processes = processes
+            now = time.monotonic()
+            for bucket in self.buckets.values():
+                bucket._refill(now)
+                bucket.per_second *= scale
+            core, write = self.buckets["core"], self.buckets["write"]
+            core.capacity = share(self.primary_limit, processes)
+            write.capacity = share(GITHUB_WRITES_PER_MINUTE, processes)
+            write.min_interval = GITHUB_WRITE_INTERVAL * processes
+            for bucket in self.buckets.values():
+                bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    @staticmethod
+    def classes(method):
+        return ("core", "write") if method.upper() in MUTATING else ("core",)
+
+    def acquire(self, method):
+        """Blocks until every bucket of the request's classes has a token."""
+        classes = self.classes(method)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = max(self.buckets[c].wait_time(now) for c in classes)
+                if wait <= 0:
+                    for c in classes:
+                        self.buckets[c].take(now)
+                    self.requests += 1
+                    self.waited += waited
+                    return waited
+            # Re-check regularly: a response may lift or extend a pause.
+            step = min(wait, 5.0)
+            time.sleep(step)
+            waited += step
+
+    def observe(self, resp):
+        """Syncs the primary-limit bucket from a response's rate headers."""
+        headers = resp.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        try:
+            limit = int(headers.get("X-RateLimit-Limit", DEFAULT_PRIMARY_LIMIT))
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = int(headers.get("X-RateLimit-Reset", time.time() + 3600))
+        except ValueError:
+            return
+        resource = headers.get("X-RateLimit-Resource", "core")
+        with self.lock:
+            self.limits[resource] = {"limit": limit, "remaining": remaining, "reset": reset}
+            if resource != "core":
+                return
+            bucket = self.buckets["core"]
+            bucket._refill(time.monotonic())
+            self.primary_limit = limit
+            bucket.capacity = share(limit, self.processes)
+            bucket.tokens = min(bucket.tokens, remaining / self.processes)
+            bucket.per_second = (max(remaining, 1) / max(reset - time.time(), 1)
+                                 / self.processes)
+
+    @staticmethod
+    def is_rate_limited(resp):
+        if resp.status_code == 429:
+            return True
+        if resp.status_code != 403:
+            return False
+        return (resp.headers.get("X-RateLimit-Remaining") == "0"
+                or "Retry-After" in resp.headers
+                or b"rate limit" in resp.content.lower())
+
+    def throttle(self, resp, method):
+        """Pauses the affected class after a rate-limited answer; returns the wait."""
+        headers = resp.headers
+        if "Retry-After" in headers:
+            try:
+                wait = float(headers["Retry-After"])
+            except ValueError:
+                wait = SECONDARY_LIMIT_PAUSE
+            bucket = "write" if method.upper() in MUTATING else "core"
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            wait = int(headers.get("X-RateLimit-Reset", 0)) - time.time() + 1
+            bucket = "core"
+        else:
+            wait = SECONDARY_LIMIT_PAUSE
+            bucket = "write" if method.upper() in MUTATING else "core"
+        wait = max(wait, 1.0)
+        with self.lock:
+            self.throttled += 1
+            if wait <= GITHUB_MAX_RATE_WAIT:
+                self.buckets[bucket].pause(wait)
+        return wait
+
+    def remaining_fraction(self):
+        """Share of the primary budget left right now (0 while paused)."""
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.buckets["core"]
+            if (bucket.paused_until > now or self.buckets["write"].paused_until > now
+                    or self.rejected_until > now):
+                return 0.0
+            bucket._refill(now)
+            return max(0.0, bucket.tokens) / max(bucket.capacity, 1)
+
+    def snapshot(self):
+        """Remaining budget per limit class, for /metrics."""
+        with self.lock:
+            now = time.monotonic()
+            report = {}
+            for name, bucket in self.buckets.items():
+                bucket._refill(now)
+                report[name] = {
+                    "tokens": int(bucket.tokens), "capacity": round(bucket.capacity, 1),
+                    "paused_for": round(max(0.0, bucket.paused_until - now), 1),
+                }
+            report["limits"] = {k: dict(v) for k, v in self.limits.items()}
+            report.update(requests=self.requests, throttled=self.throttled,
+                          waited_seconds=round(self.waited, 1))
+            return report
+
+
+_budgets = {}
+_labels = {}
+_budgets_lock = threading.Lock()
+_processes = 1
+
+
+def budget_for(token):
+    """The budget of the account behind an API token (None: anonymous)."""
+    with _budgets_lock:
+        if token not in _budgets:
+            _budgets[token] = GitHubBudget(_processes)
+        return _budgets[token]
+
+
+def set_processes(count):
+    """Shares every account's limits among `count` live worker processes."""
+    global _processes
+    count = max(1, int(count))
+    with _budgets_lock:
+        if count == _processes:
+            return
+        _processes = count
+        budgets = list(_budgets.values())
+    logger.info(f"GitHub budgets shared among {count} worker process(es)")
+    for budget in budgets:
+        budget.set_processes(count)
+
+
+def register(token, label):
+    """Names a token's budget in snapshot() without exposing the token."""
+    with _budgets_lock:
+        _labels[token] = label
+
+
+def snapshot():
+    """Budget report per account, for /metrics."""
+    with _budgets_lock:
+        budgets = [(_labels.get(token) or _default_label(token), b)
+                   for token, b in _budgets.items()]
+    return {label: b.snapshot() for label, b in budgets}
+
+
+def _default_label(token):
+    if token is None:
+        return "anonymous"
+    return "token-" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:8]
+
+
+def _request_token(request):
+    auth = request.headers.get("Authorization")
+    return auth.split()[-1] if auth else None
+
+
+class BudgetAdapter(requests.adapters.HTTPAdapter):
+    """Transport adapter that paces requests through the account's budget."""
+
+    def send(self, request, **kwargs):
+        budget = budget_for(_request_token(request))
+        for attempt in range(GITHUB_RATE_RETRIES + 1):
+            waited = budget.acquire(request.method)
+            if waited:
+                tracing.set_attribute("github.budget_wait", round(waited, 3))
+            resp = super().send(request, **kwargs)
+            budget.observe(resp)
+            if resp.status_code == 401:
+                budget.rejected_until = time.monotonic() + REJECTED_TOKEN_PAUSE
+            if attempt == GITHUB_RATE_RETRIES or not budget.is_rate_limited(resp):
+                return resp
+            wait = budget.throttle(resp, request.method)
+            tracing.set_attribute("github.rate_limited", attempt + 1)
+            if wait > GITHUB_MAX_RATE_WAIT:
+                logger.error(
+                    f"GitHub rate limit for {request.method} {request.path_url} "
+                    f"resets in {wait:.0f}s, not waiting")
+                return resp
+            logger.warning(
+                f"GitHub rate limited {request.method} {request.path_url} "
+                f"({resp.status_code}); retrying in {wait:.0f}s")
+        return resp
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """The shared, budgeted requests.Session for GitHub API calls."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                # Like PyGithub: never fall back to ~/.netrc credentials.
+                s.auth = Requester.noopAuth
+                adapter = BudgetAdapter(max_retries=3)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session = s
+    return _session
+
+
+class _SharedSessionMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session.close()
+        self.session = session()
+
+    def close(self):
+        pass  # The shared session outlives PyGithub's per-request connections.
+
+
+class _BudgetedHTTPConnection(_SharedSessionMixin, HTTPRequestsConnectionClass):
+    pass
+
+
+class _BudgetedHTTPSConnection(_SharedSessionMixin, HTTPSRequestsConnectionClass):
+    pass
+
+
+def github_client(token, base_url):
+    """
+    PyGithub client whose requests go through the token's budget. PyGithub's
+    own request spacing and retries are turned off in favour of it.
+    """
+    Requester.injectConnectionClasses(_BudgetedHTTPConnection, _BudgetedHTTPSConnection)
+    return Github(token, base_url=base_url, retry=None,
+                  seconds_between_requests=None, seconds_between_writes=None)
@@ -0,0 +1,729 @@
+"""
+SQLite-backed job queue shared by the web tier and the worker processes.
+
+The web tier `enqueue`s request payloads, workers `claim` them, and every
+process registers a heartbeat so crashed workers' jobs can be requeued.
+Jobs form one lane per `task`: a task's jobs run one at a time in round
+order, while jobs of different tasks run in parallel. Across lanes, workers
+take the job with the earliest deadline (receipt time plus the per-round
+SLA), penalised per job its submitter already has ahead and credited for
+time spent waiting, so one email cannot starve everybody else.
+Claiming a lane's head job folds the task's other queued jobs into it
+("superseded", `merged_into` the claimed job), and a newer revision of a
+round that is already running asks that job to stop at its next stage
+boundary, so bursts of resubmissions cost one pipeline run.
+SQLite in WAL mode lets any number of local processes (gunicorn workers,
+`python app.py worker` children) use the same queue file; other machines
+reach it through the RPC front in cluster.py.
+
+In multi-node mode every node holds a lease in the `nodes` table, renewed
+by its worker heartbeats, and only claims jobs of the tasks it owns on a
+consistent-hash ring of the nodes with live leases. A task's rounds thus
+run on the same node while membership is stable. When a lease expires the
+ring moves the node's tasks to the others and its running jobs are
+requeued.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv(
+    "JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "tds-jobs.sqlite3"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 45
+# A node that has not renewed its lease for this long loses its tasks.
+NODE_LEASE_SECONDS = float(os.getenv("NODE_LEASE_SECONDS", "30"))
+# Points per node on the hash ring; more spread tasks more evenly.
+NODE_VNODES = 64
+
+
+def parse_sla(value):
+    """Parses "1:900,2:600,*:600" into {1: 900.0, 2: 600.0, "*": 600.0}."""
+    sla = {}
+    for part in value.split(","):
+        key, _, seconds = part.strip().partition(":")
+        sla[key if key == "*" else int(key)] = float(seconds)
+    return sla
+
+
+# Seconds after receipt by which a round should be finished.
+ROUND_SLA_SECONDS = parse_sla(os.getenv("ROUND_SLA_SECONDS", "1:900,2:600,*:600"))
+# Deadline seconds added per job the same submitter already has running or
+# ranked ahead, and penalty seconds forgiven per second the job has waited.
+FAIR_SHARE_PENALTY = float(os.getenv("FAIR_SHARE_PENALTY", "300"))
+AGING_WEIGHT = float(os.getenv("AGING_WEIGHT", "0.5"))
+# Job duration assumed for projections until real durations are known.
+DEFAULT_JOB_SECONDS = 180
+# A resubmitted (task, round, nonce) attaches to the earlier job for this
+# long; finished jobs are pruned after it, or beyond JOB_HISTORY_MAX rows.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+JOB_HISTORY_MAX = int(os.getenv("JOB_HISTORY_MAX", "5000"))
+# Successful generations kept for near-duplicate reuse (see similarity.py).
+GENERATION_HISTORY_MAX = int(os.getenv("GENERATION_HISTORY_MAX", "500"))
+# Coalesce queued jobs of a task and cancel superseded in-flight ones.
+JOB_COALESCE = os.getenv("JOB_COALESCE", "1") != "0"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    task TEXT,
+    round INTEGER,
+    nonce TEXT,
+    email TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    deadline REAL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    stage TEXT,
+    stages TEXT,
+    updated_at REAL,
+    merged_into TEXT,
+    superseded_by TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_task ON jobs (task, status, round);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (task, round, nonce, created_at);
+CREATE TABLE IF NOT EXISTS generations (
+    task TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    signature TEXT NOT NULL,
+    code TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (task, round)
+);
+CREATE TABLE IF NOT EXISTS task_accounts (
+    task TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    assigned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    slots INTEGER NOT NULL DEFAULT 1,
+    started_at REAL,
+    heartbeat_at REAL,
+    stats TEXT,
+    node TEXT
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    lease_until REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, for queue files created before them.
+MIGRATIONS = {
+    "jobs": {
+        "deadline": "REAL",
+        "stage": "TEXT",
+        "stages": "TEXT",
+        "updated_at": "REAL",
+        "merged_into": "TEXT",
+        "superseded_by": "TEXT",
+    },
+    "workers": {"slots": "INTEGER NOT NULL DEFAULT 1", "stats": "TEXT", "node": "TEXT"},
+}
+
+
+def deadline_for(round_num, received_at):
+    sla = ROUND_SLA_SECONDS.get(round_num, ROUND_SLA_SECONDS.get("*", 600.0))
+    return received_at + sla
+
+
+def process_id(pid=None):
+    """Identifies a process (this one by default) in the workers table."""
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    """Raised at a stage boundary of a job whose node no longer holds its lease."""
+
+
+class HashRing:
+    """Consistent hashing of task ids onto node ids."""
+
+    def __init__(self, nodes, vnodes=NODE_VNODES):
+        points = sorted((self._hash(f"{node}#{i}"), node)
+                        for node in nodes for i in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key):
+        """The node owning `key`, or None for an empty ring."""
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[i]
+
+
+class JobSuperseded(Exception):
+    """Raised at a stage boundary of a job that a newer request replaced."""
+
+    def __init__(self, job_id):
+        super().__init__(f"superseded by job {job_id}")
+        self.job_id = job_id
+
+
+class JobStore:
+    """
+    Durable job queue. Connections are per thread; every write that must be
+    atomic across processes runs in a BEGIN IMMEDIATE transaction.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, max_depth=None):
+        self.path = path
+        self.max_depth = max_depth
+        self._local = threading.local()
+        db = self._conn()
+        db.executescript(SCHEMA)
+        for table, columns in MIGRATIONS.items():
+            existing = {row["name"] for row in db.execute(f"PRAGMA table_info({table})")}
+            for column, ddl in columns.items():
+                if column not in existing:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @staticmethod
+    def _row_to_job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["stages"] = json.loads(job["stages"]) if job.get("stages") else []
+        return job
+
+    def enqueue(self, req, dedupe=True):
+        """
+        Queues a request payload and returns (job_id, existing). When `dedupe`
+        is set and the same (task, round, nonce) was received within
+        IDEMPOTENCY_TTL_SECONDS and has not failed, nothing is queued and
+        `existing` is that earlier job; otherwise `existing` is None.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._tx() as db:
+            if dedupe:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE task IS ? AND round IS ? AND nonce IS ?"
+                    " AND created_at >= ? AND status != 'failed'"
+                    " ORDER BY created_at DESC LIMIT 1",
+                    (req.get("task"), req.get("round"), req.get("nonce"),
+                     now - IDEMPOTENCY_TTL_SECONDS)).fetchone()
+                if row is not None:
+                    return row["id"], self._row_to_job(row)
+            if self.max_depth:
+                depth = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if depth >= self.max_depth:
+                    raise QueueFull(f"{depth} jobs already queued")
+            db.execute(
+                "INSERT INTO jobs (id, task, round, nonce, email, payload,"
+                " created_at, deadline, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, req.get("task"), req.get("round"), req.get("nonce"),
+                 req.get("email"), json.dumps(req), now,
+                 deadline_for(req.get("round"), now), now))
+            if JOB_COALESCE:
+                # A running job that is building this round (itself or via a
+                # job merged into it) is now stale.
+                db.execute(
+                    "UPDATE jobs SET superseded_by = ? WHERE task = ?"
+                    " AND status = 'running' AND superseded_by IS NULL"
+                    " AND ? <= (SELECT MAX(m.round) FROM jobs m"
+                    "   WHERE m.id = jobs.id OR m.merged_into = jobs.id)",
+                    (job_id, req.get("task"), req.get("round")))
+        return job_id, None
+
+    # A queued job is runnable when nothing else in its task lane is running
+    # and no queued job of the same task comes before it in round order.
+    RUNNABLE = (
+        "j.status = 'queued'"
+        " AND NOT EXISTS (SELECT 1 FROM jobs r WHERE r.task = j.task"
+        "   AND r.status = 'running')"
+        " AND NOT EXISTS (SELECT 1 FROM jobs q WHERE q.task = j.task"
+        "   AND q.status = 'queued' AND (q.round < j.round"
+        "   OR (q.round = j.round AND q.created_at < j.created_at)))"
+    )
+
+    @staticmethod
+    def _priority_order(db, now):
+        """
+        Returns runnable job rows, most urgent first. Lower score runs first:
+        deadline, plus FAIR_SHARE_PENALTY for every job the same submitter has
+        running or ranked ahead. The penalty shrinks by AGING_WEIGHT per second
+        waited, so a held-back job falls back to its plain deadline and then
+        overtakes newer jobs of other submitters.
+        """
+        rows = db.execute(
+            "SELECT id, task, email, round, created_at, deadline FROM jobs j"
+            f" WHERE {JobStore.RUNNABLE}").fetchall()
+        share = dict(db.execute(
+            "SELECT email, COUNT(*) FROM jobs WHERE status = 'running'"
+            " GROUP BY email").fetchall())
+
+        def urgency(row):
+            return row["deadline"] or deadline_for(row["round"], row["created_at"])
+
+        scored = []
+        for row in sorted(rows, key=urgency):
+            ahead = share.get(row["email"], 0)
+            share[row["email"]] = ahead + 1
+            penalty = max(0.0, FAIR_SHARE_PENALTY * ahead
+                          - AGING_WEIGHT * (now - row["created_at"]))
+            score = urgency(row) + penalty
+            scored.append((score, row["created_at"], row))
+        scored.sort(key=lambda item: item[:2])
+        return [row for _, _, row in scored]
+
+    def claim(self, worker_id, node=None):
+        """
+        Atomically takes the most urgent runnable job, or returns None. With
+        JOB_COALESCE the task's other queued jobs are merged into it; their
+        payloads come back in `job["merged"]`, and `job["revisions"]` holds
+        the claimed payload and the merged ones in round and arrival order (a
+        job handed over by `supersede` is older than the job it merged into).
+        With a `node`, only jobs of tasks that node owns on the ring are taken.
+        """
+        with self._tx() as db:
+            order = self._priority_order(db, time.time())
+            if node is not None and order:
+                ring = HashRing(self._live_nodes(db))
+                order = [row for row in order if ring.owner(row["task"]) == node]
+            if not order:
+                return None
+            row = db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (order[0]["id"],)).fetchone()
+            now = time.time()
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?,"
+                " attempts = attempts + 1, stage = NULL, stages = NULL,"
+                " superseded_by = NULL, updated_at = ? WHERE id = ?",
+                (worker_id, now, now, row["id"]))
+            if JOB_COALESCE:
+                db.execute(
+                    "UPDATE jobs SET status = 'superseded', merged_into = ?,"
+                    " updated_at = ? WHERE task = ? AND status = 'queued'",
+                    (row["id"], now, row["task"]))
+            revisions = db.execute(
+                "SELECT id, payload FROM jobs WHERE id = ? OR merged_into = ?"
+                " ORDER BY round, created_at", (row["id"], row["id"])).fetchall()
+        merged = [r for r in revisions if r["id"] != row["id"]]
+        job = self._row_to_job(row)
+        job["attempts"] += 1
+        job["worker"] = worker_id
+        job["merged"] = [json.loads(m["payload"]) for m in merged]
+        job["revisions"] = [json.loads(r["payload"]) for r in revisions]
+        if merged:
+            logger.info(f"Job {row['id']} carries {len(merged)} merged request(s)")
+        return job
+
+    def finish(self, job_id, status, result=None, error=None, worker=None):
+        """
+        Records a job's outcome. With `worker`, nothing is recorded if the
+        job was requeued or claimed by another worker in the meantime.
+        """
+        now = time.time()
+        with self._tx() as db:
+            if worker is not None:
+                row = db.execute("SELECT status, worker FROM jobs WHERE id = ?",
+                                 (job_id,)).fetchone()
+                if row is None or row["status"] != "running" or row["worker"] != worker:
+                    logger.warning(f"Job {job_id} is no longer held by {worker}, "
+                                   f"not recording its {status} outcome")
+                    return False
+            db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?,"
+                " stage = NULL, updated_at = ? WHERE id = ? OR merged_into = ?",
+                (status, now, json.dumps(result) if result else None,
+                 error, now, job_id, job_id))
+        return True
+
+    def superseded_by(self, job_id):
+        """Id of the newer job that replaces a running job, if any."""
+        row = self._conn().execute(
+            "SELECT superseded_by FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["superseded_by"] if row else None
+
+    def supersede(self, job_id, newer_id):
+        """
+        Hands a cancelled job, and the jobs merged into it, over to the newer
+        job that replaced it; they finish when that job does.
+        """
+        now = time.time()
+        with self._tx() as db:
+            db.execute(
+                "UPDATE jobs SET merged_into = ?, updated_at = ? WHERE merged_into = ?",
+                (newer_id, now, job_id))
+            db.execute(
+                "UPDATE jobs SET status = 'superseded', merged_into = ?, stage = NULL,"
+                " updated_at = ? WHERE id = ?", (newer_id, now, job_id))
+
+    def stage_started(self, job_id, name, started_at):
+        """Marks `name` as the job's current stage and logs its start."""
+        self._update_stages(job_id, name, lambda stages: stages.append(
+            {"name": name, "started_at": started_at, "finished_at": None}))
+
+    def stage_finished(self, job_id, name, finished_at, attributes=None):
+        """Closes the latest open entry for `name`, keeping `attributes`."""
+        def close(stages):
+            for entry in reversed(stages):
+                if entry["name"] == name and entry["finished_at"] is None:
+                    entry["finished_at"] = finished_at
+                    entry.update(attributes or {})
+                    return
+        self._update_stages(job_id, None, close)
+
+    def _update_stages(self, job_id, stage, change):
+        # Read-modify-write inside one IMMEDIATE transaction so a concurrent
+        # writer cannot drop an entry.
+        with self._tx() as db:
+            row = db.execute(
+                "SELECT stage, stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"]) if row["stages"] else []
+            change(stages)
+            db.execute(
+                "UPDATE jobs SET stage = ?, stages = ?, updated_at = ? WHERE id = ?",
+                (stage or row["stage"], json.dumps(stages), time.time(), job_id))
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def list_jobs(self, task=None, limit=50):
+        """Newest jobs first, optionally only those of one task."""
+        if task is None:
+            rows = self._conn().execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT * FROM jobs WHERE task = ? ORDER BY created_at DESC LIMIT ?",
+                (task, limit)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def queue_position(self, job_id):
+        """
+        1-based rank of a queued job among the jobs that could start now, or
+        None if it is waiting for an earlier job of its own task.
+        """
+        order = [row["id"] for row in self._priority_order(self._conn(), time.time())]
+        return order.index(job_id) + 1 if job_id in order else None
+
+    def prune(self, ttl=IDEMPOTENCY_TTL_SECONDS, keep=JOB_HISTORY_MAX):
+        """Drops finished jobs older than `ttl` and beyond the newest `keep`."""
+        with self._tx() as db:
+            expired = db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed')"
+                " AND finished_at < ?", (time.time() - ttl,)).rowcount
+            overflow = db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND id NOT IN"
+                " (SELECT id FROM jobs WHERE status IN ('done', 'failed')"
+                "  ORDER BY finished_at DESC LIMIT ?)", (keep,)).rowcount
+        return expired + overflow
+
+    def depth(self):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def load(self, node=None):
+        """
+        Returns (running, runnable): jobs in progress and jobs that could start
+        right now. Their sum is the useful number of workers. With a `node`,
+        only the jobs that node's workers run and the runnable jobs of the
+        tasks it owns on the ring count.
+        """
+        db = self._conn()
+        if node is None:
+            running = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            runnable = db.execute(
+                f"SELECT COUNT(*) FROM jobs j WHERE {self.RUNNABLE}").fetchone()[0]
+            return running, runnable
+        running = db.execute(
+            "SELECT COUNT(*) FROM jobs j WHERE status = 'running' AND EXISTS"
+            " (SELECT 1 FROM workers w WHERE w.node = ? AND j.worker LIKE w.id || ':%')",
+            (node,)).fetchone()[0]
+        ring = HashRing(self._live_nodes(db))
+        rows = db.execute(f"SELECT task FROM jobs j WHERE {self.RUNNABLE}").fetchall()
+        runnable = sum(1 for row in rows if ring.owner(row["task"]) == node)
+        return running, runnable
+
+    def average_duration(self, sample=20):
+        rows = self._conn().execute(
+            "SELECT finished_at - started_at FROM jobs WHERE status = 'done'"
+            " AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+            (sample,)).fetchall()
+        durations = [row[0] for row in rows if row[0] and row[0] > 0]
+        return sum(durations) / len(durations) if durations else DEFAULT_JOB_SECONDS
+
+    def capacity(self):
+        """Worker slots across all live worker processes (at least 1)."""
+        total = self._conn().execute(
+            "SELECT SUM(slots) FROM workers WHERE heartbeat_at >= ?",
+            (time.time() - HEARTBEAT_TIMEOUT,)).fetchone()[0]
+        return max(1, total or 0)
+
+    def projected_start(self, job_id):
+        """
+        Estimates when a queued job will start, from the jobs scheduled before
+        it, the live worker slots and the recent average job duration.
+        """
+        db = self._conn()
+        job = db.execute(
+            "SELECT task, round, created_at, status, started_at FROM jobs WHERE id = ?",
+            (job_id,)).fetchone()
+        if job is None or job["status"] != "queued":
+            return job["started_at"] if job else None
+
+        now = time.time()
+        avg = self.average_duration()
+        capacity = self.capacity()
+        running = db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+        order = [row["id"] for row in self._priority_order(db, now)]
+        ahead = order.index(job_id) if job_id in order else len(order)
+        free = max(0, capacity - running)
+        waves = 0 if ahead < free else (ahead - free) // capacity + 1
+        # Jobs of the same task that must finish first, one after another.
+        lane_ahead = db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE task = ? AND id != ?"
+            " AND (status = 'running' OR (status = 'queued' AND (round < ?"
+            " OR (round = ? AND created_at < ?))))",
+            (job["task"], job_id, job["round"], job["round"], job["created_at"])).fetchone()[0]
+        return now + max(waves, lane_ahead) * avg
+
+    def record_generation(self, task, round_num, signature, code,
+                          keep=GENERATION_HISTORY_MAX):
+        """Stores the app.py of a successful run with its brief signature."""
+        with self._tx() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO generations (task, round, signature, code,"
+                " created_at) VALUES (?, ?, ?, ?, ?)",
+                (task, round_num, json.dumps(signature), code, time.time()))
+            db.execute(
+                "DELETE FROM generations WHERE rowid NOT IN (SELECT rowid FROM"
+                " generations ORDER BY created_at DESC LIMIT ?)", (keep,))
+
+    def generations(self):
+        """Signatures of the stored generations (without their code)."""
+        rows = self._conn().execute(
+            "SELECT task, round, signature FROM generations").fetchall()
+        return [{"task": row["task"], "round": row["round"],
+                 "signature": json.loads(row["signature"])} for row in rows]
+
+    def generation_code(self, task, round_num):
+        row = self._conn().execute(
+            "SELECT code FROM generations WHERE task = ? AND round = ?",
+            (task, round_num)).fetchone()
+        return row["code"] if row else None
+
+    def task_head(self, task):
+        """Commit SHA deployed by the task's latest successful job, if any."""
+        row = self._conn().execute(
+            "SELECT result FROM jobs WHERE task = ? AND status = 'done'"
+            " AND result IS NOT NULL ORDER BY finished_at DESC LIMIT 1", (task,)).fetchone()
+        return json.loads(row["result"]).get("commit_sha") if row else None
+
+    def task_account(self, task):
+        """GitHub account that owns the task's repo, if one was assigned."""
+        row = self._conn().execute(
+            "SELECT account FROM task_accounts WHERE task = ?", (task,)).fetchone()
+        return row["account"] if row else None
+
+    def assign_account(self, task, account):
+        """
+        Makes `account` the owner of the task's repo unless another process
+        assigned one first. Returns the owning account either way.
+        """
+        with self._tx() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO task_accounts (task, account, assigned_at)"
+                " VALUES (?, ?, ?)", (task, account, time.time()))
+            return db.execute("SELECT account FROM task_accounts WHERE task = ?",
+                              (task,)).fetchone()["account"]
+
+    def account_loads(self):
+        """Running jobs per GitHub account, across all processes."""
+        rows = self._conn().execute(
+            "SELECT a.account, COUNT(*) FROM jobs j JOIN task_accounts a ON a.task = j.task"
+            " WHERE j.status = 'running' GROUP BY a.account").fetchall()
+        return dict(rows)
+
+    def incr(self, name, amount=1):
+        """Bumps a named counter shared by all processes using the store."""
+        with self._tx() as db:
+            db.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount))
+
+    def counters(self):
+        return dict(self._conn().execute("SELECT name, value FROM counters").fetchall())
+
+    def is_busy(self, proc_id):
+        """True if the given worker process has a job in progress."""
+        return self._conn().execute(
+            "SELECT 1 FROM jobs WHERE status = 'running' AND worker LIKE ? LIMIT 1",
+            (f"{proc_id}:%",)).fetchone() is not None
+
+    def heartbeat(self, proc_id=None, slots=1, stats=None, node=None,
+                  lease=NODE_LEASE_SECONDS):
+        """
+        Registers a live worker process running `slots` worker threads, with
+        optional process-local `stats` (reported by worker_stats). A `node`
+        has its lease renewed for `lease` seconds; the lease end is returned.
+        """
+        proc_id = proc_id or process_id()
+        now = time.time()
+        host, _, pid = proc_id.rpartition(":")
+        with self._tx() as db:
+            db.execute(
+                "INSERT INTO workers (id, host, pid, slots, started_at, heartbeat_at, stats, node)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at,"
+                " slots = excluded.slots, stats = COALESCE(excluded.stats, stats),"
+                " node = excluded.node",
+                (proc_id, host, int(pid), slots, now, now,
+                 json.dumps(stats) if stats is not None else None, node))
+            if node is None:
+                return None
+            db.execute(
+                "INSERT INTO nodes (id, started_at, heartbeat_at, lease_until)"
+                " VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET"
+                " heartbeat_at = excluded.heartbeat_at, lease_until = excluded.lease_until",
+                (node, now, now, now + lease))
+        return now + lease
+
+    @staticmethod
+    def _live_nodes(db):
+        rows = db.execute("SELECT id FROM nodes WHERE lease_until >= ? ORDER BY id",
+                          (time.time(),)).fetchall()
+        return [row["id"] for row in rows]
+
+    def live_nodes(self):
+        """Ids of the nodes holding a lease, i.e. the members of the ring."""
+        return self._live_nodes(self._conn())
+
+    def task_owner(self, task):
+        """The node that runs the task's jobs under the current membership."""
+        return HashRing(self.live_nodes()).owner(task)
+
+    def release_node(self, node):
+        """Gives up a node's lease so its tasks move to the other nodes now."""
+        with self._tx() as db:
+            db.execute("DELETE FROM nodes WHERE id = ?", (node,))
+
+    def worker_stats(self, max_age=HEARTBEAT_TIMEOUT):
+        """{process id: stats} of the live worker processes that sent any."""
+        rows = self._conn().execute(
+            "SELECT id, stats FROM workers WHERE heartbeat_at >= ? AND stats IS NOT NULL",
+            (time.time() - max_age,)).fetchall()
+        return {row["id"]: json.loads(row["stats"]) for row in rows}
+
+    def live_workers(self, max_age=HEARTBEAT_TIMEOUT):
+        rows = self._conn().execute(
+            "SELECT id FROM workers WHERE heartbeat_at >= ?",
+            (time.time() - max_age,)).fetchall()
+        return [row["id"] for row in rows]
+
+    def requeue_worker(self, proc_id):
+        """
+        Puts the running jobs of a dead worker process back in the queue, or
+        fails them once they have used up JOB_MAX_ATTEMPTS.
+        """
+        with self._tx() as db:
+            rows = db.execute(
+                "SELECT id, attempts FROM jobs WHERE status = 'running'"
+                " AND (worker = ? OR worker LIKE ?)",
+                (proc_id, f"{proc_id}:%")).fetchall()
+            for row in rows:
+                if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                    db.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?,"
+                        " error = 'worker crashed' WHERE id = ? OR merged_into = ?",
+                        (time.time(), row["id"], row["id"]))
+                else:
+                    db.execute(
+                        "UPDATE jobs SET status = 'queued', worker = NULL WHERE id = ?",
+                        (row["id"],))
+            db.execute("DELETE FROM workers WHERE id = ?", (proc_id,))
+        if rows:
+            logger.warning(f"Recovered {len(rows)} job(s) from dead worker {proc_id}")
+        return len(rows)
+
+    def recover_stale(self, max_age=HEARTBEAT_TIMEOUT):
+        """
+        Requeues jobs of every worker process whose heartbeat has expired or
+        whose node lost its lease.
+        """
+        cutoff = time.time() - max_age
+        stale = self._conn().execute(
+            "SELECT id FROM workers WHERE heartbeat_at < ? OR node IN"
+            " (SELECT id FROM nodes WHERE lease_until < ?)",
+            (cutoff, time.time())).fetchall()
+        recovered = sum(self.requeue_worker(row["id"]) for row in stale)
+        # Running jobs whose worker never registered a heartbeat at all.
+        orphans = self._conn().execute(
+            "SELECT DISTINCT worker FROM jobs WHERE status = 'running'"
+            " AND started_at < ?", (cutoff,)).fetchall()
+        live = set(self.live_workers(max_age))
+        for row in orphans:
+            worker = row["worker"] or ""
+            if not any(worker == w or worker.startswith(f"{w}:") for w in live):
+                recovered += self.requeue_worker(worker)
+        return recovered
@@ -0,0 +1,282 @@
+"""
+Versioned LLM prompt templates.
+
+Every prompt is a fixed block of instructions followed by the job's data
+(brief, checks, code, settings) rendered from a Jinja2 template compiled
+once at import. The instructions come first and never contain job data, so
+all prompts of a template share a byte-identical prefix that providers can
+serve from their prompt cache; the variable part is always at the end, with
+the data most often repeated between jobs (settings, brief, code) before
+what is unique to a task (the repository name).
+
+A template's version hashes its instructions and data template. Anything
+derived from a prompt's output (e.g. the artifact fingerprints) includes
+the version, so editing a template invalidates what it produced.
+"""
+import hashlib
+
+from jinja2 import Environment, StrictUndefined
+
+
+_env = Environment(undefined=StrictUndefined, autoescape=False,
+                   trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=True)
+
+
+class PromptTemplate:
+    """
+    Instructions are plain text, not Jinja, so they may show literal braces
+    and template syntax to the model; only `data` is rendered.
+    """
+
+    def __init__(self, name, instructions, data):
+        self.name = name
+        self.instructions = instructions
+        self.data = _env.from_string(data)
+        self.version = hashlib.sha256(
+            f"{instructions}\0{data}".encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def key(self):
+        return f"{self.name}@{self.version}"
+
+    def render(self, **data):
+        return self.instructions + self.data.render(**data)
+
+
+_CHECKS = """--- FUNCTIONAL REQUIREMENTS ---
+{% for check in checks %}
+- {{ check }}
+{% else %}
+- None specified.
+{% endfor %}
+"""
+
+CODE_BUILD = PromptTemplate("code_build", """\
+TASK: Build app.py based on the BRIEF and FUNCTIONAL REQUIREMENTS given under JOB DATA at the end.
+By default, create a minimal, generic Python app.
+If ANY requirement, check, or brief context explicitly mentions or requires 'Flask', rigorously use Flask with correct conventions (setup, routing, context, dynamic server, etc.).
+Exported static site must visually and functionally demonstrate EVERY condition in the brief and functional checks—no hidden logic, everything directly observable for inspection.
+All code must be syntactically and indentation-correct Python 3 ready-to-run code (4 spaces per level, no tabs).
+ALL functional requirements must be reflected in the output. Exclude README/repo setup requirements.
+Include all imports required for app functionality.
+
+--- ATTACHMENT HANDLING ---
+At runtime, load attachments from data.json in repo root, formatted as:
+{
+  "attachments": [
+    { "name": "sample.png", "url": "data:image/png;base64,iVBORw..." }
+  ]
+}
+The attachments to process are listed under JOB DATA.
+
+--- MODES OF OPERATION ---
+Support BOTH modes:
+1. Development: 'python app.py' starts the Flask (if required) server on any standard port for dynamic serving.
+2. Static Export: 'python app.py --export' generates all site pages, decoded attachments, CSS/JS/images, etc. in the OUTPUT DIRECTORY given under JOB DATA (output_dir below) for offline viewing. Script completes without user interaction.
+    - If Flask is used, always render templates/routes via Flask (not raw Jinja) before saving HTML to output_dir in export mode.
+    - Ensure exported HTML only contains evaluated content—no Jinja tags visible to users.
+
+--- SPECIFIC INSTRUCTIONS ---
+1. Parse data.json; decode all Data URIs at runtime. Do NOT hardcode attachments/sample data.
+2. Use attachments exactly as required in brief and functional checks.
+3. In export mode, save ALL output/binary/static files to output_dir and properly link/image/reference in HTML.
+4. Export CSS inline or as a separate file in output_dir for proper rendering.
+5. All exported files must reside in output_dir and be referenced correctly from HTML/pages.
+6. Static GitHub Pages export MUST be fully self-contained and directly validate every functional requirement (no external links, redirects, or missing data).
+7. Always use standard Python 3 indentation (4 spaces per level) and guarantee no syntax/indentation errors.
+8. When writing Python strings containing HTML, CSS, or JS for .format(), always escape literal curly braces as double braces ({{ and }}), except for format placeholders.
+9. Never include links or redirects outside exported static site for feature access or inspection in GitHub Pages.
+10. Strictly render all template logic before export—do NOT save raw templates with Jinja tags to output_dir.
+11. Do NOT display the words 'static export', 'exported', '--export', 'development mode', or other workflow/internal process keywords anywhere on the rendered pages, headings, or user-facing site text.
+12. All visible content must reflect only the required outputs, features, data, and UX as described in the BRIEF and functional checks. Hide all implementation details from users.
+13. - During '--export' mode, always wrap all template rendering (render_template, render_template_string) in 'with app.app_context():'
+14. All Jinja template expressions must use only valid Jinja2 syntax—never put colons (:) inside {{ ... }}. For default values, use {{ var or 'default' }} instead of {{ var:default }}.
+15. Ensure all template files render without any Jinja TemplateSyntaxError in Flask.
+16. **Important** : Strictly use the brief/checks to define all visible content, features, and UX.
+
+--- OUTPUT REQUIREMENT ---
+Output ONLY the full code for app.py—no markdown, code fences, sample input/output, or explanations. All code must be fully runnable and free of syntax/indentation errors.
+
+=== JOB DATA ===
+""", """\
+--- OUTPUT DIRECTORY ---
+{{ output_dir }}/
+
+--BRIEF--
+{{ brief }}
+
+""" + _CHECKS + """
+--- ATTACHMENTS ---
+{% for att in attachments %}
+- {{ att.name }} (Preview: {{ att.url[:64] }}...)
+{% else %}
+- None
+{% endfor %}
+""")
+
+CODE_UPDATE = PromptTemplate("code_update", """\
+TASK: Update ONLY the feature logic of the PREVIOUS app.py given under JOB DATA at the end, based on the revised brief and functional checks given there.
+Keep ALL other code—structure, attachments/data.json handling, export/static/dual-mode routines, and file naming—exactly as-is.
+Change or add ONLY the code necessary to fulfill the new logic/routes/output per the updated requirements.
+Do NOT modify headers, comments, initialization, dual-mode switches, export routines, or static file patterns unless mandated by the new brief/checks.
+If using Flask, retain all existing routing/app setup and update only route logic as required.
+Preserve all import statements, file IO, and static export mechanisms unless core logic changes require updates.
+All code must use standard Python 3 indentation (4 spaces per level, no tabs), be free of syntax/indentation errors, and be ready to run without modification.
+All new requirements must be reflected in app logic, view output, or site content as needed.
+Preserve dependencies, attachment decoding, and dual-mode support from previous version.
+
+--- OUTPUT REQUIREMENT ---
+Output ONLY the new, full code for app.py (with core logic updated for the new round, all else untouched). Do NOT include markdown, code fences, or explanations. Output must be fully runnable and free of syntax/indentation errors.
+
+=== JOB DATA ===
+""", """\
+--UPDATED BRIEF--
+{{ brief }}
+
+""" + _CHECKS + """
+--PREVIOUS APP.PY CODE (START)--
+{{ app_code }}
+--PREVIOUS APP.PY CODE (END)--
+""")
+
+WORKFLOW = PromptTemplate("workflow", """\
+TASK: Generate a GitHub Actions workflow YAML (deploy.yml) to export and deploy the Flask app given under JOB DATA at the end as a static site to GitHub Pages.
+Use the app.py code under JOB DATA as the definitive reference for runtime, environment, dependencies, data handling, commands, and output structure.
+The PYTHON VERSION, DEPENDENCY FILE, INSTALL COMMAND and OUTPUT DIRECTORY to use are also given under JOB DATA.
+
+--- CRITICAL WORKFLOW REQUIREMENTS ---
+1. The workflow must ONLY be triggered by either:
+    - A push to the main branch where 'app.py' was changed (created, updated, or deleted)
+    - A manual workflow dispatch event (workflow_dispatch)
+2. Do not trigger for changes to other files.
+3. Set up the PYTHON VERSION with actions/setup-python@v4 using `cache: pip` and `cache-dependency-path:` set to the DEPENDENCY FILE
+4. Install all dependencies with exactly the INSTALL COMMAND
+5. Ensure data.json exists in repo root
+6. **CRITICAL:** Run 'python app.py --export' as defined in the reference code to generate static files to the OUTPUT DIRECTORY
+7. Upload ONLY the OUTPUT DIRECTORY using actions/upload-pages-artifact@v4. Do not use any download-pages-artifact action; only use the official upload and deploy actions.
+8. Deploy using actions/deploy-pages@v4 in a separate job
+9. Set permissions: contents: read, pages: write, id-token: write
+10. Use concurrency group 'pages-${{ github.ref }}' with cancel-in-progress: true
+11. Use TWO jobs: 'build' (export static files) and 'deploy' (deploy to pages)
+12. **SECURITY CHECK:** The first build step must scan the entire repo for secrets using Gitleaks (zricethezav/gitleaks-action@v2 or latest). If secrets are found, fail the build and do not deploy.
+
+--- EXACT STRUCTURE ---
+Job 1 'build':
+  - Checkout code (actions/checkout@v4)
+  - Setup the PYTHON VERSION (actions/setup-python@v4, pip cache keyed on the DEPENDENCY FILE)
+  - Run Gitleaks scan
+  - Install requirements from the DEPENDENCY FILE
+  - Verify data.json exists
+  - Run: python app.py --export
+  - Upload the OUTPUT DIRECTORY using actions/upload-pages-artifact@v4
+
+Job 2 'deploy':
+  - Needs: build
+  - Environment: github-pages
+  - Uses: actions/deploy-pages@v4
+
+--- OUTPUT FORMAT ---
+Output ONLY valid YAML for .github/workflows/deploy.yml.
+Use only: actions/checkout@v4, actions/setup-python@v4, actions/upload-pages-artifact@v4, actions/deploy-pages@v4.
+Do not use any download-pages-artifact step—GitHub deploy-pages will use the uploaded artifact automatically.
+Reference only the code and requirements given under JOB DATA. No markdown fences, no explanations: produce pure YAML only.
+
+=== JOB DATA ===
+""", """\
+PYTHON VERSION: {{ python_version }}
+DEPENDENCY FILE: {{ deps_file }}
+INSTALL COMMAND: pip install {{ install_flags }}-r {{ deps_file }}
+OUTPUT DIRECTORY: {{ output_dir }}/
+
+-- ORIGINAL APP BRIEF --
+{{ brief }}
+
+""" + _CHECKS + """
+----- BEGIN app.py -----
+{{ code }}
+----- END app.py -----
+""")
+
+README = PromptTemplate("readme", """\
+Write a comprehensive, user-friendly README.md for the GitHub repository named under JOB DATA at the end.
+Use the app.py code under JOB DATA as your complete source of truth for code and features, and its PROJECT SUMMARY as the summary.
+
+--- SETUP INSTRUCTIONS ---
+1. Outline all prerequisites required by the code, including Python version and external dependencies.
+2. Provide steps for installing requirements and running the app (include any data.json preparation as seen in code).
+3. Give instructions for both development (dynamic) and static export modes, and describe the --export flag if used.
+--- USAGE GUIDE ---
+Describe how to run the app, use its options/flags, and where the exported files will appear according to the real code provided.
+
+--- CODE EXPLANATION ---
+Explain the logical structure of app.py based on the code—major components, data flow, file handling, and any non-obvious routines.
+- Summarize the LICENSE and how it applies to this code.
+- For README.md, state that it is AI-generated for transparency.
+
+--- LICENSE ---
+MIT License (brief summary of permissions and limitations).
+
+--- LIVE DEMO LINK ---
+Link the GitHub Pages live site given under JOB DATA.
+
+--- AI GENERATION NOTICE ---
+End by stating that this README and the code were generated with an AI tool.
+
+=== JOB DATA ===
+""", """\
+--- PROJECT SUMMARY ---
+{{ brief }}
+
+--- START app.py ---
+{{ code }}
+--- END app.py ---
+
+REPOSITORY: {{ repo_name }}
+LIVE SITE: [GitHub Pages live site](https://{{ github_user }}.github.io/{{ repo_name }}/)
+""")
+
+REQUIREMENTS = PromptTemplate("requirements", """\
+For the code snippet given under JOB DATA at the end, please gather and provide the requirements.txt content.
+Do not include built-in Python modules.
+List each package name and the required version (if known); otherwise, latest is fine.
+Output requirements.txt as plain text only—do not use code fences, markdown, or add any explanations.
+
+=== JOB DATA ===
+""", """\
+{{ code }}
+""")
+
+LICENSE = PromptTemplate("license", """\
+Based on FUNCTIONAL REQUIREMENTS & CHECK about license in the previous chat, create a license file. If no license check mentioned, create MIT license as default.
+Output license as plain text only—do not use code fences, markdown, or add any explanations.
+""", "")
+
+TEMPLATES = {t.name: t for t in (CODE_BUILD, CODE_UPDATE, WORKFLOW, README, REQUIREMENTS, LICENSE)}
+
+
+def render(name, **data):
+    return TEMPLATES[name].render(**data)
+
+
+def version(name):
+    return TEMPLATES[name].version
+
+
+def versions():
+    """Version of every template, e.g. for /metrics and cache keys."""
+    return {name: t.version for name, t in TEMPLATES.items()}
+
+
+def usage_tokens(usage):
+    """
+    (prompt tokens, of which served from the provider's prompt cache) from
+    an OpenAI-style `usage` dict or a Gemini `usage_metadata` object;
+    (0, 0) when the provider reported no usage.
+    """
+    if not usage:
+        return 0, 0
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details") or {}
+        return usage.get("prompt_tokens") or 0, details.get("cached_tokens") or 0
+    return (getattr(usage, "prompt_token_count", None) or 0,
+            getattr(usage, "cached_content_token_count", None) or 0)
@@ -0,0 +1,78 @@
+"""
+Near-duplicate detection for task briefs.
+
+Briefs and checks are reduced to MinHash signatures over character
+shingles, so the Jaccard similarity of two tasks can be estimated from a
+few dozen integers without any network call. The pipeline keeps one
+signature per successful generation in the job store and, for a round-1
+job whose brief is close enough to an earlier one, starts from that
+earlier app.py instead of generating from scratch.
+"""
+import hashlib
+import random
+import re
+
+
+NUM_PERM = 64
+SHINGLE_SIZE = 5
+# Checks are mostly boilerplate ("Repo has MIT license") shared by unrelated
+# tasks, so they count for less than the brief.
+BRIEF_WEIGHT = 0.75
+
+_PRIME = (1 << 61) - 1
+# Seeded so signatures stay comparable across processes and restarts.
+_rng = random.Random(20240917)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME))
+                 for _ in range(NUM_PERM)]
+
+
+def normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    text = normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _hash(shingle):
+    digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def minhash(text):
+    """MinHash signature (NUM_PERM ints) of the text's shingle set."""
+    hashes = [_hash(s) for s in shingles(text)]
+    if not hashes:
+        return [_PRIME] * NUM_PERM
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def jaccard(sig_a, sig_b):
+    """Estimated Jaccard similarity of the sets behind two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def signature(brief, checks=None):
+    return {"brief": minhash(brief), "checks": minhash("\n".join(checks or []))}
+
+
+def score(sig_a, sig_b):
+    """Weighted brief/checks similarity of two task signatures, 0 to 1."""
+    return (BRIEF_WEIGHT * jaccard(sig_a["brief"], sig_b["brief"])
+            + (1 - BRIEF_WEIGHT) * jaccard(sig_a["checks"], sig_b["checks"]))
+
+
+def closest(sig, candidates):
+    """
+    Returns (score, candidate) for the candidate dict whose "signature" is
+    most similar to `sig`, or (0.0, None) if there are none.
+    """
+    best, best_score = None, 0.0
+    for candidate in candidates:
+        value = score(sig, candidate["signature"])
+        if value > best_score:
+            best, best_score = candidate, value
+    return best_score, best
@@ -0,0 +1,12 @@
+#!/bin/sh
+# Production entry point: supervised job-executor processes plus a
+# multi-worker gunicorn web tier that only handles intake.
+set -e
+
+python app.py worker --processes "${WORKER_PROCESSES:-2}" &
+
+exec gunicorn app:app \
+    --bind "0.0.0.0:${PORT:-7860}" \
+    --workers "${WEB_CONCURRENCY:-2}" \
+    --threads "${WEB_THREADS:-4}" \
+    --timeout 60
@@ -0,0 +1,48 @@
+import types
+
+import pytest
+
+import app
+import jobs
+from jobs import JobStore
+
+
+class Clock:
+    """Stands in for time.time() in jobs.py; advanced by hand."""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobs, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    """Flask test client on `store`, with no background workers."""
+    monkeypatch.setattr(app, "_job_store", store)
+    monkeypatch.setattr(app, "_workers_started", True)
+    monkeypatch.setattr(app, "GOOGLE_FORM_SECRET", "s3cret")
+    return app.app.test_client()
+
+
+def request(task, round_num=1, nonce="n1", email="a@example.com", **fields):
+    req = {"task": task, "round": round_num, "nonce": nonce, "email": email,
+           "brief": "brief", "secret": "s3cret"}
+    req.update(fields)
+    return req
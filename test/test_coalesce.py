@@ -0,0 +1,40 @@
+"""
+Coalescing and supersession of a task's queued revisions (JobStore plus
+app.latest_revisions): whatever order the jobs reach the worker in, the
+newest revision of each round is the one that gets built.
+"""
+import app
+from conftest import request as make_request
+
+
+def request(round_num, brief, nonce):
+    return make_request("t1", round_num, nonce, brief=brief)
+
+
+def test_queued_revisions_coalesce_to_newest(store):
+    store.enqueue(request(1, "OLD", "n1"))
+    store.enqueue(request(1, "NEW", "n2"))
+    store.enqueue(request(2, "R2", "n3"))
+    job = store.claim("w1")
+    assert job["payload"]["brief"] == "OLD"
+    assert [r["brief"] for r in job["revisions"]] == ["OLD", "NEW", "R2"]
+    rounds = app.latest_revisions(job["revisions"])
+    assert [r["brief"] for r in rounds] == ["NEW", "R2"]
+
+
+def test_superseded_job_does_not_win_over_newer(store):
+    old_id, _ = store.enqueue(request(1, "OLD", "n1"))
+    assert store.claim("w1")["id"] == old_id
+    new_id, _ = store.enqueue(request(1, "NEW", "n2"))
+    assert store.superseded_by(old_id) == new_id
+    store.supersede(old_id, new_id)
+
+    job = store.claim("w2")
+    assert job["id"] == new_id
+    assert [m["brief"] for m in job["merged"]] == ["OLD"]
+    assert [r["brief"] for r in job["revisions"]] == ["OLD", "NEW"]
+    rounds = app.latest_revisions(job["revisions"])
+    assert [r["brief"] for r in rounds] == ["NEW"]
+
+    assert store.finish(new_id, "done", result={"ok": True}, worker="w2")
+    assert store.get(old_id)["status"] == "done"
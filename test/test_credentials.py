@@ -0,0 +1,114 @@
+"""
+Credential pools (credentials.py): cooldowns after failed calls, lease
+choice by load per remaining quota, and the sticky GitHub account of a task.
+"""
+import types
+
+import pytest
+
+import app
+import credentials
+from credentials import Credential, CredentialPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(credentials, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def pool(*secrets):
+    return CredentialPool("aipipe", [Credential("aipipe", s) for s in secrets])
+
+
+def cooling_for(cred, clock):
+    return cred.cooldown_until - clock.now
+
+
+def test_rate_limit_cools_down_for_retry_after(clock):
+    p = pool("a")
+    cred = p.credentials[0]
+    p.report(cred, status=429, retry_after="42")
+    assert cooling_for(cred, clock) == 42
+    other = pool("b")
+    other.report(other.credentials[0], status=429)
+    assert cooling_for(other.credentials[0], clock) == credentials.RATE_LIMIT_COOLDOWN
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_rejected_credential_cools_down_ten_minutes(clock, status):
+    p = pool("a")
+    cred = p.credentials[0]
+    p.report(cred, status=status)
+    assert cooling_for(cred, clock) == 600 == credentials.AUTH_COOLDOWN
+
+
+def test_errors_back_off_exponentially_from_five_seconds(clock):
+    p = pool("a")
+    cred = p.credentials[0]
+    waits = []
+    for outcome in [{"status": 502}, {"error": True}, {"status": 500}, {"error": True}]:
+        p.report(cred, **outcome)
+        waits.append(cooling_for(cred, clock))
+        clock.now = cred.cooldown_until  # Next failure after the cooldown.
+    assert waits == [5, 10, 20, 40]
+    for _ in range(10):
+        p.report(cred, error=True)
+    assert cooling_for(cred, clock) == credentials.MAX_ERROR_COOLDOWN
+    p.report(cred, status=200)
+    assert cred.failures == 0
+
+
+def test_cooling_credentials_are_skipped_until_all_are(clock):
+    p = pool("a", "b")
+    a, b = p.credentials
+    p.report(a, status=429, retry_after="30")
+    assert p.select() is b
+    p.report(b, status=429, retry_after="60")
+    assert p.select() is a  # Recovers first.
+    clock.now += 31
+    assert p.select() is a
+
+
+def test_lease_picks_lowest_load_per_remaining_quota(clock):
+    p = pool("a", "b", "c")
+    a, b, c = p.credentials
+    a.remaining, b.remaining, c.remaining = 1.0, 0.2, 0.5
+    # Scores are (in flight + 1) / remaining: a 1, b 5, c 2.
+    with p.lease() as first:
+        assert first is a
+        # a is now at 2, tied with c; the tie goes to the less used c.
+        with p.lease() as second:
+            assert second is c
+    # Load seen in other processes counts too.
+    assert p.select(loads={a.label: 5}) is c
+    assert a.in_flight == 0
+
+
+@pytest.fixture
+def github_accounts(monkeypatch, store):
+    """Configures GITHUB_ACCOUNTS and returns a function to change it."""
+    def configure(value):
+        monkeypatch.setenv("GITHUB_ACCOUNTS", value)
+        monkeypatch.setattr(app, "_github_pool", credentials.github_from_env())
+    monkeypatch.setattr(app, "_job_store", store)
+    return configure
+
+
+def test_task_keeps_its_first_github_account(github_accounts, store):
+    github_accounts("alice:tok-a,bob:tok-b")
+    first = app.github_account_for("t1", "t1", 1)
+    # Load on the first account no longer moves the task.
+    first.in_flight = 10
+    assert app.github_account_for("t1", "t1", 2).label == first.label
+    assert store.task_account("t1") == first.label
+    assert app.github_account_for("t2", "t2", 1).label != first.label
+
+
+def test_removed_account_fails_later_rounds(github_accounts):
+    github_accounts("alice:tok-a")
+    assert app.github_account_for("t1", "t1", 1).label == "alice"
+    github_accounts("bob:tok-b")
+    with pytest.raises(RuntimeError, match="alice"):
+        app.github_account_for("t1", "t1", 2)
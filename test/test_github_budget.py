@@ -0,0 +1,122 @@
+"""
+GitHub budgets (github_budget.py): sharing an account's limits among the
+live worker processes, and how rate-limited answers pause and retry calls.
+Requests go to a stub transport; time is a hand-driven clock.
+"""
+import types
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import github_budget
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(github_budget, "time", types.SimpleNamespace(
+        time=clock.time, monotonic=clock.time, sleep=clock.sleep))
+    monkeypatch.setattr(github_budget, "_budgets", {})
+    monkeypatch.setattr(github_budget, "_processes", 1)
+    return clock
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """Answers queued (status, headers) pairs, then 200s; records requests."""
+    class Transport:
+        answers = []
+        sent = []
+
+    def send(adapter, request, **kwargs):
+        Transport.sent.append((request.method, request.url))
+        status, headers = Transport.answers.pop(0) if Transport.answers else (200, {})
+        resp = requests.Response()
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(headers)
+        resp._content = b"{}"
+        resp.request = request
+        resp.url = request.url
+        return resp
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", send)
+    return Transport
+
+
+@pytest.fixture
+def session(transport):
+    s = requests.Session()
+    s.mount("https://", github_budget.BudgetAdapter())
+    s.headers["Authorization"] = "token tok"
+    return s
+
+
+def test_limits_are_shared_among_live_processes(clock):
+    budget = github_budget.budget_for("tok")
+    github_budget.set_processes(4)
+    core, write = budget.buckets["core"], budget.buckets["write"]
+    assert write.per_second == pytest.approx(github_budget.GITHUB_WRITES_PER_MINUTE / 60 / 4)
+    assert write.capacity == pytest.approx(github_budget.GITHUB_WRITES_PER_MINUTE / 4)
+    assert write.min_interval == pytest.approx(github_budget.GITHUB_WRITE_INTERVAL * 4)
+    assert core.per_second == pytest.approx(github_budget.DEFAULT_PRIMARY_LIMIT / 3600 / 4)
+    # Budgets created later start from the same share.
+    later = github_budget.budget_for("other").buckets["write"]
+    assert later.min_interval == pytest.approx(github_budget.GITHUB_WRITE_INTERVAL * 4)
+
+    github_budget.set_processes(1)
+    assert write.per_second == pytest.approx(github_budget.GITHUB_WRITES_PER_MINUTE / 60)
+    assert write.min_interval == pytest.approx(github_budget.GITHUB_WRITE_INTERVAL)
+
+
+def test_writes_are_spaced_by_process_share(clock, session):
+    github_budget.set_processes(3)
+    session.post("https://api.github.com/repos/u/r/git/trees")
+    session.post("https://api.github.com/repos/u/r/git/trees")
+    assert clock.slept == pytest.approx(3 * github_budget.GITHUB_WRITE_INTERVAL)
+
+
+def test_secondary_limit_pauses_only_writes_and_retries(clock, session, transport):
+    transport.answers = [(429, {"Retry-After": "30"})]
+    resp = session.post("https://api.github.com/repos/u/r/git/trees")
+    assert resp.status_code == 200
+    assert len(transport.sent) == 2
+    assert clock.slept >= 30
+    budget = github_budget.budget_for("tok")
+    assert budget.throttled == 1
+    # The pause was on the write bucket; reads were never held back.
+    assert budget.buckets["core"].paused_until == 0.0
+    assert budget.buckets["write"].paused_until > 0.0
+
+
+def test_exhausted_primary_limit_pauses_reads_until_reset(clock, session, transport):
+    reset = int(clock.now) + 60
+    transport.answers = [(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Limit": "5000",
+                                "X-RateLimit-Reset": str(reset)})]
+    resp = session.get("https://api.github.com/repos/u/r")
+    assert resp.status_code == 200
+    assert len(transport.sent) == 2
+    assert clock.now >= reset
+    budget = github_budget.budget_for("tok")
+    assert budget.buckets["write"].paused_until == 0.0
+
+
+def test_wait_beyond_max_rate_wait_fails_the_call(clock, session, transport):
+    wait = github_budget.GITHUB_MAX_RATE_WAIT + 100
+    transport.answers = [(429, {"Retry-After": str(wait)})]
+    resp = session.post("https://api.github.com/repos/u/r/git/trees")
+    assert resp.status_code == 429
+    assert len(transport.sent) == 1
+    assert clock.slept == 0
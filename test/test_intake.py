@@ -0,0 +1,93 @@
+"""
+Idempotent intake on (task, round, nonce): resubmissions attach to the
+earlier job or replay its result until IDEMPOTENCY_TTL_SECONDS, and the
+queue refuses work beyond its maximum depth.
+"""
+import threading
+
+import pytest
+
+import app
+import jobs
+from conftest import request
+from jobs import JobStore, QueueFull
+
+
+def submit(client, req):
+    resp = client.post("/api-endpoint", json=req)
+    return resp.status_code, resp.get_json()
+
+
+def test_duplicate_of_queued_job_attaches(client):
+    _, first = submit(client, request("t1"))
+    status, again = submit(client, request("t1"))
+    assert status == 200
+    assert again["job_id"] == first["job_id"]
+    assert again["duplicate"] is True
+    assert first["duplicate"] is False
+
+
+def test_duplicate_of_running_job_attaches(client, store):
+    _, first = submit(client, request("t1"))
+    store.claim("w1")
+    _, again = submit(client, request("t1"))
+    assert again["job_id"] == first["job_id"]
+    assert again["duplicate"] is True
+
+
+def test_duplicate_of_completed_job_replays_result(client, store, monkeypatch):
+    replayed = []
+    done = threading.Event()
+
+    def replay(req, result):
+        replayed.append(result)
+        done.set()
+    monkeypatch.setattr(app, "replay_evaluation", replay)
+    _, first = submit(client, request("t1"))
+    store.claim("w1")
+    result = {"repo_url": "https://github.com/u/t1", "commit_sha": "abc123",
+              "pages_url": "https://u.github.io/t1/"}
+    store.finish(first["job_id"], "done", result=result)
+
+    _, again = submit(client, request("t1"))
+    assert again["status"] == "completed"
+    assert again["duplicate"] is True
+    assert again["job_id"] == first["job_id"]
+    assert again["commit_sha"] == "abc123"
+    assert again["pages_url"] == "https://u.github.io/t1/"
+    assert done.wait(5)  # The callback is replayed on a background thread.
+    assert replayed[0]["commit_sha"] == "abc123"
+
+
+def test_failed_job_can_be_resubmitted(client, store):
+    _, first = submit(client, request("t1"))
+    store.claim("w1")
+    store.finish(first["job_id"], "failed", error="boom")
+    _, again = submit(client, request("t1"))
+    assert again["job_id"] != first["job_id"]
+    assert again["duplicate"] is False
+
+
+def test_records_expire_after_ttl(store, clock):
+    job_id, _ = store.enqueue(request("t1"))
+    clock.advance(jobs.IDEMPOTENCY_TTL_SECONDS - 1)
+    same_id, existing = store.enqueue(request("t1"))
+    assert same_id == job_id and existing["id"] == job_id
+    clock.advance(2)
+    new_id, existing = store.enqueue(request("t1"))
+    assert existing is None
+    assert new_id != job_id
+
+
+def test_queue_full_at_max_depth(client, tmp_path, monkeypatch):
+    small = JobStore(str(tmp_path / "small.sqlite3"), max_depth=2)
+    monkeypatch.setattr(app, "_job_store", small)
+    assert submit(client, request("t1"))[0] == 200
+    assert submit(client, request("t2"))[0] == 200
+    status, body = submit(client, request("t3"))
+    assert status == 503
+    assert "full" in body["error"].lower()
+    with pytest.raises(QueueFull):
+        small.enqueue(request("t4"))
+    # Duplicates of queued jobs still attach when the queue is full.
+    assert submit(client, request("t1"))[1]["duplicate"] is True
@@ -0,0 +1,46 @@
+"""Failing a pipeline early when its background GitHub provisioning fails."""
+from concurrent.futures import Future
+
+import pytest
+
+import app
+
+
+def failed(exc):
+    future = Future()
+    future.set_exception(exc)
+    return future
+
+
+def test_checkpoint_raises_provisioning_error_and_cancels_prep():
+    pending = Future()
+    token = app._provisioning.set((failed(RuntimeError("Bad credentials")), [pending]))
+    try:
+        with pytest.raises(RuntimeError, match="Bad credentials"):
+            app.checkpoint()
+    finally:
+        app._provisioning.reset(token)
+    assert pending.cancelled()
+
+
+def test_llm_call_is_not_made_after_provisioning_failed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "get_llm_pool", lambda: calls.append(1))
+    token = app._provisioning.set((failed(RuntimeError("repo create failed")), []))
+    try:
+        with pytest.raises(RuntimeError, match="repo create failed"):
+            app.llm_generate_file("prompt")
+    finally:
+        app._provisioning.reset(token)
+    assert calls == []
+
+
+def test_checkpoint_passes_while_provisioning_runs_or_succeeded():
+    running, done = Future(), Future()
+    done.set_result("repo")
+    for future in (running, done):
+        token = app._provisioning.set((future, []))
+        try:
+            app.checkpoint()
+        finally:
+            app._provisioning.reset(token)
@@ -0,0 +1,66 @@
+"""
+Earliest-deadline-first scheduling across task lanes, the fair-share penalty
+per submitter, its decay as a job waits, and the projected start returned on
+intake. SLAs are the defaults: round 1 900 s, round 2 600 s.
+"""
+import pytest
+
+import jobs
+from conftest import request
+
+
+@pytest.fixture(autouse=True)
+def defaults(monkeypatch):
+    monkeypatch.setattr(jobs, "ROUND_SLA_SECONDS", {1: 900.0, 2: 600.0, "*": 600.0})
+    monkeypatch.setattr(jobs, "FAIR_SHARE_PENALTY", 300.0)
+    monkeypatch.setattr(jobs, "AGING_WEIGHT", 0.5)
+
+
+def order(store):
+    return [row["task"] for row in store._priority_order(store._conn(), jobs.time.time())]
+
+
+def test_earliest_deadline_first_across_rounds(store, clock):
+    store.enqueue(request("r1", 1, email="a@example.com"))  # deadline 900
+    clock.advance(100)
+    store.enqueue(request("r2", 2, email="b@example.com"))  # deadline 700
+    clock.advance(100)
+    store.enqueue(request("late", 1, email="c@example.com"))  # deadline 1100
+    assert order(store) == ["r2", "r1", "late"]
+    assert store.claim("w1")["task"] == "r2"
+
+
+def test_fair_share_penalty_across_submitters(store, clock):
+    store.enqueue(request("a1", email="alice@example.com"))
+    clock.advance(1)
+    store.enqueue(request("a2", email="alice@example.com"))
+    clock.advance(1)
+    store.enqueue(request("b1", email="bob@example.com"))
+    # a2 is alice's second job: 300 s behind its deadline, so bob's goes first.
+    assert order(store) == ["a1", "b1", "a2"]
+
+
+def test_waiting_job_overtakes_newer_job_of_other_submitter(store, clock):
+    store.enqueue(request("busy", email="alice@example.com"))
+    store.claim("w1")  # Alice now has a job running.
+    store.enqueue(request("alice", email="alice@example.com"))  # 900 + 300
+    clock.advance(100)
+    store.enqueue(request("bob", email="bob@example.com"))  # 1000
+    assert order(store) == ["bob", "alice"]
+    clock.advance(400)  # Alice waited 500 s: 250 s of her penalty are gone.
+    assert order(store) == ["alice", "bob"]
+    assert store.claim("w2")["task"] == "alice"
+
+
+def test_projected_start_in_acknowledgment(client, store):
+    first = client.post("/api-endpoint", json=request("t1")).get_json()
+    assert first["status"] == "acknowledged"
+    assert first["projected_start_in"] == 0
+    # One worker slot, taken by the first job: the next waits one job.
+    second = client.post("/api-endpoint", json=request("t2", email="b@example.com")).get_json()
+    assert second["projected_start_in"] == pytest.approx(jobs.DEFAULT_JOB_SECONDS, abs=2)
+    # Round 2 of t1 is not runnable before its round 1 and queues behind
+    # both runnable jobs.
+    lane = client.post("/api-endpoint", json=request("t1", 2, nonce="n2")).get_json()
+    assert lane["projected_start_in"] == pytest.approx(2 * jobs.DEFAULT_JOB_SECONDS, abs=2)
+    assert store.projected_start(lane["job_id"]) is not None
@@ -0,0 +1,53 @@
+"""Sampled span profiling (tracing.TRACE_PROFILE_RATE)."""
+import threading
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def profile_everything(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "TRACE_PROFILE_RATE", 1.0)
+    monkeypatch.setattr(tracing, "TRACE_PROFILE_DIR", str(tmp_path))
+
+
+def test_nested_span_is_not_profiled_over_outer():
+    with tracing.start_trace("job"):
+        with tracing.span("outer", profile=True) as outer:
+            with tracing.span("inner", profile=True) as inner:
+                sum(range(1000))
+            sum(range(1000))
+    assert "profile.path" in outer.attributes
+    assert "profile.path" not in inner.attributes
+    assert not tracing._profiling
+
+
+def test_concurrent_spans_profile_one_at_a_time():
+    inside = threading.Barrier(2)  # Both spans are open at the same time.
+    spans = []
+
+    def work():
+        with tracing.start_trace("job"):
+            with tracing.span("stage", profile=True) as s:
+                spans.append(s)
+                inside.wait(5)
+    threads = [threading.Thread(target=work) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum("profile.path" in s.attributes for s in spans) == 1
+
+
+def test_profiler_errors_do_not_reach_traced_code(monkeypatch):
+    class Broken:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+    monkeypatch.setattr(tracing.cProfile, "Profile", Broken)
+    with tracing.start_trace("job"):
+        with tracing.span("stage", profile=True) as s:
+            pass
+    assert "profile.path" not in s.attributes
+    assert s.status_code != tracing.STATUS_ERROR
+    assert not tracing._profiling
@@ -0,0 +1,27 @@
+"""Acceptance of LLM-generated deploy workflows (app.validate_workflow)."""
+import app
+
+
+def test_template_is_accepted():
+    for deps_file in ("requirements.lock", "requirements.txt"):
+        assert app.validate_workflow(app.render_workflow_template(deps_file), deps_file) == []
+
+
+def test_cache_must_be_keyed_on_the_installed_file():
+    workflow = app.render_workflow_template("requirements.lock").replace(
+        "cache-dependency-path: requirements.lock", "cache-dependency-path: requirements.txt")
+    assert app.validate_workflow(workflow, "requirements.lock") == [
+        "pip cache keyed on requirements.lock"]
+
+
+def test_quoted_cache_path_is_accepted():
+    workflow = app.render_workflow_template("requirements.lock").replace(
+        "cache-dependency-path: requirements.lock", 'cache-dependency-path: "requirements.lock"')
+    assert app.validate_workflow(workflow, "requirements.lock") == []
+
+
+def test_lock_install_must_check_hashes():
+    workflow = app.render_workflow_template("requirements.lock").replace(
+        "--require-hashes ", "")
+    assert app.validate_workflow(workflow, "requirements.lock") == [
+        "hash-checked install from requirements.lock"]
@@ -0,0 +1,336 @@
+"""
+Per-job tracing for the request pipeline.
+
+Each `process_request` run opens a root span with `start_trace`; pipeline
+stages and outbound calls open child spans with `span` or the `traced`
+decorator. When the root span ends the whole trace is handed to the
+configured exporters as an OTLP/JSON `ExportTraceServiceRequest`. Span
+listeners see every span as it starts and ends, for live progress reporting.
+Work handed to a thread pool with `submit` stays part of the caller's trace.
+
+Environment:
+    TRACE_EXPORT: File path (one JSON trace per line) or http(s) URL of an
+        OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces.
+    TRACE_PROFILE_RATE: Fraction (0-1) of profiled spans that run under
+        cProfile. Defaults to 0 (off). One span is profiled at a time per
+        process; spans starting meanwhile, nested or on other threads, are
+        not sampled.
+    TRACE_PROFILE_DIR: Where sampled .prof files are written.
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "tds-project1"
+TRACE_EXPORT = os.getenv("TRACE_EXPORT")
+TRACE_PROFILE_RATE = float(os.getenv("TRACE_PROFILE_RATE", "0"))
+TRACE_PROFILE_DIR = os.getenv(
+    "TRACE_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "tds-profiles"))
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_exporters = []
+_listeners = []
+_export_lock = threading.Lock()
+# Only one cProfile profiler may run at a time: a nested one stops the outer
+# one when it is disabled, and Python 3.12+ refuses to enable a second one.
+_profile_lock = threading.Lock()
+_profiling = False
+
+
+def _attr_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace:
+    """Collects the finished spans of one job."""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.root = None
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span_data):
+        with self.lock:
+            self.spans.append(span_data)
+
+
+class Span:
+    def __init__(self, trace, name, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status_code = STATUS_OK
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status_code = STATUS_ERROR
+        self.status_message = str(message)[:500]
+
+    @property
+    def duration(self):
+        """Span duration in seconds (up to now if still open)."""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        self.trace.add(self.to_otlp())
+
+    def to_otlp(self):
+        data = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _attr_value(v)}
+                           for k, v in self.attributes.items()],
+            "status": {"code": self.status_code, "message": self.status_message},
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        return data
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_attribute(key, value):
+    """Sets an attribute on the active span, if any."""
+    active = _current_span.get()
+    if active is not None:
+        active.set_attribute(key, value)
+
+
+def add_exporter(exporter):
+    """Registers a callable receiving each finished trace as an OTLP dict."""
+    with _export_lock:
+        _exporters.append(exporter)
+
+
+def remove_exporter(exporter):
+    with _export_lock:
+        if exporter in _exporters:
+            _exporters.remove(exporter)
+
+
+def add_span_listener(listener):
+    """
+    Registers a callable invoked as `listener(event, span)` with event
+    "start" or "end" for every span of every trace.
+    """
+    with _export_lock:
+        _listeners.append(listener)
+
+
+def remove_span_listener(listener):
+    with _export_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def _notify(event, span_obj):
+    with _export_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(event, span_obj)
+        except Exception as e:
+            logger.warning(f"Span listener {listener!r} failed: {e}")
+
+
+def to_otlp_request(trace):
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": _attr_value(SERVICE_NAME)},
+                {"key": "process.pid", "value": _attr_value(os.getpid())},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": sorted(trace.spans, key=lambda s: int(s["startTimeUnixNano"])),
+            }],
+        }]
+    }
+
+
+def summarize(otlp):
+    """
+    Reduces an exported trace to (root attributes, {span name: seconds}),
+    summing spans that share a name. The root span is reported as "job".
+    """
+    attributes, durations = {}, {}
+    for data in otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]:
+        seconds = (int(data["endTimeUnixNano"]) - int(data["startTimeUnixNano"])) / 1e9
+        if "parentSpanId" not in data:
+            attributes = {a["key"]: next(iter(a["value"].values()))
+                          for a in data["attributes"]}
+            durations["job"] = seconds
+        else:
+            durations[data["name"]] = durations.get(data["name"], 0.0) + seconds
+    return attributes, durations
+
+
+def _export_to_target(payload):
+    if not TRACE_EXPORT:
+        return
+    try:
+        if TRACE_EXPORT.startswith(("http://", "https://")):
+            requests.post(TRACE_EXPORT, json=payload, timeout=5)
+        else:
+            with _export_lock, open(TRACE_EXPORT, "a") as f:
+                f.write(json.dumps(payload) + "\n")
+    except Exception as e:
+        logger.warning(f"Trace export to {TRACE_EXPORT} failed: {e}")
+
+
+def _export(trace):
+    payload = to_otlp_request(trace)
+    _export_to_target(payload)
+    with _export_lock:
+        exporters = list(_exporters)
+    for exporter in exporters:
+        try:
+            exporter(payload)
+        except Exception as e:
+            logger.warning(f"Trace exporter {exporter!r} failed: {e}")
+
+
+def _start_profile():
+    """Starts a profiler unless one is already running; never raises."""
+    global _profiling
+    with _profile_lock:
+        if _profiling:
+            return None
+        _profiling = True
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    except Exception as e:
+        logger.warning(f"Could not start the span profiler: {e}")
+        with _profile_lock:
+            _profiling = False
+        return None
+
+
+def _stop_profile(profiler, span_obj):
+    """Stops the profiler and saves its stats with the span; never raises."""
+    global _profiling
+    try:
+        profiler.disable()
+        os.makedirs(TRACE_PROFILE_DIR, exist_ok=True)
+        path = os.path.join(
+            TRACE_PROFILE_DIR, f"{span_obj.trace.trace_id}-{span_obj.span_id}.prof")
+        profiler.dump_stats(path)
+        span_obj.set_attribute("profile.path", path)
+    except Exception as e:
+        logger.warning(f"Could not save the profile of span {span_obj.name}: {e}")
+    finally:
+        with _profile_lock:
+            _profiling = False
+
+
+@contextmanager
+def _activate(span_obj, profile):
+    token = _current_span.set(span_obj)
+    _notify("start", span_obj)
+    profiler = None
+    if profile and TRACE_PROFILE_RATE and random.random() < TRACE_PROFILE_RATE:
+        profiler = _start_profile()
+    try:
+        yield span_obj
+    except BaseException as e:
+        span_obj.set_error(e)
+        raise
+    finally:
+        if profiler is not None:
+            _stop_profile(profiler, span_obj)
+        _current_span.reset(token)
+        span_obj.end()
+        _notify("end", span_obj)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """Opens the root span of a new trace and exports it when it closes."""
+    trace = Trace()
+    root = trace.root = Span(trace, name, attributes=attributes)
+    try:
+        with _activate(root, profile=False):
+            yield root
+    finally:
+        _export(trace)
+
+
+@contextmanager
+def span(name, kind=SPAN_KIND_INTERNAL, profile=False, **attributes):
+    """
+    Opens a child span of the active span. Outside of a trace this is a no-op
+    that yields None.
+
+    Args:
+        name (str): Span name, e.g. the pipeline function being timed.
+        kind (int): SPAN_KIND_INTERNAL or SPAN_KIND_CLIENT for outbound calls.
+        profile (bool): Sample this span under cProfile (see TRACE_PROFILE_RATE).
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(Span(parent.trace, name, parent, kind, attributes), profile) as child:
+        yield child
+
+
+def traced(name=None, kind=SPAN_KIND_INTERNAL, profile=False):
+    """Decorator running the wrapped function inside a child span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__, kind=kind, profile=profile):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Submits `fn` to an executor inside a copy of the caller's context, so
+    spans it opens nest under the span active at submission.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)